@@ -7,7 +7,7 @@ import pathlib
 sys.path.append(str(pathlib.Path(__file__).parent.parent))
 
 from main.AI import AI
-from main.utils import Logger, estimate_tokens
+from main.utils import Logger
 import traceback
 
 colorama.init()
@@ -54,8 +54,8 @@ async def main():
         print(f"Retrieving memory for {query}")
 
     @ai.event(ai.event_bus.GARBAGE_COLLECTOR)
-    def gc(path, **_):
-        print(f"Garbage collector cleaning: {path}")
+    def gc(paths, **_):
+        print(f"Garbage collector cleaned {len(paths)} file(s): {', '.join(paths[:3])}{' ...' if len(paths) > 3 else ''}")
     
     @ai.event(ai.event_bus.ROUTING_ROLE)
     def route(role, **_):
@@ -169,10 +169,9 @@ async def main():
                     print(response, end="", flush=True)
             print()
             print()
-            words = await ai.context_manager.get_conversation(ai.last_cid)
-            words = [c["content"] for c in await words.get_context()]
-            words = estimate_tokens(" ".join(words))
-            print(f"Estimated total tokens: {round(words)}")
+            convo = await ai.context_manager.get_conversation(ai.last_cid)
+            await convo.flush_queue()
+            print(f"Estimated total tokens: {round(convo.tokens.total)}")
             print()
 
         except KeyboardInterrupt:
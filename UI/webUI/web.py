@@ -11,7 +11,7 @@ import random
 import traceback
 
 from main.AI import AI
-from main.utils import Logger, estimate_tokens
+from main.utils import Logger
 from main.configs import USERNAME, DEFAULT_PROMPT, CHAOS_PROMPT, RAG_MIN_SCORE
 
 app = Quart(__name__)
@@ -79,9 +79,7 @@ async def chat_view(cid):
         chat_summary = await chat.get_summary()
         chat_facts = await chat.get_facts()
         chats = await ai.context_manager.list_conversations()
-        words = [c["content"] for c in await chat.get_context()]
-        words = " ".join(words)
-        est = round(estimate_tokens(words))
+        est = round(chat.tokens.total)
         c = {
             "greeting": "",
             "name": USERNAME, 
@@ -169,6 +167,14 @@ async def settings():
 
     return await render_template('full_details.html', **config_state)
 
+@app.route('/api/search')
+async def search_api():
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 20, type=int)
+    if not query:
+        return jsonify([])
+    return jsonify(await ai.context_manager.search(query, min(max(limit, 1), 100), request.args.get('cid')))
+
 @app.route('/api/models-status')
 async def models_status_api():
     async def event_generator():
@@ -0,0 +1,112 @@
+'''
+`main.RAG.chunking.chunk` against the previous implementation, which re-joined the whole buffer to count tokens for every unit.
+With a real tokenizer the old cost grows with the number of units per chunk (so with `limit`), because every unit re-tokenizes
+the joined buffer; the new one counts each unit once and stays linear in the input size. A regex word-piece tokenizer stands in
+for a real one so the script has no extra dependencies; `tiktoken` is used as well when installed.
+
+    python benchmarks/bench_chunking.py [max_mb]
+'''
+import pathlib
+import random
+import re
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.RAG.chunking import chunk, make_token_counter
+from main.utils import estimate_tokens
+
+SENTENCE_SEP = r"(?<=[.!?])\s+"
+
+PIECE_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+def wordpiece_count(text: str) -> int:
+    return len(PIECE_RE.findall(text))
+
+def old_chunk(text:str, limit=700, overlap_size= 1, count = estimate_tokens) -> list[str]:
+    text = re.sub(r'Reprint \d{4}-\d{2}', '', text)
+
+    if count(text) <= limit:
+        return [text.strip()]
+
+    chunks = []
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
+
+    if len(paragraphs) <= 1:
+        sentences = re.split(SENTENCE_SEP, text)
+        if len(sentences) <= 1:
+            words = text.split()
+            step = max(1, int(limit / 1.3))
+            return [" ".join(words[i:i+step]) for i in range(0, len(words), step)]
+        unit = sentences
+    else:
+        unit = paragraphs
+
+    buffer = []
+    for u in unit:
+        if count(u) > limit:
+            if buffer:
+                chunks.append('\n\n'.join(buffer))
+                buffer = []
+            chunks.extend(old_chunk(u, limit, overlap_size, count))
+        elif count(" ".join(buffer) + u) <= limit:
+            buffer.append(u)
+        else:
+            chunks.append('\n\n'.join(buffer))
+            overlap = buffer[-overlap_size:] if len(buffer) >= overlap_size else []
+            buffer = overlap + [u]
+
+    if buffer:
+        chunks.append('\n\n'.join(buffer))
+    return chunks
+
+WORDS = "the of model cache prompt token index vector query memory server stream summary chunk embed".split()
+
+def make_text(size: int, seed = 0) -> str:
+    '''Short paragraphs of short sentences, so every chunk packs many units.'''
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < size:
+        sentences = [" ".join(rng.choices(WORDS, k=rng.randint(4, 14))).capitalize() + "." for _ in range(rng.randint(1, 4))]
+        p = " ".join(sentences)
+        paragraphs.append(p)
+        total += len(p) + 2
+    return "\n\n".join(paragraphs)
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - start, out
+
+def main(max_mb = 8):
+    sizes = [mb for mb in (1, 2, 4, 8, 16) if mb <= max_mb]
+
+    counters = [("character estimate", estimate_tokens, None), ("word-piece tokenizer", wordpiece_count, wordpiece_count)]
+    try:
+        tok = make_token_counter("tiktoken:cl100k_base")
+        counters.append(("tiktoken cl100k_base", lambda s: int(tok(s)), "tiktoken:cl100k_base"))
+    except ImportError:
+        pass
+
+    for label, old_count, tokenizer in counters:
+        print(f"{label}: scaling with input size (limit 700)")
+        print(f"{'MB':>4} {'old s':>8} {'new s':>8} {'old s/MB':>9} {'new s/MB':>9} {'chunks':>8}")
+        for mb in sizes:
+            text = make_text(mb * 1024 * 1024)
+            t_old, _ = timed(old_chunk, text, count=old_count)
+            t_new, out = timed(chunk, text, tokenizer=tokenizer)
+            print(f"{mb:>4} {t_old:8.2f} {t_new:8.2f} {t_old / mb:9.3f} {t_new / mb:9.3f} {len(out):>8}")
+
+        print(f"\n{label}: scaling with chunk size (units per chunk), 1 MB")
+        text = make_text(1024 * 1024)
+        print(f"{'limit':>6} {'old s':>8} {'new s':>8}")
+        for limit in (250, 700, 2000, 6000):
+            t_old, _ = timed(old_chunk, text, limit, count=old_count)
+            t_new, _ = timed(chunk, text, limit, tokenizer=tokenizer)
+            print(f"{limit:>6} {t_old:8.2f} {t_new:8.2f}")
+        print()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
@@ -0,0 +1,69 @@
+'''
+Throughput of `main.RAG.embedding.embed` against a local stand-in for Ollama's `/api/embed`: one batch at a time
+(the old loop) versus the pipelined, adaptive version. The stand-in charges a fixed cost per request plus a cost per input,
+and runs at most `parallel` requests at once like `OLLAMA_NUM_PARALLEL`.
+
+    python benchmarks/bench_embed_pipeline.py [inputs] [request_ms] [item_ms] [parallel]
+'''
+import asyncio
+import pathlib
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from aiohttp import web
+from main.models.models_profile import RemoteEmbedder
+from main.RAG.embedding import embed
+from main.http_pool import ConnectionPool
+
+PORT = 18600
+DIM = 768
+
+def make_app(request_ms, item_ms, parallel):
+    gate = asyncio.Semaphore(parallel)
+    async def handler(request):
+        body = await request.json()
+        inputs = body["input"]
+        async with gate:
+            await asyncio.sleep((request_ms + item_ms * len(inputs)) / 1000)
+        return web.json_response({"model": body["model"], "embeddings": [[float(len(t) % 7)] * DIM for t in inputs]})
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app.router.add_post("/api/embed", handler)
+    return app
+
+async def run(label, embedder, texts, **kwargs):
+    start = time.perf_counter()
+    vectors = await embed(embedder, texts, auto_warm_up=False, use_cache=False, **kwargs)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts)
+    print(f"{label:<36} {elapsed:7.2f}s  {len(texts) / elapsed:8.1f} inputs/s")
+    return elapsed
+
+async def main(inputs = 2000, request_ms = 40.0, item_ms = 2.0, parallel = 2):
+    runner = web.AppRunner(make_app(request_ms, item_ms, parallel))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    embedder = RemoteEmbedder("embedding", "bench", "bench-embed", PORT, None, None)
+    embedder.warmed_up = True
+    embedder.resource_manager.create_session()
+    texts = [f"chunk {i} " * 40 for i in range(inputs)]
+
+    print(f"{inputs} inputs, {request_ms}ms per request + {item_ms}ms per input, server parallelism {parallel}\n")
+    try:
+        base = await run("sequential, batch 16 (old loop)", embedder, texts, chunk_size=16, max_in_flight=1, adaptive=False)
+        for in_flight in (2, 4, 8):
+            t = await run(f"pipelined, {in_flight} in flight, fixed 16", embedder, texts, chunk_size=16, max_in_flight=in_flight, adaptive=False)
+            print(f"{'':<36} speedup x{base / t:.2f}")
+        for in_flight in (2, 4):
+            t = await run(f"pipelined, {in_flight} in flight, adaptive", embedder, texts, chunk_size=16, max_in_flight=in_flight)
+            print(f"{'':<36} speedup x{base / t:.2f}")
+    finally:
+        await ConnectionPool.close()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if len(args) > 0 else 2000, float(args[1]) if len(args) > 1 else 40.0,
+                     float(args[2]) if len(args) > 2 else 2.0, int(args[3]) if len(args) > 3 else 2))
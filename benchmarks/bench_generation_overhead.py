@@ -0,0 +1,111 @@
+'''
+CPU time `AI.create_generation` spends on the conversation before the request reaches the backend, for a conversation of
+`messages` messages: `Conversation.get_states`, `ContextManager.context_resolver` and `AI.get_prompted_query` ("prepare"),
+plus `ContextManager.add_and_maintain` saving the finished turn ("commit"). No model is involved.
+
+    python benchmarks/bench_generation_overhead.py [messages] [rounds] [--against <git ref>]
+
+`--against` also runs the same measurement on `<ref>`'s `main/` package (extracted with `git archive`), for a before / after
+comparison, e.g. `--against HEAD~1`.
+'''
+import asyncio
+import json
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+def make_messages(n: int, seed = 0):
+    rng = random.Random(seed)
+    words = "model context token cache prompt stream memory summary vector query tool result image file".split()
+    text = lambda k: " ".join(rng.choices(words, k=k))
+    messages = []
+    for i in range(n):
+        if i % 2 == 0:
+            m = {"role": "user", "content": text(rng.randint(20, 120))}
+        else:
+            m = {"role": "assistant", "content": text(rng.randint(80, 400)), "thinking": text(rng.randint(40, 200)),
+                 "tool_calls": [{"function": {"name": "search", "arguments": {"query": text(4)}}}] if i % 10 == 1 else []}
+        m.update({"edited": False, "gen_idx": 0, "msg_id": str(uuid.uuid4()), "msg_idx": i + 1})
+        messages.append(m)
+    return messages
+
+async def measure(messages: int, rounds: int):
+    from main.context_manager import ContextManager
+    from main.AI import AI
+
+    directory = tempfile.mkdtemp(prefix="bench_ctx_")
+    cid = str(uuid.uuid4())
+    with open(os.path.join(directory, f"{cid}.json"), "w") as f:
+        json.dump({"summary": "An earlier summary. " * 20, "facts": ["fact"] * 10, "key_decisions": [], "open_threads": [],
+                   "conversation": make_messages(messages), "id": cid, "name": "bench", "last_used": 1}, f)
+
+    cm = ContextManager(directory, None, summary_max_tokens=10 ** 9)
+    await cm.init()
+    ai = types.SimpleNamespace(RAG_Manager=None)
+    try:
+        from main.prompt_builder import PromptBuilder
+        ai.prompt_builder = PromptBuilder(1000)
+    except ImportError:
+        pass # trees from before the prompt builder
+    prepare, commit = [], []
+
+    for i in range(rounds):
+        start = time.process_time()
+        c = cm.conversations[cid]
+        meta = await c.get_states()
+        context = await cm.context_resolver(cid)
+        context, query = await AI.get_prompted_query(ai, meta, context, False, f"question {i}") # type:ignore
+        prepare.append(time.process_time() - start)
+
+        turn = [{"role": "user", "content": query}, {"role": "assistant", "content": f"answer {i} " * 50, "thinking": "", "tool_calls": []}]
+        start = time.process_time()
+        await cm.add_and_maintain(cid, turn)
+        commit.append(time.process_time() - start)
+
+    return {"prepare_ms": statistics.median(prepare) * 1000, "commit_ms": statistics.median(commit) * 1000}
+
+def run_tree(tree: pathlib.Path, messages: int, rounds: int):
+    out = subprocess.run([sys.executable, __file__, str(messages), str(rounds), "--tree", str(tree)], capture_output=True, text=True,
+                         cwd=tempfile.gettempdir())
+    lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+    if out.returncode != 0 or not lines:
+        raise RuntimeError(out.stderr[-2000:])
+    return json.loads(lines[-1])
+
+def main():
+    args = sys.argv[1:]
+    if "--tree" in args:
+        tree = args[args.index("--tree") + 1]
+        sys.path.insert(0, tree)
+        os.chdir(tempfile.mkdtemp(prefix="bench_cwd_"))
+        print(json.dumps(asyncio.run(measure(int(args[0]), int(args[1])))))
+        return
+
+    against = args[args.index("--against") + 1] if "--against" in args else None
+    args = [a for a in args if not a.startswith("--") and a != against]
+    messages = int(args[0]) if len(args) > 0 else 500
+    rounds = int(args[1]) if len(args) > 1 else 20
+
+    results = {"current": run_tree(ROOT, messages, rounds)}
+    if against:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = subprocess.run(["git", "-C", str(ROOT), "archive", against, "main"], capture_output=True, check=True).stdout
+            subprocess.run(["tar", "-x", "-C", tmp], input=archive, check=True)
+            results[against] = run_tree(pathlib.Path(tmp), messages, rounds)
+
+    print(f"{messages} messages, median of {rounds} rounds (CPU time)\n")
+    print(f"{'tree':<12} {'prepare ms':>11} {'commit ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['prepare_ms']:11.2f} {r['commit_ms']:10.2f}")
+
+if __name__ == "__main__":
+    main()
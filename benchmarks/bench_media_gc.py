@@ -0,0 +1,78 @@
+'''
+Media cache GC cost as the cache grows: one pass of the previous collector (list both folders, load every indexed path, select
+the candidates, sum the sizes) versus the ticks of the incremental `GarbageCollector`. Each cache has 256 expired files to
+collect; the rest are recent. The tick cost should stay flat while the full pass grows with the number of files.
+
+    python benchmarks/bench_media_gc.py [largest cache size]
+'''
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.cache_manager import CacheManager
+from main.media_index import MediaEntry
+
+EXPIRED = 256
+
+def populate(cm: CacheManager, n: int):
+    now = time.time()
+    entries = []
+    for i in range(n):
+        path = os.path.join(cm.images_dir, f"{i:064x}.png")
+        with open(path, "wb") as f:
+            f.write(b"x")
+        age = 30 * 86400 if i < EXPIRED else 60
+        entries.append(MediaEntry(f"{i:064x}", path, 1, now - age, "image"))
+    conn = cm.index._connect()
+    with conn:
+        conn.executemany("INSERT INTO media VALUES (?, ?, ?, ?, ?, ?)", entries)
+    cm.index._total = n
+
+def full_pass(cm: CacheManager):
+    '''What each run of the collector did before, without the deletes.'''
+    t = time.perf_counter()
+    files = [os.path.join(cm.images_dir, f) for f in os.listdir(cm.images_dir)] + \
+            [os.path.join(cm.videos_dir, f) for f in os.listdir(cm.videos_dir)]
+    indexed = cm.index.paths()
+    orphans = [p for p in files if p not in indexed]
+    now = time.time()
+    cm.index.unused_since(now - cm.gc.time_limit)
+    cm.index.unused_since(now - cm.gc.time_limit // 2, cm.gc.size_threshold_in_mbs)
+    conn = cm.index._connect()
+    conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()
+    assert not orphans
+    return time.perf_counter() - t
+
+async def measure(n: int):
+    with tempfile.TemporaryDirectory() as d:
+        cm = CacheManager(7 * 86400, 50, 1800, d)
+        populate(cm, n)
+        before = full_pass(cm)
+        ticks = []
+        cm.gc._scan = cm.gc._walk()
+        while True:
+            more = await cm.gc.tick(cm.index)
+            ticks.append(cm.gc.stats["last_tick_seconds"])
+            if not more:
+                break
+        stats = cm.get_gc_stats()
+        left = cm.index.count()
+        await asyncio.to_thread(cm.gc.close)
+        cm.index.close()
+    assert stats["deleted"] == EXPIRED and left == n - EXPIRED
+    return before, ticks
+
+async def main(largest = 100_000):
+    sizes = [s for s in (1_000, 10_000, 100_000) if s <= largest] or [largest]
+    print(f"{'files':>8} {'full pass':>11} {'ticks':>6} {'mean tick':>10} {'max tick':>10}")
+    for n in sizes:
+        before, ticks = await measure(n)
+        print(f"{n:>8} {before * 1e3:8.1f} ms {len(ticks):>6} {sum(ticks) / len(ticks) * 1e3:7.2f} ms {max(ticks) * 1e3:7.2f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
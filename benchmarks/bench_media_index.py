@@ -0,0 +1,66 @@
+'''
+Cost of recording one cache hit as the media cache grows: rewriting the whole `index.json` (what `CacheManager.save` did after
+every cached file and GC run) versus one row update in `main.media_index.MediaIndex`, plus picking the GC candidates.
+
+    python benchmarks/bench_media_index.py [entries]
+'''
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.media_index import MediaIndex, MediaEntry
+
+def make_entries(n: int, seed = 0):
+    rng = random.Random(seed)
+    now = time.time()
+    return [MediaEntry(f"{i:064x}", f"cache/images/{i:064x}.png", rng.randint(10_000, 5_000_000), now - rng.uniform(0, 30 * 86400),
+                       "image") for i in range(n)]
+
+def per_op(fn, repeat):
+    t = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - t) / repeat
+
+def main(n = 20_000):
+    entries = make_entries(n)
+    with tempfile.TemporaryDirectory() as d:
+        legacy = {e.hash: {"path": e.path, "last_used": e.last_used, "size": e.size} for e in entries}
+        json_path = os.path.join(d, "index.json")
+
+        def json_touch(i):
+            legacy[entries[i % n].hash]["last_used"] = time.time()
+            with open(json_path, "w") as f:
+                f.write(json.dumps(legacy, indent=2))
+
+        index = MediaIndex(os.path.join(d, "index.sqlite"))
+        for e in entries:
+            index.put(e)
+
+        json_t = per_op(json_touch, 20)
+        row_t = per_op(lambda i: index.touch([entries[i % n].hash], time.time()), 500)
+
+        week = time.time() - 28 * 86400
+        t = time.perf_counter()
+        by_dict = [h for h, v in legacy.items() if v["last_used"] < week]
+        dict_scan = time.perf_counter() - t
+        t = time.perf_counter()
+        by_index = index.unused_since(week)
+        query = time.perf_counter() - t
+        assert len(by_index) <= len(by_dict)
+        index.close()
+
+    print(f"{n} cached files\n")
+    print(f"{'touch one entry':<28} {'index.json':>12} {'sqlite':>10}")
+    print(f"{'':<28} {json_t * 1e3:9.2f} ms {row_t * 1e3:7.3f} ms   x{json_t / row_t:.0f}")
+    print(f"\nGC candidates (unused > 28 days): dict scan {dict_scan * 1e3:.2f} ms, indexed query {query * 1e3:.2f} ms "
+          f"({len(by_index)} rows)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
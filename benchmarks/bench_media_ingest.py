@@ -0,0 +1,67 @@
+'''
+Putting a large video into the media cache with each `main.media_ingest` strategy, against the `shutil.copy` that `cache_file`
+used before. The source is written once up front, so copies read it from the page cache (drop the caches between runs to see
+cold reads). Strategies the filesystem doesn't support are reported as such; reflinks need btrfs / XFS / bcachefs.
+
+    python benchmarks/bench_media_ingest.py [GB] [directory]
+'''
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main import media_ingest
+
+def make_file(path: str, size: int):
+    block = os.urandom(64 * 1024 * 1024)
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            n = min(len(block), size - written)
+            f.write(block[:n])
+            written += n
+
+def timed(name, fn, src, dst):
+    t = time.perf_counter()
+    ok = fn(src, dst)
+    took = time.perf_counter() - t
+    if ok is False:
+        return name, None
+    if os.path.exists(dst):
+        os.remove(dst)
+    return name, took
+
+def main(gb = 2.0, directory = None):
+    size = int(gb * 1024 ** 3)
+    with tempfile.TemporaryDirectory(dir=directory) as d:
+        src = os.path.join(d, "video.mp4")
+        make_file(src, size)
+        dst = os.path.join(d, "cached.mp4")
+
+        runs = [
+            timed("shutil.copy (before)", shutil.copy, src, dst),
+            timed("plain copy", media_ingest.copy, src, dst),
+            timed("sendfile", media_ingest.sendfile, src, dst),
+            timed("copy_file_range", media_ingest.copy_file_range, src, dst),
+            timed("hardlink", media_ingest.hardlink, src, dst),
+            timed("reflink", media_ingest.reflink, src, dst),
+        ]
+        t = time.perf_counter()
+        chosen = media_ingest.ingest(src, dst, "never")
+        ingest_took = time.perf_counter() - t
+
+    print(f"{size / 1024 ** 3:.1f} GB file\n")
+    print(f"{'strategy':<22} {'seconds':>9} {'GB/s':>8}")
+    for name, took in runs:
+        if took is None:
+            print(f"{name:<22} {'unsupported':>18}")
+        else:
+            print(f"{name:<22} {took:9.3f} {size / 1024 ** 3 / max(took, 1e-9):8.1f}")
+    print(f"\ningest() picked {chosen} (hardlinks off): {ingest_took:.3f} s")
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2.0, sys.argv[2] if len(sys.argv) > 2 else None)
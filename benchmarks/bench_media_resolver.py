@@ -0,0 +1,65 @@
+'''
+`CacheManager.file_path_resolver` latency on repeated multi-MB media: hashing on every call (memo disabled, what the resolver did
+before) versus the stat-keyed digest memo, and the first resolve of a new file (hash, miss, copy). Every installed hash
+algorithm is measured.
+
+    python benchmarks/bench_media_resolver.py [files] [repeats]
+'''
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.cache_manager import CacheManager
+from main.media_hash import FileHasher, blake3, xxhash
+
+SIZES_MB = (2, 8, 32)
+
+def make_files(directory: str, n: int):
+    paths = []
+    for i in range(n):
+        size = SIZES_MB[i % len(SIZES_MB)] * 1024 * 1024
+        p = os.path.join(directory, f"media_{i}.mp4")
+        with open(p, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(p)
+    return paths
+
+async def run(algorithm: str, memo_size: int, paths, repeats: int):
+    with tempfile.TemporaryDirectory() as cache:
+        cm = CacheManager(3600, 1024, 1800, cache)
+        cm.hasher = FileHasher(algorithm, memo_size)
+
+        t = time.perf_counter()
+        for p in paths:
+            await cm.file_path_resolver(p)
+        first = (time.perf_counter() - t) / len(paths)
+
+        t = time.perf_counter()
+        for _ in range(repeats):
+            for p in paths:
+                await cm.file_path_resolver(p)
+        repeat = (time.perf_counter() - t) / (repeats * len(paths))
+        stats = cm.get_hash_stats()
+        await cm.shutdown()
+    return first, repeat, stats
+
+async def main(n = 6, repeats = 20):
+    algorithms = ["sha256"] + (["blake3"] if blake3 else []) + (["xxh3"] if xxhash else [])
+    with tempfile.TemporaryDirectory() as d:
+        paths = make_files(d, n)
+        print(f"{n} files of {', '.join(f'{s} MB' for s in SIZES_MB)}, {repeats} repeated resolves each\n")
+        print(f"{'algorithm':<10} {'memo':<6} {'first resolve':>14} {'repeat resolve':>15} {'MB hashed':>10}")
+        for algorithm in algorithms:
+            for memo_size in (0, 4096):
+                first, repeat, stats = await run(algorithm, memo_size, paths, repeats)
+                print(f"{algorithm:<10} {'on' if memo_size else 'off':<6} {first * 1e3:11.2f} ms {repeat * 1e3:12.3f} ms "
+                      f"{stats['bytes_hashed'] / 1024 ** 2:10.0f}")
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
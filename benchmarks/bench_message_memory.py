@@ -0,0 +1,62 @@
+'''
+Memory per 10k conversation messages, measured with tracemalloc: plain message dicts (what `Conversation.messages` held before)
+versus `main.messages.Message` records. The message texts are allocated up front and shared by both, so the numbers are the
+per-message overhead alone (containers, ids, nested values).
+
+    python benchmarks/bench_message_memory.py [messages]
+'''
+import gc
+import pathlib
+import random
+import sys
+import tracemalloc
+import uuid
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.messages import freeze_all
+
+def make_texts(n: int, seed = 0):
+    rng = random.Random(seed)
+    words = "model context token cache prompt stream memory summary vector query tool result".split()
+    return [" ".join(rng.choices(words, k=rng.randint(20, 200))) for _ in range(n)]
+
+def make_dicts(texts):
+    messages = []
+    for i, text in enumerate(texts):
+        if i % 2 == 0:
+            m = {"role": "user", "content": text}
+        else:
+            m = {"role": "assistant", "content": text, "thinking": "", "tool_calls": []}
+        m.update({"edited": False, "gen_idx": 0, "msg_id": str(uuid.uuid4()), "msg_idx": i + 1})
+        messages.append(m)
+    return messages
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, value
+
+def main(n = 10_000):
+    texts = make_texts(n)
+    text_bytes = sum(sys.getsizeof(t) for t in texts)
+
+    dict_bytes, dicts = measure(lambda: make_dicts(texts))
+    # the records are built from the same dicts, so measure their own allocations only
+    record_bytes, records = measure(lambda: freeze_all(dicts))
+    assert list(records) == dicts
+
+    per = 10_000 / n
+    print(f"{n} messages, texts {text_bytes / 1024 ** 2:.1f} MB (shared, not counted)\n")
+    print(f"{'representation':<22} {'per 10k msgs':>14} {'per message':>12}")
+    print(f"{'dict':<22} {dict_bytes * per / 1024 ** 2:11.2f} MB {dict_bytes / n:10.0f} B")
+    print(f"{'Message (__slots__)':<22} {record_bytes * per / 1024 ** 2:11.2f} MB {record_bytes / n:10.0f} B")
+    print(f"\nsaving x{dict_bytes / record_bytes:.2f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
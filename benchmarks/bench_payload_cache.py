@@ -0,0 +1,68 @@
+'''
+Encoding the same cached media on every turn (what the models did before) versus reading it from the `PayloadCache`, from
+memory and from its disk spill: a multi-MB image, and a video over the 5 MB inline limit whose sampled frames are decoded and
+re-encoded to JPEG. The video is generated with PyAV (noise, so it stays big).
+
+    python benchmarks/bench_payload_cache.py [turns] [image MBs]
+'''
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import av
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.media_hash import FileHasher
+from main.media_payloads import PayloadCache
+from main.models.base_model import InputHandler
+
+STRIDE = 10
+
+def make_video(path: str, frames = 120):
+    with av.open(path, "w") as container:
+        stream = container.add_stream("mpeg4", rate=24)
+        stream.width, stream.height, stream.pix_fmt = 640, 360, "yuv420p"
+        stream.bit_rate = 20_000_000
+        for _ in range(frames):
+            img = np.random.randint(0, 256, (360, 640, 3), dtype=np.uint8)
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(img, format="rgb24")))
+        container.mux(stream.encode())
+
+async def turns(handler: InputHandler, image: str, video: str, n: int):
+    t = time.perf_counter()
+    for _ in range(n):
+        await handler.cached(image, "model", "image", lambda: handler.encode_image(image))
+    image_took = (time.perf_counter() - t) / n
+    t = time.perf_counter()
+    for _ in range(n):
+        await handler.cached(video, "model", "video", lambda: handler.encode_frames_from_vid(video, False, STRIDE), STRIDE, "JPEG")
+    return image_took, (time.perf_counter() - t) / n
+
+async def main(n = 10, image_mbs = 8):
+    with tempfile.TemporaryDirectory() as d:
+        image = os.path.join(d, "image.png")
+        with open(image, "wb") as f:
+            f.write(os.urandom(image_mbs * 1024 ** 2))
+        video = os.path.join(d, "video.mp4")
+        make_video(video)
+        print(f"{image_mbs} MB image, {os.path.getsize(video) / 1024 ** 2:.1f} MB video (every {STRIDE}th frame), {n} turns\n")
+
+        hasher = FileHasher()
+        runs = [("encode every turn", InputHandler()),
+                ("payload cache, memory", InputHandler(PayloadCache(os.path.join(d, "mem"), hasher))),
+                ("payload cache, disk", InputHandler(PayloadCache(os.path.join(d, "disk"), hasher, max_memory_MBs=0)))]
+        print(f"{'':<24} {'image / turn':>13} {'video / turn':>13}")
+        for name, handler in runs:
+            if handler.payloads is not None:
+                await turns(handler, image, video, 1) # first turn encodes
+            image_took, video_took = await turns(handler, image, video, n)
+            print(f"{name:<24} {image_took * 1e3:10.2f} ms {video_took * 1e3:10.2f} ms")
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,79 @@
+'''
+Conversation search latency: the FTS5 index of `main.conversation_index` versus reading every saved conversation and scanning
+its messages (what finding a message took without the index). The corpus is spread over 200 conversations on disk.
+
+    python benchmarks/bench_search.py [messages]
+'''
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.conversation_index import ConversationIndex, search_rows
+from main.tokens import message_text
+
+CONVERSATIONS = 200
+QUERIES = ["ollama keep_alive", "embedding cache", "vector", "summary token", "stream"]
+
+def make_corpus(n: int, seed = 0):
+    rng = random.Random(seed)
+    words = ("model context token cache prompt stream memory summary vector query tool result ollama keep_alive embedding "
+             "window budget chunk index").split()
+    filler = [f"w{i}" for i in range(2000)]
+    convos = {f"c{i}": [] for i in range(CONVERSATIONS)}
+    for i in range(n):
+        cid = f"c{i % CONVERSATIONS}"
+        text = " ".join(rng.choice(words) if rng.random() < 0.05 else rng.choice(filler) for _ in range(rng.randint(20, 120)))
+        convos[cid].append({"role": "user" if i % 2 == 0 else "assistant", "content": text, "msg_idx": len(convos[cid]) + 1})
+    return convos
+
+def scan(directory: str, query: str, limit = 20):
+    words = query.lower().split()
+    hits = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            messages = json.load(f)["conversation"]
+        for m in messages:
+            text = message_text(m).lower()
+            if all(w in text for w in words):
+                hits.append((name, m["msg_idx"]))
+    return hits[:limit]
+
+def timed(fn, repeat = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def main(n = 50_000):
+    convos = make_corpus(n)
+    with tempfile.TemporaryDirectory() as d:
+        for cid, messages in convos.items():
+            with open(os.path.join(d, f"{cid}.json"), "w", encoding="utf-8") as f:
+                json.dump({"conversation": messages}, f)
+
+        index = ConversationIndex(os.path.join(d, "conversations.sqlite"))
+        t = time.perf_counter()
+        for cid, messages in convos.items():
+            index.index_messages(cid, search_rows(messages), len(messages), replace=True)
+        build = time.perf_counter() - t
+
+        print(f"{n} messages in {CONVERSATIONS} conversations, index built in {build:.2f} s\n")
+        print(f"{'query':<22} {'scan':>10} {'fts':>10} {'speedup':>9}")
+        for q in QUERIES:
+            s = timed(lambda: scan(d, q), repeat=2)
+            f = timed(lambda: index.search(q))
+            print(f"{q:<22} {s * 1e3:7.1f} ms {f * 1e3:7.2f} ms {s / f:8.0f}x")
+        index.close()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,105 @@
+'''
+Replays synthetic 10k token Ollama (NDJSON) and OpenRouter (SSE) streams through the old `str` buffer loop
+and `main.stream_decoder.StreamDecoder`, and prints the per token overhead of each.
+
+    python benchmarks/bench_stream_decoder.py [tokens] [chunk_size]
+'''
+import json
+import pathlib
+import sys
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent))
+
+from main.stream_decoder import StreamDecoder, NDJSON, SSE, _json_loads, orjson
+
+def ollama_stream(tokens):
+    lines = []
+    for i in range(tokens):
+        lines.append(json.dumps({"model": "bench", "created_at": "2025-01-01T00:00:00Z", "message": {"role": "assistant", "content": f" tok{i}"}, "done": False}))
+    lines.append(json.dumps({"model": "bench", "message": {"role": "assistant", "content": ""}, "done": True, "eval_count": tokens}))
+    return ("\n".join(lines) + "\n").encode()
+
+def openrouter_stream(tokens):
+    lines = [": OPENROUTER PROCESSING", ""]
+    for i in range(tokens):
+        lines.append("data: " + json.dumps({"id": "gen-bench", "choices": [{"index": 0, "delta": {"role": "assistant", "content": f" tok{i}"}}]}))
+        lines.append("")
+    lines.append("data: [DONE]")
+    return ("\n".join(lines) + "\n").encode()
+
+def split(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+def old_ndjson(chunks):
+    buffer = ""
+    n = 0
+    for raw in chunks:
+        buffer += raw.decode("utf-8", errors='ignore')
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                json_line = json.loads(line)
+                json_line.get("message", {}).get("content", "")
+                n += 1
+            except json.JSONDecodeError:
+                continue
+    return n
+
+def old_sse(chunks):
+    buffer = ""
+    n = 0
+    for raw in chunks:
+        buffer += raw.decode("utf-8", errors='ignore')
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            line = line.strip()
+            if line.startswith('data: '):
+                line = line[6:]
+                if line == '[DONE]':
+                    break
+            if not line:
+                continue
+            try:
+                json_line = json.loads(line)
+                json_line['choices'][0]['delta'].get('content', "")
+                n += 1
+            except json.JSONDecodeError:
+                continue
+    return n
+
+def new(framing, loads):
+    def run(chunks):
+        decoder = StreamDecoder(framing, loads)
+        n = 0
+        for raw in chunks:
+            n += len(decoder.feed(raw))
+        return n + len(decoder.flush())
+    return run
+
+def bench(name, fn, chunks, tokens, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - t)
+    print(f"  {name:<28} {best * 1e3:8.2f} ms total  {best / tokens * 1e6:6.2f} us/token")
+
+def main():
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+
+    for label, body, old, framing in (("ollama ndjson", ollama_stream(tokens), old_ndjson, NDJSON),
+                                      ("openrouter sse", openrouter_stream(tokens), old_sse, SSE)):
+        chunks = split(body, chunk_size)
+        print(f"{label}: {tokens} tokens, {len(body) / 1024:.0f} KiB in {len(chunks)} x {chunk_size} B chunks")
+        bench("str buffer + split", old, chunks, tokens)
+        bench("StreamDecoder (json)", new(framing, _json_loads), chunks, tokens)
+        if orjson is not None:
+            bench("StreamDecoder (orjson)", new(framing, None), chunks, tokens)
+
+if __name__ == "__main__":
+    main()
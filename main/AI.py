@@ -12,9 +12,10 @@ from .backends.single_server import SingleServer
 from .backends.backend import Generation
 import inspect
 import traceback
-from copy import deepcopy
 from .events import EventBus
+from .http_pool import ConnectionPool
 from .context_manager import ContextManager
+from .prompt_builder import PromptBuilder
 from .configs import ( 
     CoT_PROMPT, 
     CHAT_PROMPT, 
@@ -27,13 +28,16 @@ from .configs import (
     EMBEDDING_MODEL_ROLE,
     RAG_MIN_SCORE,
     USERNAME,
+    WARMUP_CONCURRENCY,
+    RESIDENCY_MEMORY_BUDGET_MB,
 )
     
 class AI:
     def __init__(self, model_config_path="main/Models_config.json", context_dir="main/saves/", 
                  mode:Literal['single'] | Literal['multi'] | Literal['openrouter'] = "multi" , max_turns = 5,  absolute_max_turns = 50, use_RAG = True, memory_db_path = "./RAG_DB",
                    table_name = 'memories', summary_max_tokens = 4000, keep_tokens_after_summary = 2000, min_recent_turns = 3, cache_folder = './cache', 
-                  gc_time_limit = 259200, gc_limit_size_MBs = 50, gc_interval = 1800, embedder_auto_warm_up = True, max_memory_rag_chars = 1000, embed_chunk_size = 32):
+                  gc_time_limit = 259200, gc_limit_size_MBs = 50, gc_interval = 1800, embedder_auto_warm_up = True, max_memory_rag_chars = 1000, embed_chunk_size = 32,
+                  warmup_concurrency = WARMUP_CONCURRENCY, warmup_priority: list[str] | None = None, memory_budget_mb: int | None = RESIDENCY_MEMORY_BUDGET_MB):
         self.model_config_path = model_config_path
         self.context_dir = context_dir
         self.system_prompts = {
@@ -44,10 +48,13 @@ class AI:
             'summarizer': SUMMARIZER_PROMPT,
         }
         self.use_RAG = use_RAG
+        self.warmup_kwargs = {"warmup_concurrency": warmup_concurrency, "warmup_priority": warmup_priority}
+        self.memory_budget_mb = memory_budget_mb
         if USERNAME.strip(): self.system_prompts = {k: v + f"\n\nThe **user's username** is: {USERNAME}" for k, v in self.system_prompts.items()}
         self.default_role = 'chat'
         self.running_tasks = set()
         self.max_memory_rag_chars = max_memory_rag_chars
+        self.prompt_builder = PromptBuilder(max_memory_rag_chars)
 
         self.mode = mode.lower()
         self.backend = None
@@ -72,24 +79,28 @@ class AI:
         self.tools_regis = ToolRegistry()
         if self.use_RAG:
             from .RAG.manager import RAG_manager
-            self.RAG_Manager = RAG_manager(None, embedder_auto_warm_up, memory_db_path, table_name, embed_chunk_size)
+            self.RAG_Manager = RAG_manager(None, embedder_auto_warm_up, memory_db_path, table_name, embed_chunk_size, event_bus=self.event_bus)
         else:
             self.RAG_Manager = None
 
     def load_models(self):
         d = DEFAULT_PROMPT + (f"\n\nThe **user's username** is: {USERNAME}") if USERNAME.strip() else ""
         if self.mode == 'multi':
-            self.backend = MultiServer(self.model_config_path, self.system_prompts, d, self.event_bus)
+            self.backend = MultiServer(self.model_config_path, self.system_prompts, d, self.event_bus, memory_budget_mb=self.memory_budget_mb, **self.warmup_kwargs)
             self.backend.load()
         elif self.mode == 'single':
-            self.backend = SingleServer(self.model_config_path, self.system_prompts, d, event_bus=self.event_bus)
+            self.backend = SingleServer(self.model_config_path, self.system_prompts, d, event_bus=self.event_bus, **self.warmup_kwargs)
             self.backend.load()
         elif self.mode == 'openrouter':
-            self.backend = OpenrouterBackend(self.model_config_path, self.system_prompts, d, self.event_bus)
+            self.backend = OpenrouterBackend(self.model_config_path, self.system_prompts, d, self.event_bus, **self.warmup_kwargs)
             self.backend.load()
         else:
             raise ValueError(f"Invalid mode: {self.mode}. Please ensure the mode is 'multi' or 'single'.")
 
+        for model in self.backend.models.values():
+            if hasattr(model, "input_handler"):
+                model.input_handler.payloads = self.context_manager.cache_manager.payloads
+
     def event(self, event_name:str):
         def wrapper(func):
             self.event_bus.add_listener(event_name, func)
@@ -169,7 +180,16 @@ class AI:
             self.running_tasks.add(t)
 
         async with self.lock:
-            self.status = {"status":self.event_bus.INITIALISED, "message": ""}
+            self.status = {"status":"Waiting for models", "message": "Waiting for the remaining models to warm up..."}
+
+        readiness = await self.backend.wait_until_ready()
+        failed = [role for role, ready in readiness.items() if not ready]
+        if failed:
+            await Logger.log_async(f"Models not ready after init: {', '.join(failed)}", 'warn')
+            await self.event_bus.parallel_emit(self.event_bus.WARN, msg = f"Models not ready after init: {', '.join(failed)}")
+
+        async with self.lock:
+            self.status = {"status":self.event_bus.INITIALISED, "message": ", ".join(f"{r}: {'ready' if ok else 'failed'}" for r, ok in readiness.items())}
 
         await self.event_bus.parallel_emit(self.event_bus.INITIALISED)
                 
@@ -259,50 +279,8 @@ class AI:
         key_decisions = meta.get('key_decisions', meta.get("prev_key_decisions"))
         open_threads = meta.get('open_threads', meta.get("prev_open_threads"))
 
-        context = deepcopy(context)
-        context = context or []
-
-        f = f"""
-            The system has also generated a set of facts extracted from the previous turns. These are still lossy facts and maybe inaccurate. 
-            For reference only, use for user profile modeling.
-            <FACTS>
-                {"\n\n-".join(facts).strip()}
-            </FACTS>
-            """ if facts and "".join(facts).strip() else ''
-        
-        o = f"""
-            The system has also generated a set of open threads (unresolved or open discussion, debate, tasks, etc) extracted from the previous turns. These are still lossy and maybe inaccurate. 
-            For reference only, use for user profile modeling.
-            <OPEN_THREADS>
-                {"\n\n-".join(open_threads).strip()}
-            </OPEN_THREADS>
-            """ if open_threads and "".join(open_threads).strip() else ''
-        
-        k = f"""
-            The system has also generated a set of key decisions (decisions, commitments, willingness, etc) extracted from the previous turns. These are still lossy and maybe inaccurate. 
-            For reference only, use for user profile modeling.
-            <KEY_DECISONS>
-                {"\n\n-".join(key_decisions).strip()}
-            </KEY_DECISONS>
-            """ if key_decisions and "".join(key_decisions).strip() else ''
-       
-        if summary:
-            context.insert(0, {"role": "assistant", "content": f"""[PERSISTED MEMORY - NOT DIALogger.log_asyncUE]
-                [INTERNAL MEMORY - DO NOT REPEAT - NOT PART OF CONVERSATION]
-
-                The system generated summary of previous messages/turns. **Do NOT** treat this as the part of the conversation. For reference only. 
-                <SUMMARY>
-                    {summary}
-                </SUMMARY>
-
-                {f}
-
-                {k}
-
-                {o}
-                                           
-                THESE ARE NOT A PART OF THE CONVERSATION. THESE ARE SYSTEM GENERATED PERSISTED MEMORY
-                [END INTERNAL DATA]""".strip()}) # role:system is fatal.
+        # stable parts first (memory block, history), the volatile retrieved chunks go into the last message, see PromptBuilder
+        context = self.prompt_builder.assemble(context, summary, facts, key_decisions, open_threads)
             
         if use_memory:
             if not self.RAG_Manager:
@@ -318,35 +296,12 @@ class AI:
             if rag_results:
                 scores = [r["score"] for r in rag_results]
                 await Logger.log_async(f"RAG: {len(rag_results)} chunks, scores {min(scores):.3f}–{max(scores):.3f}, avg {sum(scores)/len(scores):.3f}", 'info')
-                current_chars = 0
-                rag_text = ""
-                for r in rag_results:
-                    score = r["score"]
-                    text = r["text"]
-                    meta = r["metadata"]
-                    if not text.strip():
-                        continue
-                    if current_chars + len(text) > self.max_memory_rag_chars:
-                        break
-                    source = meta.get('source', 'unknown') if meta else 'unknown'
-                    rag_text += f"\n\nSource: {source} | Score: {score:.3f} | {text}"
-                    current_chars += len(text)
+                rag_text = self.prompt_builder.rag_text(rag_results)
 
                 async with self.lock:
                     self.status['message'] = f'Retrieved {len(rag_results)} results'
 
-                query = f'''
-                    The system has retrieved a few *maybe* relevent user memory, saved by the system.
-                    <important>
-                    THESE ARE **NOT** PART OF THE CONVERSATION. THESE ARE SYSTEM MAINTAINED MEMORY.
-                    </important>
-                    <RETRIEVED CHUNKS>
-                    {rag_text}
-                    </RETRIEVED CHUNKS>
-                    <UserQuery>
-                    {query}
-                    </UserQuery>
-                    '''   
+                query = self.prompt_builder.query_with_memory(query, rag_text)   
                 
         return context, query
 
@@ -447,6 +402,12 @@ class AI:
         except Exception as e:
             await Logger.log_async(f"Context manager shutdown failed: {e}; {traceback.format_exc()}", 'error')
 
+        if self.RAG_Manager:
+            try:
+                await self.RAG_Manager.close()
+            except Exception as e:
+                await Logger.log_async(f"RAG manager shutdown failed: {e}; {traceback.format_exc()}", 'warn')
+
         if self.backend:
             try:
                 await self.backend.close_sessions()
@@ -458,6 +419,8 @@ class AI:
                 await Logger.log_async(f"Backend shutdown failed: {e}; {traceback.format_exc()}", 'error')
         else:
             await Logger.log_async("No backend provided! Skipping backend shutdown.", 'error')
+
+        await ConnectionPool.close()
         
         await self.event_bus.parallel_emit(self.event_bus.SHUTDOWN)
 
@@ -1,6 +1,7 @@
-from .chunking import chunk
-from .embedding import embed
+from .chunking import chunk, chunk_spans, ChunkSpan, make_token_counter
+from .embedding import embed, EmbeddingError
+from .embedding_cache import EmbeddingCache
 from .reading import read
 from .manager import RAG_manager
 
-__all__ = ['RAG_manager', 'chunk', 'embed', 'read']
\ No newline at end of file
+__all__ = ['RAG_manager', 'chunk', 'embed', 'read', 'EmbeddingCache', 'EmbeddingError', 'chunk_spans', 'ChunkSpan', 'make_token_counter']
\ No newline at end of file
@@ -1,47 +1,126 @@
 import re
-from main.utils import estimate_tokens
-
-def chunk(text:str, limit=700, overlap_size= 1) -> list[str]:
-
-    text = re.sub(r'Reprint \d{4}-\d{2}', '', text)
-
-    if estimate_tokens(text) <= limit:
-        return [text.strip()]
-
-    chunks = []
-    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
-    
-    if len(paragraphs) <= 1:
-        sentences = re.split(r"(?<!\b(?:Mr|Mrs|Dr|Prof|Sr|Jr|vs|etc)\.)(?<=[.!?])\s+", text)
-        if len(sentences) <= 1:
-            words = text.split()
-            step = max(1, int(limit / 1.3))
-            chunks = [
-                " ".join(words[i:i+step])
-                for i in range(0, len(words), step)
-            ]
-            return chunks
-        
-        unit = sentences
+from bisect import bisect_right
+from typing import Callable, NamedTuple
+from ..tokens import make_token_counter
+
+REPRINT_RE = re.compile(r'Reprint \d{4}-\d{2}')
+PARAGRAPH_SEP_RE = re.compile(r'\n\s*\n')
+# one lookbehind per abbreviation, `re` only supports fixed-width lookbehinds
+SENTENCE_SEP_RE = re.compile("".join(rf"(?<!\b{a}\.)" for a in ("Mr", "Mrs", "Dr", "Prof", "Sr", "Jr", "vs", "etc")) + r"(?<=[.!?])\s+")
+WORD_RE = re.compile(r'\S+')
+
+PARAGRAPHS = 0
+SENTENCES = 1
+WORDS = 2
+
+class ChunkSpan(NamedTuple):
+    text: str
+    start: int # character offsets into the text given to `chunk_spans`
+    end: int
+    tokens: float
+
+def _spans(pattern: re.Pattern, text: str, start: int, end: int):
+    '''Non-empty, stripped `(start, end)` spans of `text[start:end]` between matches of `pattern`.'''
+    out = []
+    pos = start
+    for m in pattern.finditer(text, start, end):
+        out.append((pos, m.start()))
+        pos = m.end()
+    out.append((pos, end))
+
+    stripped = []
+    for s, e in out:
+        while s < e and text[s].isspace(): s += 1
+        while e > s and text[e - 1].isspace(): e -= 1
+        if s < e:
+            stripped.append((s, e))
+    return stripped
+
+def _split(text: str, start: int, end: int, level: int, limit: int, count, overlap_size: int, out: list):
+    if level == PARAGRAPHS:
+        units = _spans(PARAGRAPH_SEP_RE, text, start, end)
+        if len(units) <= 1:
+            return _split(text, start, end, SENTENCES, limit, count, overlap_size, out)
+        sep = "\n\n"
+    elif level == SENTENCES:
+        units = _spans(SENTENCE_SEP_RE, text, start, end)
+        if len(units) <= 1:
+            return _split(text, start, end, WORDS, limit, count, overlap_size, out)
+        sep = "\n\n"
     else:
-        unit = paragraphs
+        words = [(m.start(), m.end()) for m in WORD_RE.finditer(text, start, end)]
+        step = max(1, int(limit / 1.3))
+        for i in range(0, len(words), step):
+            window = words[i:i + step]
+            piece = " ".join(text[s:e] for s, e in window)
+            out.append(ChunkSpan(piece, window[0][0], window[-1][1], count(piece)))
+        return
+
+    sep_cost = count(" ")
+    buffer: list[tuple[int, int, float]] = []
+    running = 0.0
 
-    buffer = []
+    def flush():
+        piece = sep.join(text[s:e] for s, e, _ in buffer)
+        out.append(ChunkSpan(piece, buffer[0][0], buffer[-1][1], running))
 
-    for u in unit:
-        if estimate_tokens(u) > limit:
+    for s, e in units:
+        tokens = count(text[s:e])
+        if round(tokens) > limit:
             if buffer:
-                chunks.append('\n\n'.join(buffer))
-                buffer = []
-            chunks.extend(chunk(u, limit, overlap_size))
-        elif estimate_tokens(" ".join(buffer) + u) <= limit:
-            buffer.append(u)
+                flush()
+                buffer, running = [], 0.0
+            _split(text, s, e, level + 1, limit, count, overlap_size, out)
+        elif round(running + (sep_cost if buffer else 0) + tokens) <= limit:
+            running += (sep_cost if buffer else 0) + tokens
+            buffer.append((s, e, tokens))
         else:
-            chunks.append('\n\n'.join(buffer))
-            overlap = buffer[-overlap_size:] if len(buffer) >= overlap_size else []
-            buffer = overlap + [u]
+            flush()
+            buffer = buffer[-overlap_size:] if overlap_size and len(buffer) >= overlap_size else []
+            buffer.append((s, e, tokens))
+            running = sum(t for _, _, t in buffer) + sep_cost * (len(buffer) - 1)
 
     if buffer:
-        chunks.append('\n\n'.join(buffer))
+        flush()
+
+def chunk_spans(text: str, limit = 700, overlap_size = 1, tokenizer = None, counter: Callable[[str], float] | None = None) -> list[ChunkSpan]:
+    '''
+    Splits `text` into chunks of at most `limit` tokens (paragraphs, then sentences, then word windows for oversized units), with
+    `overlap_size` units carried over between neighbouring chunks. Unit boundaries are found once and packed with a running token
+    count, so the cost is linear in the input. Each chunk carries its `[start, end)` character offsets into `text`.
+    '''
+    count = counter or make_token_counter(tokenizer)
+
+    removed = [(m.start(), m.end()) for m in REPRINT_RE.finditer(text)]
+    if removed:
+        clean = REPRINT_RE.sub('', text)
+        starts, shifts = [], []
+        total = 0
+        for s, e in removed:
+            total += e - s
+            starts.append(s - (total - (e - s)))
+            shifts.append(total)
+
+        def to_source(pos):
+            i = bisect_right(starts, pos) - 1
+            return pos + (shifts[i] if i >= 0 else 0)
+    else:
+        clean = text
+        to_source = None
+
+    if round(count(clean)) <= limit:
+        stripped = clean.strip()
+        if not stripped:
+            return []
+        s = len(clean) - len(clean.lstrip())
+        spans = [ChunkSpan(stripped, s, s + len(stripped), count(stripped))]
+    else:
+        spans = []
+        _split(clean, 0, len(clean), PARAGRAPHS, limit, count, overlap_size, spans)
+
+    if to_source:
+        spans = [c._replace(start=to_source(c.start), end=to_source(c.end - 1) + 1) for c in spans]
+    return spans
 
-    return chunks
\ No newline at end of file
+def chunk(text:str, limit=700, overlap_size= 1, tokenizer = None) -> list[str]:
+    return [c.text for c in chunk_spans(text, limit, overlap_size, tokenizer)]
\ No newline at end of file
@@ -1,31 +1,139 @@
 from main.models.model_instance import LocalEmbedder
 from main.models.models_profile import RemoteEmbedder
 from main.models.openrouter_model import OpenRouterEmbedder
-from main.configs import ERROR_TOKEN
+from main.configs import ERROR_TOKEN, EMBED_MAX_IN_FLIGHT, EMBED_BATCH_RETRIES, EMBED_TARGET_BATCH_SECONDS, EMBED_MAX_BATCH_SIZE
 from main.utils import Logger
+from .embedding_cache import EmbeddingCache
+import asyncio
+import time
 
-async def embed(embedder:LocalEmbedder | RemoteEmbedder | OpenRouterEmbedder, chunks:list[str], auto_warm_up = True, chunk_size = 16):
-    if auto_warm_up and not embedder.warmed_up:
-        await embedder.warm_up()
+class EmbeddingError(RuntimeError):
+    def __init__(self, message, failed: list[int]) -> None:
+        super().__init__(message)
+        self.failed = failed
 
+class BatchSizer:
+    '''
+    Picks the next batch size so one request takes about `target_seconds`, from a moving average of the measured latency per item.
+    Stays within `[min_size, max_size]` and at most doubles / halves per step.
+    '''
+    def __init__(self, initial: int, min_size = 1, max_size = EMBED_MAX_BATCH_SIZE, target_seconds = EMBED_TARGET_BATCH_SECONDS, smoothing = 0.3) -> None:
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = min(max(initial, self.min_size), self.max_size)
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.per_item: float | None = None
+
+    def observe(self, items: int, seconds: float):
+        if items <= 0:
+            return
+        sample = seconds / items
+        self.per_item = sample if self.per_item is None else (1 - self.smoothing) * self.per_item + self.smoothing * sample
+        if self.per_item > 0:
+            wanted = int(self.target_seconds / self.per_item)
+            self.size = min(max(wanted, self.size // 2, self.min_size), self.size * 2, self.max_size)
+
+async def embed(embedder:LocalEmbedder | RemoteEmbedder | OpenRouterEmbedder, chunks:list[str], auto_warm_up = True, chunk_size = 16, use_cache = True,
+                max_in_flight = EMBED_MAX_IN_FLIGHT, adaptive = True):
     if isinstance(chunks, str):
         chunks = [chunks]
     elif len(chunks) <= 1 and isinstance(chunks, (tuple, list)):
         chunks = [*chunks]
 
+    if not use_cache:
+        if auto_warm_up and not embedder.warmed_up:
+            await embedder.warm_up()
+        return await embed_pipelined(embedder, chunks, chunk_size, max_in_flight, adaptive)
+
+    embeddings = await EmbeddingCache.get_many(embedder.model_name, chunks)
+    missing = list(dict.fromkeys(c for c, e in zip(chunks, embeddings) if e is None))
+
+    if missing:
+        if auto_warm_up and not embedder.warmed_up:
+            await embedder.warm_up()
+
+        async def store(texts, vectors):
+            await EmbeddingCache.put_many(embedder.model_name, texts, vectors)
+
+        fresh = dict(zip(missing, await embed_pipelined(embedder, missing, chunk_size, max_in_flight, adaptive, on_batch=store)))
+        embeddings = [e if e is not None else fresh[c] for c, e in zip(chunks, embeddings)]
+
+    return embeddings
+
+async def _embed_once(embedder:LocalEmbedder | RemoteEmbedder | OpenRouterEmbedder, batch:list[str]):
+    embeds = await embedder.embed(batch)
+    if embeds == ERROR_TOKEN:
+        raise RuntimeError('An error occured during embedding!')
+    elif embeds is None:
+        raise RuntimeError("Embeddings not found ('None')")
+    elif len(embeds) != len(batch):
+        raise RuntimeError(f"Got {len(embeds)} embeddings for {len(batch)} inputs")
+    return embeds
+
+async def embed_pipelined(embedder:LocalEmbedder | RemoteEmbedder | OpenRouterEmbedder, chunks:list[str], chunk_size = 16, max_in_flight = EMBED_MAX_IN_FLIGHT,
+                          adaptive = True, retries = EMBED_BATCH_RETRIES, on_batch = None):
+    '''
+    Embeds `chunks` keeping up to `max_in_flight` batches in flight, returns the vectors in input order.
+
+    With `adaptive`, batch sizes start at `chunk_size` and follow the measured latency per item. A failed batch is retried on its own
+    (with backoff) and then split in halves, so one bad input only costs its own batch. `on_batch(texts, vectors)` is awaited for
+    every batch that succeeds, even if others fail, so finished work isn't lost. Raises `EmbeddingError` listing the inputs that
+    could not be embedded.
+    '''
+    n = len(chunks)
+    results: list = [None] * n
+    failed: list[int] = []
+    if adaptive:
+        sizer = BatchSizer(chunk_size, max_size=max(chunk_size, EMBED_MAX_BATCH_SIZE))
+    else:
+        sizer = BatchSizer(chunk_size, chunk_size, chunk_size)
+    semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def run(start: int, batch: list[str]):
+        for attempt in range(retries + 1):
+            try:
+                t = time.perf_counter()
+                embeds = await _embed_once(embedder, batch)
+                if adaptive: sizer.observe(len(batch), time.perf_counter() - t)
+                results[start:start + len(batch)] = embeds
+                if on_batch: await on_batch(batch, embeds)
+                return
+            except (RuntimeError, OSError, asyncio.TimeoutError) as e:
+                if attempt < retries:
+                    await Logger.log_async(f"Embedding batch {start}-{start + len(batch) - 1} failed ({e}), retrying ({attempt + 1}/{retries})...", 'warn')
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                elif len(batch) > 1:
+                    half = len(batch) // 2
+                    await Logger.log_async(f"Embedding batch {start}-{start + len(batch) - 1} keeps failing, splitting it", 'warn')
+                    await run(start, batch[:half])
+                    await run(start + half, batch[half:])
+                else:
+                    await Logger.log_async(f"Could not embed input {start}: {e}", 'error')
+                    failed.append(start)
+
+    async def guarded(start: int, batch: list[str]):
+        try:
+            await run(start, batch)
+        finally:
+            semaphore.release()
 
-    embeddings = [] 
+    tasks = []
+    pos = 0
+    try:
+        while pos < n:
+            await semaphore.acquire()
+            batch = chunks[pos:pos + sizer.size]
+            tasks.append(asyncio.create_task(guarded(pos, batch)))
+            pos += len(batch)
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
 
-    for i in range(0, len(chunks), chunk_size):
-        chunk = chunks[i : i + chunk_size]
-        embeds = await embedder.embed(chunk)
-        if embeds == ERROR_TOKEN:
-            await Logger.log_async('An error occured during embedding!', 'error')
-            raise RuntimeError
-        elif embeds is None:
-            await Logger.log_async("Embeddings not found ('None')", 'error')
-            raise RuntimeError
-        
-        embeddings.extend(embeds)
+    if failed:
+        await Logger.log_async(f'{len(failed)} of {n} inputs could not be embedded!', 'error')
+        raise EmbeddingError(f"{len(failed)} of {n} inputs could not be embedded", sorted(failed))
 
-    return embeddings
\ No newline at end of file
+    return results
\ No newline at end of file
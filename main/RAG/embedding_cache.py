@@ -0,0 +1,218 @@
+from main.configs import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MEMORY_ITEMS
+from main.utils import Logger
+from collections import OrderedDict
+from hashlib import sha256
+from array import array
+import asyncio
+import os
+import sqlite3
+import threading
+import traceback
+
+class EmbeddingCache:
+    '''
+    Process wide, content addressed embedding cache keyed by `(embedder model name, sha256(text))`.
+
+    An in-memory LRU (`max_memory_items` vectors) sits in front of a SQLite table holding the vectors as packed float32 blobs.
+    The store remembers which embedding model it was filled with: when a different model (or the same name returning vectors of a
+    different size, e.g. after a re-pull) shows up, the stale vectors are dropped instead of being mixed into the index.
+    '''
+    path: str | None = EMBEDDING_CACHE_PATH
+    max_memory_items = EMBEDDING_CACHE_MEMORY_ITEMS
+    _memory: OrderedDict[tuple[str, bytes], list[float]] = OrderedDict()
+    _conn: sqlite3.Connection | None = None
+    _lock = threading.Lock()
+    _active_model: str | None = None
+    _dims: dict[str, int] = {}
+    stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "invalidations": 0}
+
+    @classmethod
+    def configure(cls, path: str | None = None, max_memory_items: int | None = None):
+        '''`path=None` keeps the current store, pass `""` to run memory only.'''
+        with cls._lock:
+            if path is not None and path != cls.path:
+                if cls._conn is not None:
+                    cls._conn.close()
+                    cls._conn = None
+                cls.path = path or None
+                cls._active_model = None
+                cls._dims.clear()
+            if max_memory_items is not None:
+                cls.max_memory_items = max_memory_items
+                while len(cls._memory) > cls.max_memory_items:
+                    cls._memory.popitem(last=False)
+
+    @staticmethod
+    def digest(text: str) -> bytes:
+        return sha256(text.encode("utf-8", "surrogatepass")).digest()
+
+    @classmethod
+    def _connect(cls):
+        if cls._conn is not None or not cls.path:
+            return cls._conn
+        directory = os.path.dirname(cls.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(cls.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, hash BLOB NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+                     "PRIMARY KEY (model, hash)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+        cls._conn = conn
+        return conn
+
+    @classmethod
+    def _drop_model_locked(cls, keep: str | None = None, only: str | None = None):
+        if only is not None:
+            stale = [k for k in cls._memory if k[0] == only]
+        else:
+            stale = [k for k in cls._memory if k[0] != keep]
+        for k in stale:
+            del cls._memory[k]
+
+        conn = cls._connect()
+        if conn is not None:
+            if only is not None:
+                conn.execute("DELETE FROM embeddings WHERE model = ?", (only,))
+            else:
+                conn.execute("DELETE FROM embeddings WHERE model != ?", (keep,))
+            conn.commit()
+        cls.stats["invalidations"] += 1
+
+    @classmethod
+    def _activate_locked(cls, model: str):
+        if cls._active_model == model:
+            return
+        conn = cls._connect()
+        previous = cls._active_model
+        if conn is not None:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+            previous = row[0] if row else previous
+        if previous is not None and previous != model:
+            Logger.log_sync(f"Embedding model changed ({previous} -> {model}), dropping cached embeddings", 'warn')
+            cls._drop_model_locked(keep=model)
+            cls._dims.clear()
+        if conn is not None:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (model,))
+            conn.commit()
+        cls._active_model = model
+
+    @classmethod
+    def _get_many_sync(cls, model: str, keys: list[bytes]) -> list[list[float] | None]:
+        out: list[list[float] | None] = [None] * len(keys)
+        with cls._lock:
+            cls._activate_locked(model)
+            pending = {}
+            for i, key in enumerate(keys):
+                vec = cls._memory.get((model, key))
+                if vec is not None:
+                    cls._memory.move_to_end((model, key))
+                    cls.stats["memory_hits"] += 1
+                    out[i] = vec
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            conn = cls._connect()
+            if pending and conn is not None:
+                wanted = list(pending)
+                for start in range(0, len(wanted), 500):
+                    batch = wanted[start:start + 500]
+                    rows = conn.execute(f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                                        (model, *batch)).fetchall()
+                    for key, blob in rows:
+                        vec = array('f')
+                        vec.frombytes(blob)
+                        vec = vec.tolist()
+                        cls._remember(model, key, vec)
+                        for i in pending.pop(key):
+                            out[i] = vec
+                            cls.stats["disk_hits"] += 1
+
+            cls.stats["misses"] += sum(len(v) for v in pending.values())
+        return out
+
+    @classmethod
+    def _remember(cls, model: str, key: bytes, vec: list[float]):
+        cls._memory[(model, key)] = vec
+        cls._memory.move_to_end((model, key))
+        while len(cls._memory) > cls.max_memory_items:
+            cls._memory.popitem(last=False)
+
+    @classmethod
+    def _put_many_sync(cls, model: str, keys: list[bytes], vectors: list[list[float]]):
+        with cls._lock:
+            cls._activate_locked(model)
+            dims = {len(v) for v in vectors}
+            known = cls._dims.get(model)
+            conn = cls._connect()
+            if known is None and conn is not None:
+                row = conn.execute("SELECT dim FROM embeddings WHERE model = ? LIMIT 1", (model,)).fetchone()
+                known = row[0] if row else None
+            if known is not None and dims and dims != {known}:
+                Logger.log_sync(f"{model} now returns {sorted(dims)} dimensional embeddings instead of {known}, dropping cached embeddings", 'warn')
+                cls._drop_model_locked(only=model)
+            if len(dims) == 1:
+                cls._dims[model] = next(iter(dims))
+
+            for key, vec in zip(keys, vectors):
+                cls._remember(model, key, list(vec))
+            if conn is not None:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (model, hash, dim, vector) VALUES (?, ?, ?, ?)",
+                                 [(model, key, len(vec), array('f', vec).tobytes()) for key, vec in zip(keys, vectors)])
+                conn.commit()
+            cls.stats["writes"] += len(keys)
+
+    @classmethod
+    async def get_many(cls, model: str, texts: list[str]) -> list[list[float] | None]:
+        '''Cached vectors for `texts` in order, `None` where the text hasn't been embedded with `model` before.'''
+        keys = [cls.digest(t) for t in texts]
+        try:
+            return await asyncio.to_thread(cls._get_many_sync, model, keys)
+        except sqlite3.Error as e:
+            await Logger.log_async(f"Embedding cache lookup failed, embedding without it: {e}; {traceback.format_exc()}", 'warn')
+            return [None] * len(texts)
+
+    @classmethod
+    async def put_many(cls, model: str, texts: list[str], vectors: list[list[float]]):
+        keys = [cls.digest(t) for t in texts]
+        try:
+            await asyncio.to_thread(cls._put_many_sync, model, keys, vectors)
+        except sqlite3.Error as e:
+            await Logger.log_async(f"Failed to store embeddings in the cache: {e}; {traceback.format_exc()}", 'warn')
+
+    @classmethod
+    def metrics(cls):
+        lookups = cls.stats["memory_hits"] + cls.stats["disk_hits"] + cls.stats["misses"]
+        hits = cls.stats["memory_hits"] + cls.stats["disk_hits"]
+        return {
+            **cls.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_hit_rate": cls.stats["memory_hits"] / lookups if lookups else 0.0,
+            "memory_items": len(cls._memory),
+            "model": cls._active_model,
+            "path": cls.path,
+        }
+
+    @classmethod
+    async def clear(cls, model: str | None = None):
+        def _clear():
+            with cls._lock:
+                if model is None:
+                    cls._memory.clear()
+                    conn = cls._connect()
+                    if conn is not None:
+                        conn.execute("DELETE FROM embeddings")
+                        conn.commit()
+                else:
+                    cls._drop_model_locked(only=model)
+        await asyncio.to_thread(_clear)
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._conn is not None:
+                cls._conn.close()
+                cls._conn = None
+            cls._active_model = None
@@ -0,0 +1,152 @@
+from main.configs import FTS_DEBOUNCE_SECONDS, FTS_MAX_PENDING_WRITES, FTS_MAX_DELAY_SECONDS
+from main.utils import Logger
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import asyncio
+import time
+import traceback
+
+def _rebuild_fts_index(db_path: str, table_name: str):
+    '''Runs in the worker process: rebuilds the table's FTS index from the latest version and returns that version.'''
+    import lancedb
+    table = lancedb.connect(db_path).open_table(table_name)
+    table.create_fts_index("text", replace=True)
+    return table.version
+
+class FTSIndexMaintainer:
+    '''
+    Batches full-text index rebuilds for a `RAG_manager` table.
+
+    Writes only record the ids they touched. The index is rebuilt in a worker process once no write arrived for `debounce_seconds`,
+    `max_pending` ids are waiting, or the oldest pending write is `max_delay_seconds` old. Ids written while a rebuild runs stay
+    pending for the next one. `pending` is what `RAG_manager.retrieve` scans linearly until the index catches up.
+    '''
+    def __init__(self, db_path: str, table_name: str, debounce_seconds = FTS_DEBOUNCE_SECONDS, max_pending = FTS_MAX_PENDING_WRITES,
+                 max_delay_seconds = FTS_MAX_DELAY_SECONDS, use_process = True, on_rebuilt = None) -> None:
+        self.db_path = db_path
+        self.table_name = table_name
+        self.debounce_seconds = debounce_seconds
+        self.max_pending = max_pending
+        self.max_delay_seconds = max_delay_seconds
+        self.use_process = use_process
+        self.on_rebuilt = on_rebuilt
+        self.pending: dict[str, int] = {}
+        self.has_index: bool | None = None
+        self.seq = 0
+        self.built_seq = 0
+        self.first_dirty_at: float | None = None
+        self.last_write_at = 0.0
+        self.dirty = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task | None = None
+        self.executor: ProcessPoolExecutor | None = None
+        self.stats = {"writes": 0, "rebuilds": 0, "failures": 0, "last_rebuild_seconds": 0.0, "total_rebuild_seconds": 0.0}
+
+    @property
+    def is_current(self):
+        return bool(self.has_index) and self.built_seq >= self.seq
+
+    def mark(self, ids = ()):
+        '''Records a write (insert / update / delete) and schedules a rebuild. Inserted or updated ids stay `pending` until indexed.'''
+        self.seq += 1
+        for i in ids:
+            self.pending[i] = self.seq
+        self.stats["writes"] += 1
+        now = time.monotonic()
+        self.last_write_at = now
+        if self.first_dirty_at is None:
+            self.first_dirty_at = now
+        self.dirty.set()
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _wait_debounce(self):
+        while True:
+            now = time.monotonic()
+            if len(self.pending) >= self.max_pending:
+                return
+            quiet_until = self.last_write_at + self.debounce_seconds
+            cap = (self.first_dirty_at or now) + self.max_delay_seconds
+            wake = min(quiet_until, cap)
+            if now >= wake:
+                return
+            await asyncio.sleep(wake - now)
+
+    async def _run(self):
+        failures = 0
+        while True:
+            await self.dirty.wait()
+            await self._wait_debounce()
+            if await self.rebuild():
+                failures = 0
+            else:
+                failures += 1
+                await asyncio.sleep(min(60, self.debounce_seconds * 2 ** failures))
+
+    async def _execute(self):
+        loop = asyncio.get_running_loop()
+        if self.use_process:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            try:
+                return await loop.run_in_executor(self.executor, _rebuild_fts_index, self.db_path, self.table_name)
+            except BrokenProcessPool as e:
+                await Logger.log_async(f"FTS worker process died ({e}), rebuilding in a thread from now on", 'warn')
+                self.executor = None
+                self.use_process = False
+        return await asyncio.to_thread(_rebuild_fts_index, self.db_path, self.table_name)
+
+    async def rebuild(self):
+        async with self.lock:
+            self.dirty.clear()
+            self.first_dirty_at = None
+            start_seq = self.seq
+            start = time.perf_counter()
+            try:
+                version = await self._execute()
+            except Exception as e:
+                self.stats["failures"] += 1
+                self.dirty.set()
+                if self.first_dirty_at is None: self.first_dirty_at = time.monotonic()
+                await Logger.log_async(f"FTS index rebuild for '{self.table_name}' failed: {e}; {traceback.format_exc()}", 'error')
+                return False
+
+            elapsed = time.perf_counter() - start
+            self.pending = {i: s for i, s in self.pending.items() if s > start_seq}
+            self.built_seq = max(self.built_seq, start_seq)
+            self.has_index = True
+            self.stats["rebuilds"] += 1
+            self.stats["last_rebuild_seconds"] = elapsed
+            self.stats["total_rebuild_seconds"] += elapsed
+            await Logger.log_async(f"Rebuilt FTS index for '{self.table_name}' (version {version}) in {elapsed:.2f}s, "
+                                   f"{len(self.pending)} row(s) still pending", 'info', stdout=False)
+
+        if self.on_rebuilt:
+            await self.on_rebuilt()
+        return True
+
+    async def flush(self):
+        '''Rebuilds right away if anything is waiting.'''
+        if self.dirty.is_set() or not self.is_current:
+            await self.rebuild()
+
+    async def close(self, flush = True):
+        if flush and self.dirty.is_set():
+            await self.rebuild()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def metrics(self):
+        return {**self.stats, "pending_rows": len(self.pending), "has_index": self.has_index, "current": self.is_current}
@@ -0,0 +1,153 @@
+from main.configs import INGEST_GROUP_CHARS, INGEST_QUEUE_SIZE
+from main.utils import Logger
+from .reading import iter_pdf_pages, iter_text_segments, TEXT_EXTs, PDF_EXTs
+from .chunking import chunk_spans
+from hashlib import sha256
+import asyncio
+import json
+import os
+
+class IngestCheckpoint:
+    '''
+    Progress of one document's ingestion, saved after every written group. The key covers the path, size and mtime, so a changed
+    file starts over instead of resuming from stale positions.
+    '''
+    def __init__(self, directory: str, file_path: str) -> None:
+        st = os.stat(file_path)
+        key = sha256(f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}".encode()).hexdigest()
+        self.path = os.path.join(directory, f"{key}.json")
+        self.directory = directory
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self, state: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+async def buffered(agen, maxsize = INGEST_QUEUE_SIZE):
+    '''Runs `agen` in its own task, at most `maxsize` items ahead of the consumer, so neighbouring stages overlap with bounded memory.'''
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                await queue.put((True, item))
+        except Exception as e:
+            await queue.put((False, e))
+        finally:
+            await queue.put((True, done))
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            ok, item = await queue.get()
+            if not ok:
+                raise item
+            if item is done:
+                break
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+async def read_groups(file_path: str, resume: dict, group_chars = INGEST_GROUP_CHARS):
+    '''
+    Reader stage: yields `(text, position, progress)` groups of about `group_chars` characters, made of whole pages / segments.
+    `position` is where the next group starts (`{"page": n}` or `{"offset": n}`, plus `"chars"`, the character offset into the
+    extracted text), `progress` is `(done, total)` in pages or bytes.
+    '''
+    _, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+    parts: list[str] = []
+    size = 0
+    chars = resume.get("chars", 0)
+
+    if ext in PDF_EXTs:
+        async for index, text, total in iter_pdf_pages(file_path, resume.get("page", 0)):
+            parts.append(text)
+            size += len(text)
+            if size >= group_chars:
+                text = "\n\n".join(parts) + "\n\n"
+                chars += len(text)
+                yield text, {"page": index + 1, "chars": chars}, (index + 1, total)
+                parts, size = [], 0
+        if parts:
+            text = "\n\n".join(parts)
+            yield text, {"page": index + 1, "chars": chars + len(text)}, (index + 1, total) # type:ignore
+
+    elif ext in TEXT_EXTs:
+        async for _, end, text, total in iter_text_segments(file_path, resume.get("offset", 0)):
+            parts.append(text)
+            size += len(text)
+            if size >= group_chars:
+                text = "".join(parts)
+                chars += len(text)
+                yield text, {"offset": end, "chars": chars}, (end, total)
+                parts, size = [], 0
+        if parts:
+            text = "".join(parts)
+            yield text, {"offset": total, "chars": chars + len(text)}, (total, total) # type:ignore
+
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+async def chunk_groups(groups, counter = None):
+    '''Chunker stage: splits every group into deduplicated chunks in a thread, with `(start, end)` character offsets into the document.'''
+    async for text, position, progress in groups:
+        base = position["chars"] - len(text)
+        unique = {}
+        for c in await asyncio.to_thread(chunk_spans, text, counter=counter):
+            unique.setdefault(c.text, (base + c.start, base + c.end))
+        yield list(unique), list(unique.values()), position, progress
+
+async def embed_groups(chunked, embed_fn):
+    '''Embedder stage: `embed_fn(chunks) -> vectors` per group.'''
+    async for chunks, spans, position, progress in chunked:
+        vectors = await embed_fn(chunks) if chunks else []
+        yield chunks, spans, vectors, position, progress
+
+async def ingest(file_path: str, embed_fn, write_fn, checkpoint: IngestCheckpoint | None = None, progress_fn = None, resume = True, counter = None):
+    '''
+    Streams `file_path` through reader -> chunker -> embedder -> writer. `write_fn(chunks, vectors, spans)` is awaited once per group,
+    the checkpoint is saved after each write and removed at the end. Returns the number of chunks written.
+    '''
+    state = checkpoint.load() if (checkpoint and resume) else {}
+    position = state.get("position", {})
+    written = state.get("chunks", 0)
+    if position:
+        await Logger.log_async(f"Resuming ingestion of {file_path} from {position} ({written} chunks already written)", 'info')
+
+    stages = embed_groups(buffered(chunk_groups(buffered(read_groups(file_path, position)), counter)), embed_fn)
+    async for chunks, spans, vectors, position, progress in buffered(stages):
+        if chunks:
+            await write_fn(chunks, vectors, spans)
+            written += len(chunks)
+        if checkpoint:
+            await asyncio.to_thread(checkpoint.save, {"position": position, "chunks": written})
+        if progress_fn:
+            await progress_fn(progress[0], progress[1], written)
+
+    if checkpoint:
+        await asyncio.to_thread(checkpoint.clear)
+    return written
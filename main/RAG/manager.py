@@ -5,18 +5,24 @@ import asyncio
 from main.models.model_instance import LocalEmbedder
 from main.models.models_profile import RemoteEmbedder
 from main.models.openrouter_model import OpenRouterEmbedder
-from main.configs import RAG_MIN_SCORE
+from main.configs import RAG_MIN_SCORE, CHUNK_TOKENIZER
 from main.utils import Logger
-from .chunking import chunk
+from .chunking import chunk_spans, make_token_counter
 from .reading import read
 from hashlib import sha256
 from .embedding import embed
+from .embedding_cache import EmbeddingCache
+from .fts_maintainer import FTSIndexMaintainer
+from .ingest import ingest, IngestCheckpoint
+from .reading import TEXT_EXTs, PDF_EXTs
+from main.events import EventBus
 from lancedb.rerankers import MRRReranker # you can use your own
 import shutil
 import os
 import json
 import traceback
 import re
+import inspect
 
 def sanitize_id(oid: str) -> str:
     if not re.fullmatch(r"[a-fA-fa-f0-9]{64}", oid):
@@ -25,7 +31,8 @@ def sanitize_id(oid: str) -> str:
 
 class RAG_manager:
     def __init__(self, embedder: None | LocalEmbedder | RemoteEmbedder | OpenRouterEmbedder, embedder_auto_warm_up = True, db_path="./rag_db", 
-                 table_name="memories", embed_chunk_size = 24):
+                 table_name="memories", embed_chunk_size = 24, embedding_cache_path: str | None = None, fts_in_process = True,
+                 event_bus: None | EventBus = None, tokenizer = CHUNK_TOKENIZER):
         self.embedder = embedder
         self.db_path = db_path
         self.table_name = table_name
@@ -35,6 +42,20 @@ class RAG_manager:
         self.cache = {}
         self.db = None
         self.table = None
+        self.event_bus = event_bus
+        self.checkpoint_dir = os.path.join(db_path, "_ingest")
+        self.token_counter = make_token_counter(tokenizer)
+        self.fts = FTSIndexMaintainer(db_path, table_name, use_process=fts_in_process, on_rebuilt=self._on_fts_rebuilt)
+        if embedding_cache_path is not None:
+            EmbeddingCache.configure(embedding_cache_path)
+
+    def get_cache_stats(self):
+        return {"results_cached": len(self.cache), "embeddings": EmbeddingCache.metrics(), "fts": self.fts.metrics()}
+
+    async def _on_fts_rebuilt(self):
+        if self.table is not None:
+            await asyncio.to_thread(self.table.checkout_latest)
+        self.cache.clear()
 
     async def connect(self):
         if not self.db:
@@ -60,43 +81,80 @@ class RAG_manager:
             ])
             self.table = await asyncio.to_thread(self.db.create_table, self.table_name, schema=schema)
             await asyncio.to_thread(self.table.create_scalar_index, "id")
+            self.fts.has_index = False
         else:
             self.table = await asyncio.to_thread(self.db.open_table, self.table_name)
+            indices = await asyncio.to_thread(self.table.list_indices)
+            self.fts.has_index = any(getattr(i, "index_type", "") == "FTS" for i in indices)
+            if not self.fts.has_index and await asyncio.to_thread(self.table.count_rows):
+                self.fts.mark()
 
     async def save(self):
         if not self.table: await self.load()
         if not self.table: raise ValueError
+        await self.fts.flush()
         await asyncio.to_thread(self.table.optimize)
 
-    async def index_document(self, file_path:str, metadata):
-        await Logger.log_async(f'Indexing document: {file_path}', 'info')
-        contents = await read(file_path)
-        await self.index_text(contents, metadata=metadata)
+    async def close(self):
+        await self.fts.close()
 
-    async def index_text(self, text: str, metadata: dict | None = None):
+    async def index_document(self, file_path:str, metadata, resume = True, progress_callback = None):
+        '''
+        Streams the document through reader -> chunker -> embedder -> writer, writing as it goes. Interrupted ingestions resume from
+        their last written page / offset unless `resume` is False. `progress_callback(done, total, chunks)` may be sync or async.
+        '''
         if not self.embedder:
             raise ValueError("No embedder")
-
+        await Logger.log_async(f'Indexing document: {file_path}', 'info')
         await self.load()
-
-        if not self.table: raise ValueError
-
-        chunks = chunk(text)
-        if not chunks:
-            return
-            
-        chunks = list(dict.fromkeys(c.strip() for c in chunks if c.strip()))
-
-        vectors = await embed(self.embedder, chunks, self.embedder_auto_warm_up, self.embed_chunk_size)
-
+        if self.table is None: raise ValueError
+
+        async def embed_fn(chunks):
+            return await embed(self.embedder, chunks, self.embedder_auto_warm_up, self.embed_chunk_size) # type:ignore
+
+        async def write_fn(chunks, vectors, spans):
+            await self._write_chunks(chunks, vectors, metadata, spans)
+
+        async def progress_fn(done, total, chunks):
+            if progress_callback:
+                r = progress_callback(done, total, chunks)
+                if inspect.isawaitable(r): await r
+            if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.INDEXING_PROGRESS, False, file = file_path, done = done, 
+                                                                  total = total, chunks = chunks)
+
+        checkpoint = IngestCheckpoint(self.checkpoint_dir, file_path)
+        written = await ingest(file_path, embed_fn, write_fn, checkpoint, progress_fn, resume, self.token_counter)
+        await Logger.log_async(f"Indexed {file_path}: {written} chunks.", "info")
+        return written
+
+    async def index_directory(self, root:str, metadata: dict | None = None, extensions: list[str] | None = None, resume = True, progress_callback = None):
+        '''Indexes every supported file under `root` one at a time, tagging each with its path as `source`.'''
+        exts = set(extensions or (TEXT_EXTs + PDF_EXTs))
+        total = 0
+        for dirpath, _, files in os.walk(root):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() not in exts:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    total += await self.index_document(path, {**(metadata or {}), "source": path}, resume, progress_callback)
+                except Exception as e:
+                    await Logger.log_async(f"Failed to index {path}: {e}; {traceback.format_exc()}", "error")
+        return total
+
+    async def _write_chunks(self, chunks: list[str], vectors, metadata: dict | None = None, spans: list[tuple[int, int]] | None = None):
+        '''Upserts the chunks. `spans` are their `(start, end)` character offsets in the source, stored as `char_start` / `char_end` metadata.'''
         records = []
-        for chunk_text, vec in zip(chunks, vectors):
+        for i, (chunk_text, vec) in enumerate(zip(chunks, vectors)):
             cid = sha256(chunk_text.encode()).hexdigest()
+            meta = metadata or {}
+            if spans:
+                meta = {**meta, "char_start": spans[i][0], "char_end": spans[i][1]}
             records.append({
                 "id": cid,
                 "text": chunk_text,
                 "vector": vec,
-                "metadata": json.dumps(metadata or {}),
+                "metadata": json.dumps(meta),
                 "timestamp": datetime.now().isoformat()
             })
         
@@ -104,8 +162,29 @@ class RAG_manager:
 
             await asyncio.to_thread(lambda *_: self.table.merge_insert("id").when_matched_update_all().when_not_matched_insert_all().execute(records), ) # type:ignore
 
-            await asyncio.to_thread(self.table.create_fts_index, "text", replace=True)
+            self.fts.mark([r["id"] for r in records])
             self.cache.clear()
+        return records
+
+    async def index_text(self, text: str, metadata: dict | None = None):
+        if not self.embedder:
+            raise ValueError("No embedder")
+
+        await self.load()
+
+        if not self.table: raise ValueError
+
+        unique = {}
+        for c in chunk_spans(text, counter=self.token_counter):
+            unique.setdefault(c.text, (c.start, c.end))
+        if not unique:
+            return
+            
+        chunks = list(unique)
+
+        vectors = await embed(self.embedder, chunks, self.embedder_auto_warm_up, self.embed_chunk_size)
+
+        records = await self._write_chunks(chunks, vectors, metadata, list(unique.values()))
 
         await Logger.log_async(f"Indexed {len(records)} new chunks.", "info")
 
@@ -128,7 +207,10 @@ class RAG_manager:
 
         query_vec = (await embed(self.embedder, [query], self.embedder_auto_warm_up))[0]
 
-        results = await asyncio.to_thread(_helper_search, self.table, query, query_vec, self.reranker, top_k)
+        if self.fts.is_current:
+            results = await asyncio.to_thread(_helper_search, self.table, query, query_vec, self.reranker, top_k)
+        else:
+            results = await asyncio.to_thread(self._search_with_pending, query, query_vec, top_k, list(self.fts.pending))
 
         res = []
 
@@ -155,6 +237,53 @@ class RAG_manager:
 
         return res
     
+    def _search_with_pending(self, query: str, query_vec, top_k: int, pending_ids: list[str]):
+        '''
+        Hybrid search while the FTS index is behind: full-text hits from the last good index (if any) plus a linear keyword scan of the
+        rows written since, merged and reranked together with the vector hits.
+        '''
+        table: lancedb.Table = self.table # type:ignore
+        vector_res = table.search(query_vec, vector_column_name="vector").limit(top_k).with_row_id(True).to_arrow()
+
+        fts_rows = []
+        fts_schema = None
+        if self.fts.has_index:
+            try:
+                fts_res = table.search(query, query_type='fts').limit(top_k).with_row_id(True).to_arrow()
+                fts_rows, fts_schema = fts_res.to_pylist(), fts_res.schema
+            except Exception as e:
+                Logger.log_sync(f"FTS query failed, using the linear scan only: {e}", 'warn', stdout=False)
+
+        terms = set(re.findall(r"\w+", query.lower()))
+        seen = {r["id"] for r in fts_rows}
+        top = max((r["_score"] for r in fts_rows), default=0.0) or 1.0
+        for r in fts_rows:
+            r["_score"] = r["_score"] / top
+
+        if terms:
+            for start in range(0, len(pending_ids), 500):
+                ids = [sanitize_id(i) for i in pending_ids[start:start + 500] if i not in seen]
+                if not ids:
+                    continue
+                id_list = ", ".join(f"'{i}'" for i in ids)
+                rows = table.search().where(f"id IN ({id_list})").limit(len(ids)).with_row_id(True).to_list()
+                for r in rows:
+                    words = re.findall(r"\w+", r["text"].lower())
+                    if not words:
+                        continue
+                    hits = sum(1 for w in words if w in terms)
+                    matched = len(terms.intersection(words))
+                    if matched:
+                        r["_score"] = (matched / len(terms)) * (hits / (hits + 1.2))
+                        fts_rows.append(r)
+
+        fts_rows = sorted(fts_rows, key=lambda r: r["_score"], reverse=True)[:top_k]
+        if fts_schema is None:
+            fts_schema = pyarrow.schema([f for f in vector_res.schema if f.name != "_distance"] + [pyarrow.field("_score", pyarrow.float32())])
+        fts_table = pyarrow.Table.from_pylist([{f.name: r.get(f.name) for f in fts_schema} for r in fts_rows], schema=fts_schema)
+
+        return self.reranker.rerank_hybrid(query, vector_res, fts_table).to_pylist()[:top_k]
+
     async def clear_index(self):
         if not self.db: await self.load()
 
@@ -162,6 +291,8 @@ class RAG_manager:
 
         await asyncio.to_thread(self.db.drop_table, self.table_name)
         self.table = None
+        self.fts.pending.clear()
+        self.fts.has_index = False
 
     async def delete_index_db(self, delete_full_db):
         if not self.db: await self.load()
@@ -169,6 +300,9 @@ class RAG_manager:
         if not self.db: raise FileNotFoundError
 
         await asyncio.to_thread(self.db.drop_all_tables)
+        self.table = None
+        self.fts.pending.clear()
+        self.fts.has_index = False
 
         if delete_full_db and os.path.exists(self.db_path):
             await asyncio.to_thread(shutil.rmtree, self.db_path)
@@ -258,7 +392,8 @@ class RAG_manager:
         
         try:
             await asyncio.to_thread(self.table.delete, f"id = '{sanitize_id(mem_id)}'")
-            await asyncio.to_thread(self.table.create_fts_index, "text", replace=True)
+            self.fts.pending.pop(mem_id, None)
+            self.fts.mark()
             self.cache.clear()
             await Logger.log_async(f"Deleted memory {mem_id}", "info")
             return True
@@ -293,7 +428,7 @@ class RAG_manager:
                 }
             )
 
-            await asyncio.to_thread(self.table.create_fts_index, "text", replace=True)
+            self.fts.mark([mem_id])
 
             self.cache.clear()
 
@@ -2,7 +2,13 @@ import aiofiles
 import os
 import pymupdf
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from main.utils import Logger
+from main.configs import INGEST_TEXT_SEGMENT_BYTES, INGEST_PDF_PAGES_PER_TASK, INGEST_PDF_WORKERS, INGEST_PDF_PROCESS_MIN_PAGES
+
+TEXT_EXTs = ['.txt', '.py', '.md', '.json', '.js', '.html', '.css', '.java', '.cpp']
+PDF_EXTs = ['.pdf']
 
 async def read_txt(file_path:str):
     async with aiofiles.open(file_path, "r", encoding = "utf-8") as f:
@@ -32,9 +38,94 @@ async def read_pdf(file_path:str):
 async def read(file_path:str):
     _, ext = os.path.splitext(file_path)
     ext = ext.lower()
-    if ext in ['.txt', '.py', '.md', '.json', '.js', '.html', '.css', '.java', '.cpp']:
+    if ext in TEXT_EXTs:
         return await read_txt(file_path)
-    elif ext in ['.pdf']:
+    elif ext in PDF_EXTs:
         return await read_pdf(file_path)
     else:
-        raise ValueError
\ No newline at end of file
+        raise ValueError
+
+def _pdf_page_count(file_path:str):
+    with pymupdf.open(file_path) as doc:
+        return doc.page_count
+
+def _read_pdf_pages(file_path:str, start:int, end:int):
+    with pymupdf.open(file_path) as doc:
+        return [str(doc[i].get_text('text')) for i in range(start, min(end, doc.page_count))]
+
+async def iter_pdf_pages(file_path:str, start_page = 0, pages_per_task = INGEST_PDF_PAGES_PER_TASK, workers = INGEST_PDF_WORKERS):
+    '''
+    Yields `(page_index, text, page_count)` in page order. Large PDFs are parsed `pages_per_task` pages at a time in a process pool,
+    with at most `2 * workers` page ranges parsed ahead of the consumer, small ones in a thread.
+    '''
+    page_count = await asyncio.to_thread(_pdf_page_count, file_path)
+    if start_page >= page_count:
+        return
+
+    loop = asyncio.get_running_loop()
+    executor = None
+    if page_count - start_page >= INGEST_PDF_PROCESS_MIN_PAGES and workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    ranges = [(s, min(s + pages_per_task, page_count)) for s in range(start_page, page_count, pages_per_task)]
+    ahead = max(1, 2 * workers)
+    in_flight: list[tuple[int, asyncio.Future]] = []
+    try:
+        next_range = 0
+        while next_range < len(ranges) or in_flight:
+            while next_range < len(ranges) and len(in_flight) < ahead:
+                s, e = ranges[next_range]
+                if executor:
+                    fut = loop.run_in_executor(executor, _read_pdf_pages, file_path, s, e)
+                else:
+                    fut = asyncio.ensure_future(asyncio.to_thread(_read_pdf_pages, file_path, s, e))
+                in_flight.append((s, fut))
+                next_range += 1
+
+            s, fut = in_flight.pop(0)
+            for offset, text in enumerate(await fut):
+                yield s + offset, text, page_count
+    finally:
+        for _, fut in in_flight:
+            fut.cancel()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+async def iter_text_segments(file_path:str, start_offset = 0, segment_bytes = INGEST_TEXT_SEGMENT_BYTES):
+    '''
+    Yields `(start_offset, end_offset, text, total_bytes)` for roughly `segment_bytes` sized pieces of a text file, cut at paragraph (or line)
+    boundaries so no paragraph is split unless it is larger than a whole segment.
+    '''
+    total = os.path.getsize(file_path)
+    async with aiofiles.open(file_path, "rb") as f:
+        await f.seek(start_offset)
+        offset = start_offset
+        carry = b""
+        while True:
+            block = await f.read(segment_bytes)
+            data = carry + block
+            if not data:
+                break
+            if block:
+                cut = data.rfind(b"\n\n")
+                if cut == -1:
+                    cut = data.rfind(b"\n")
+                if cut == -1:
+                    cut = data.rfind(b" ")
+                if cut == -1 and len(data) < 4 * segment_bytes:
+                    carry = data
+                    continue
+                if cut == -1:
+                    # forced cut, back to the start of a UTF-8 character (the last one may be incomplete) so none is split
+                    cut = len(data) - 1
+                    while cut > 0 and data[cut] & 0xC0 == 0x80:
+                        cut -= 1
+                else:
+                    cut += 1
+            else:
+                cut = len(data)
+            piece, carry = data[:cut], data[cut:]
+            yield offset, offset + len(piece), piece.decode("utf-8"), total
+            offset += len(piece)
+            if not block and not carry:
+                break
\ No newline at end of file
@@ -13,7 +13,10 @@ from .models.openrouter_model import OpenRouterModel, OpenRouterEmbedder
 from .models.models_profile import RemoteModel
 from .tools import tool, Tool, ToolRegistry
 from .resource_manager import ResourceManager, SessionManager
+from .http_pool import ConnectionPool
+from .scheduler import AdmissionScheduler
 from .models.base_model import Model
+from .messages import Message
 
 __all__ = ["AI", "Backend", "Model", "OpenrouterBackend", "OpenRouterModel", "OpenRouterEmbedder", "OllamaModel", "OllamaEmbedder", "Logger", 'tool', "ContextManager", "GenerationSession", "Summariser", "MultiServer", "SingleServer", 
-           "LocalModel", "RemoteModel", "Tool", "ToolRegistry", "ResourceManager", "SessionManager"]
\ No newline at end of file
+           "LocalModel", "RemoteModel", "Tool", "ToolRegistry", "ResourceManager", "SessionManager", "ConnectionPool", "AdmissionScheduler", "Message"]
\ No newline at end of file
@@ -9,13 +9,22 @@ from main.generation_session import GenerationSession, DONE, FAIL, CANCELLED
 from main.tools import ToolRegistry
 from main.utils import Logger
 import traceback
-from main.configs import ERROR_TOKEN, EMBEDDING_MODEL_ROLE
+from main.configs import ERROR_TOKEN, EMBEDDING_MODEL_ROLE, WARMUP_CONCURRENCY, WARMUP_PRIORITY, WARMUP_CRITICAL_ROLES, SCHEDULER_MAX_QUEUE
+from main.scheduler import AdmissionScheduler, priority_for_role
 import inspect
 import json
 import aiofiles
+import time
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
 
 class Backend:
-    def __init__(self, models_list_path, system_prompts, default_system_prompt, event_bus: None | EventBus = None) -> None:
+    def __init__(self, models_list_path, system_prompts, default_system_prompt, event_bus: None | EventBus = None, 
+                 warmup_concurrency = WARMUP_CONCURRENCY, warmup_priority: list[str] | None = None, warmup_critical_roles: list[str] | None = None,
+                 scheduler_max_queue = SCHEDULER_MAX_QUEUE) -> None:
         self.models_list_path = models_list_path
         self.system_prompts = system_prompts
         self.default_system_prompt = default_system_prompt
@@ -25,6 +34,14 @@ class Backend:
         self.event_bus = event_bus
         self.lock = asyncio.Lock()
         self.check_lock = asyncio.Lock()
+        self.residency = None
+        self.scheduler = AdmissionScheduler(scheduler_max_queue, event_bus)
+        self.warmup_concurrency = max(1, warmup_concurrency)
+        self.warmup_priority = list(warmup_priority if warmup_priority is not None else WARMUP_PRIORITY)
+        self.warmup_critical_roles = list(warmup_critical_roles if warmup_critical_roles is not None else WARMUP_CRITICAL_ROLES)
+        self.readiness: dict[str, str] = {}
+        self.ready_events: dict[str, asyncio.Event] = {}
+        self.startup_report: dict[str, dict] = {}
 
     def _create_model_data(self, models_data, model, embedder, override_port = False, overwritten_port=11343, auto_resolve_ports = True, require_key = False):
         if self.event_bus:asyncio.create_task(self.event_bus.parallel_emit(self.event_bus.INFO, True, msg='Loading models'))
@@ -73,6 +90,7 @@ class Backend:
                                 model_data["system_prompt"] = self.system_prompts.get(role, self.default_system_prompt)
                             
                             self.models[role] = model(**model_data, event_bus = self.event_bus)
+                            self.scheduler.register(self.models[role])
                         else:
                             self.models[role] = embedder(EMBEDDING_MODEL_ROLE, model_data.get("name", 'Embedder'), model_data['model_name'], 
                                                          model_data.get('port'), key, event_bus = self.event_bus)
@@ -119,23 +137,103 @@ class Backend:
 
     def get_model(self, role):
         model_obj = self.models.get(role)
+        if model_obj is not None and self.residency is not None:
+            self.residency.touch(role)
         return model_obj
     
+    def _warmup_order(self, models:list):
+        priority = {role: i for i, role in enumerate(self.warmup_priority)}
+        return sorted(models, key=lambda m: priority.get(m.role, len(priority)))
+
+    async def _warm_model(self, model, semaphore: asyncio.Semaphore):
+        role = model.role
+        async with semaphore:
+            self.readiness[role] = WARMING
+            start = time.perf_counter()
+            try:
+                await model.warm_up()
+                self.readiness[role] = READY if model.warmed_up else FAILED
+            except Exception as e:
+                self.readiness[role] = FAILED
+                await Logger.log_async(f"Warming up {model.name} ({model.model_name}) [{role}] failed: {e}; {traceback.format_exc()}", 'error')
+                if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.ERROR, msg = f"Warming up {model.name} ({model.model_name}) [{role}] failed: {e}")
+            finally:
+                self.startup_report[role] = {
+                    "name": model.name,
+                    "model_name": model.model_name,
+                    "state": self.readiness[role],
+                    "total": time.perf_counter() - start,
+                    "phases": dict(model.warmup_timings),
+                }
+                self.ready_events[role].set()
+
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.MODEL_READY, role = role, ready = self.readiness[role] == READY,
+                                                              seconds = round(self.startup_report[role]['total'], 3))
+
+    async def _warm_up_all(self, models:list):
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.warmup_concurrency)
+        await asyncio.gather(*(self._warm_model(m, semaphore) for m in self._warmup_order(models)))
+        self.startup_report['_total'] = {"total": time.perf_counter() - start, "concurrency": self.warmup_concurrency}
+
+        await Logger.log_async(self.format_startup_report(), 'info')
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.MODELS_LOADED, readiness = dict(self.readiness), report = self.startup_report)
+
     async def _init(self, *tools_list):
+        to_warm = []
         for model in self.models.values():
             if isinstance(model, (LocalModel, RemoteModel, OpenRouterModel)):
                 if model.has_tools:
                     await model.add_tools(*tools_list)
                 if not model.warmed_up:
-                    await model.warm_up()
+                    to_warm.append(model)
+                    self.readiness[model.role] = PENDING
+                    self.ready_events[model.role] = asyncio.Event()
                 else:
                     await Logger.log_async(f"{model.name} ({model.model_name}) is already warmed, skipping... This maybe abnormal, please ensure the initilising Logger.log_asyncic.", 'warn')
 
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.MODELS_LOADING, roles = [m.role for m in self._warmup_order(to_warm)])
+
+        t = asyncio.create_task(self._warm_up_all(to_warm))
+        self.running_tasks.add(t)
+        t.add_done_callback(self.running_tasks.discard)
+
+        await self.wait_until_ready(*[r for r in self.warmup_critical_roles if r in self.ready_events])
 
         t = asyncio.create_task(self._check_sessions())
         self.running_tasks.add(t)
         t.add_done_callback(self.running_tasks.discard)
 
+    async def wait_until_ready(self, *roles, timeout: float | None = None):
+        '''
+        Readiness barrier for the background warm-up. Waits for `roles` (every warming role if none given) to finish warming up,
+        successfully or not, and returns `{role: ready}`. Roles still warming when `timeout` runs out are reported as not ready.
+        '''
+        roles = roles or tuple(self.ready_events.keys())
+        events = [self.ready_events[r] for r in roles if r in self.ready_events]
+        if events:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(e.wait() for e in events)), timeout)
+            except asyncio.TimeoutError:
+                await Logger.log_async(f"Timed out waiting for {', '.join(r for r in roles if self.readiness.get(r) != READY)} to warm up", 'warn')
+        return {r: self.readiness.get(r) == READY for r in roles}
+
+    def get_readiness(self):
+        return dict(self.readiness)
+
+    def format_startup_report(self):
+        lines = ["Startup warm-up report:"]
+        for role, r in self.startup_report.items():
+            if role == '_total':
+                continue
+            phases = ", ".join(f"{k} {v:.2f}s" for k, v in r['phases'].items()) or "-"
+            lines.append(f"  [{role}] {r['name']} ({r['model_name']}): {r['state']} in {r['total']:.2f}s ({phases})")
+        total = self.startup_report.get('_total')
+        if total:
+            serial = sum(r['total'] for k, r in self.startup_report.items() if k != '_total')
+            lines.append(f"  wall time {total['total']:.2f}s with concurrency {total['concurrency']} (sum of model warm-ups {serial:.2f}s)")
+        return "\n".join(lines)
+
     async def remove_session(self, session_id):
         await self.cancel_generation(session_id)
         async with self.lock:
@@ -158,18 +256,22 @@ class Backend:
             await asyncio.sleep(10)
 
     async def create_session(self, query:str | None, context:list[dict], tools_regis:ToolRegistry, role, system_prompt_override: str | None = None, 
-                options: dict | None = None, format_: dict | None = None, max_turns = 10, abs_max_turns = 50, regen_consent_callback= None, temp_remove_tool_name = None):
+                options: dict | None = None, format_: dict | None = None, max_turns = 10, abs_max_turns = 50, regen_consent_callback= None, temp_remove_tool_name = None,
+                priority: int | None = None):
         
         if role == EMBEDDING_MODEL_ROLE:
             await Logger.log_async('Cannot create a session with an embedding model!', 'error')
             raise ValueError
 
-        model_obj = self.models.get(role)
+        model_obj = self.get_model(role)
 
         if not model_obj:
             await Logger.log_async(f"{role} not found in the model registry!","error")
             raise KeyError
 
+        if self.residency is not None:
+            await self.residency.ensure_resident(role)
+
         active_tools = None
 
         if isinstance(model_obj, (OpenRouterModel, LocalModel, RemoteModel)):
@@ -181,7 +283,7 @@ class Backend:
         
         session = GenerationSession(query, context, tools_regis, model_obj, # type:ignore
                 system_prompt_override, options, format_, max_turns, abs_max_turns, regen_consent_callback, 
-                active_tools, self.event_bus)
+                active_tools, self.event_bus, priority if priority is not None else priority_for_role(role))
         
         async with self.lock:
             self.sessions[session.id] = session
@@ -203,9 +305,16 @@ class Backend:
         self.running_tasks.clear()
 
     def get_models_state(self):
-        states = [{"name": m.name, 'model_name': m.model_name, 'state': m.state, 'role': m.role,} for m in self.models.values()]
+        states = [{"name": m.name, 'model_name': m.model_name, 'state': m.state, 'role': m.role, 
+                   'queue_depth': m.admission.depth if m.admission else 0, 'active_generations': m.admission.active if m.admission else 0,} for m in self.models.values()]
         return states
     
+    def get_scheduler_metrics(self):
+        return self.scheduler.metrics()
+
+    def get_prompt_metrics(self):
+        return {m.role: dict(m.prompt_stats) for m in self.models.values()}
+
     def get_sessions_states(self):
         states = [{"id": sid, 'state': s.state, 'created_at': s.created_at, "model": s.model.name, "model_name": s.model.model_name, 
                    'turns': s.turns, "total_turns": s.total_turns, "max_turns": s.max_turns, "abs_max_turns": s.abs_max_turns, 
@@ -6,11 +6,18 @@ from main.tools import Tool
 from main.utils import Logger
 from .backend import Backend
 from main.events import EventBus
+from main.http_pool import ConnectionPool
+from main.configs import RESIDENCY_MEMORY_BUDGET_MB, RESIDENCY_CHECK_INTERVAL, RESIDENCY_PINNED_ROLES
+from .residency import ResidencyManager
 
 class MultiServer(Backend):
-    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt, event_bus: None | EventBus = None,) -> None:
-        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus)
+    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt, event_bus: None | EventBus = None, 
+                 memory_budget_mb: int | None = RESIDENCY_MEMORY_BUDGET_MB, residency_interval = RESIDENCY_CHECK_INTERVAL, 
+                 pinned_roles: list[str] | None = None, **kwargs) -> None:
+        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus, **kwargs)
         self.checking_event = asyncio.Event()
+        self.residency = ResidencyManager(self, memory_budget_mb, residency_interval, 
+                                          pinned_roles if pinned_roles is not None else RESIDENCY_PINNED_ROLES, event_bus)
 
     def load(self):
         self._load(Model, Embedder, False)
@@ -20,10 +27,10 @@ class MultiServer(Backend):
 
     async def _ping_model_tag(self, url):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{url}/api/tags") as res:
-                    return res.status == 200
-        except aiohttp.ClientError:
+            session = ConnectionPool.get_session(url)
+            async with session.get(f"{url}/api/tags", timeout=aiohttp.ClientTimeout(total=5)) as res:
+                return res.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
                 return False
 
     async def _check_models(self, interval=10):
@@ -55,8 +62,13 @@ class MultiServer(Backend):
         check_task = asyncio.create_task(self._check_models())
         self.running_tasks.add(check_task)
 
+        if self.residency.memory_budget:
+            residency_task = asyncio.create_task(self.residency.run())
+            self.running_tasks.add(residency_task)
+
     async def shutdown(self):
         self.checking_event.set()
+        self.residency.stop_event.set()
 
         await self.close_sessions()
 
@@ -5,8 +5,8 @@ from main.tools import Tool
 from main.events import EventBus
 
 class OpenrouterBackend(Backend):
-    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt, event_bus: None | EventBus = None,) -> None:
-        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus)
+    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt, event_bus: None | EventBus = None, **kwargs) -> None:
+        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus, **kwargs)
     
     def load(self):
         self._load(Model, Embedder, False, require_key=True)
@@ -0,0 +1,227 @@
+from main.models.model_instance import LocalModel
+from main.models.ollama_models import IDLE, BUSY, UNLOADED
+from main.http_pool import ConnectionPool
+from main.utils import Logger
+from main.events import EventBus
+from collections import OrderedDict
+import aiohttp
+import asyncio
+import psutil
+import time
+import traceback
+
+class ResidencyManager:
+    '''
+    Keeps `MultiServer`'s local models inside a memory budget.
+
+    Every `interval` seconds it samples each model server's RSS (process tree, via psutil) and the models Ollama reports as loaded
+    (`/api/ps`). When the total goes over `memory_budget_mb`, idle models are unloaded (`keep_alive: 0`) least recently used first.
+    Unloaded models are reloaded when their role is requested again through `Backend.get_model`.
+    '''
+    def __init__(self, backend, memory_budget_mb: float | None, interval = 15, pinned_roles: list[str] | None = None, event_bus: None | EventBus = None) -> None:
+        self.backend = backend
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.interval = interval
+        self.pinned_roles = set(pinned_roles or [])
+        self.event_bus = event_bus
+        self.last_used: OrderedDict[str, float] = OrderedDict()
+        self.evicted: set[str] = set()
+        self.reloading: dict[str, asyncio.Task] = {}
+        self.usage: dict[str, dict] = {}
+        self.lock = asyncio.Lock()
+        self.stop_event = asyncio.Event()
+        self.stats = {"evictions": 0, "reloads": 0, "reload_failures": 0, "eviction_seconds": 0.0, "reload_seconds": 0.0}
+
+    def _models(self) -> dict[str, LocalModel]:
+        return {role: m for role, m in self.backend.models.items() if isinstance(m, LocalModel)}
+
+    def touch(self, role):
+        '''Marks `role` as used and starts reloading it in the background if it was evicted.'''
+        model = self._models().get(role)
+        if model is None:
+            return
+        self.last_used[role] = time.monotonic()
+        self.last_used.move_to_end(role)
+
+        if role in self.evicted and role not in self.reloading:
+            t = asyncio.create_task(self._reload(role, model))
+            self.reloading[role] = t
+            t.add_done_callback(lambda t: self._reload_done(role, t))
+
+    def _reload_done(self, role, t: asyncio.Task):
+        self.reloading.pop(role, None)
+        if not t.cancelled() and t.exception() is not None: # `_reload` handles its errors, this is only a last resort
+            Logger.log_sync(f"Reloading {role} failed: {t.exception()!r}", 'error')
+
+    async def ensure_resident(self, role):
+        self.touch(role)
+        t = self.reloading.get(role)
+        if t is not None:
+            try:
+                await asyncio.shield(t)
+            except Exception as e:
+                await Logger.log_async(f"Reloading {role} failed, the server will load it on first request: {e}", 'warn')
+
+    def _keep_alive(self, model: LocalModel):
+        value = model.custom_keep_alive_timeout if model.use_custom_keep_alive_timeout else "5m"
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+
+    async def _post_generate(self, model: LocalModel, keep_alive):
+        session = ConnectionPool.get_session(model.host)
+        headers = {"Content-Type": "application/json"}
+        if model.api_key: headers['Authorization'] = f'Bearer {model.api_key}'
+        payload = {"model": model.model_name, "keep_alive": keep_alive}
+        async with session.post(f"{model.host}/api/generate", json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+            resp.raise_for_status()
+            await resp.read()
+
+    async def _reload(self, role, model: LocalModel):
+        start = time.perf_counter()
+        await Logger.log_async(f"Reloading evicted model {model.name} ({model.model_name}) [{role}]...", 'info')
+        try:
+            await self._post_generate(model, self._keep_alive(model))
+        except Exception as e:
+            # stays evicted, the next `touch` tries again and the server loads it on its first request anyway
+            async with self.lock:
+                self.stats["reload_failures"] += 1
+            await Logger.log_async(f"Reloading {model.name} ({model.model_name}) [{role}] failed, the server will load it on first request: {e}; {traceback.format_exc()}", 'error')
+            if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.ERROR, msg = f"Reloading {model.name} ({model.model_name}) failed: {e}")
+            return False
+        latency = time.perf_counter() - start
+
+        async with self.lock:
+            self.evicted.discard(role)
+            self.stats["reloads"] += 1
+            self.stats["reload_seconds"] += latency
+        async with model.state_lock:
+            if model.state == UNLOADED:
+                model.state = IDLE
+
+        await Logger.log_async(f"Reloaded {model.name} ({model.model_name}) [{role}] in {latency:.2f}s", 'info')
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.MODEL_RELOADED, role = role, seconds = round(latency, 3),
+                                                              reloads = self.stats["reloads"])
+        return True
+
+    async def _evict(self, role, model: LocalModel):
+        async with model.state_lock:
+            if model.state != IDLE:
+                return False
+            model.state = UNLOADED
+
+        start = time.perf_counter()
+        try:
+            await self._post_generate(model, 0)
+        except Exception as e:
+            await Logger.log_async(f"Unloading {model.name} ({model.model_name}) failed: {e}; {traceback.format_exc()}", 'error')
+            async with model.state_lock:
+                if model.state == UNLOADED:
+                    model.state = IDLE
+            return False
+        latency = time.perf_counter() - start
+
+        async with model.state_lock:
+            # a request that came in during the POST used the model, so the server has it loaded again
+            unloaded = model.state == UNLOADED
+            if unloaded:
+                self.evicted.add(role)
+        if not unloaded:
+            await Logger.log_async(f"{model.name} ({model.model_name}) [{role}] was used while being unloaded, not evicted", 'info')
+            return False
+
+        async with self.lock:
+            self.stats["evictions"] += 1
+            self.stats["eviction_seconds"] += latency
+
+        await Logger.log_async(f"Evicted {model.name} ({model.model_name}) [{role}] in {latency:.2f}s to stay inside the memory budget", 'info')
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.MODEL_EVICTED, role = role, seconds = round(latency, 3),
+                                                              evictions = self.stats["evictions"], freed = self.usage.get(role, {}).get("bytes", 0))
+        return True
+
+    def _server_rss(self, model: LocalModel):
+        process = model.resource_manager.process
+        if process is None:
+            return None
+        try:
+            parent = psutil.Process(process.pid)
+            return sum(p.memory_info().rss for p in [parent] + parent.children(recursive=True))
+        except psutil.Error:
+            return None
+
+    async def _loaded_models(self, model: LocalModel):
+        try:
+            session = ConnectionPool.get_session(model.host)
+            async with session.get(f"{model.host}/api/ps", timeout=aiohttp.ClientTimeout(total=5)) as res:
+                if res.status != 200:
+                    return None
+                js = await res.json()
+                return {m.get('name', ''): m.get('size', 0) for m in js.get('models', [])}
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    async def sample(self):
+        '''Refreshes per role memory usage and reconciles the evicted set with what Ollama actually has loaded.'''
+        models = self._models()
+        usage = {}
+        for role, model in models.items():
+            rss = await asyncio.to_thread(self._server_rss, model)
+            loaded = await self._loaded_models(model)
+            is_loaded = bool(loaded) and any(n == model.model_name or n == f"{model.model_name}:latest" for n in loaded)
+            usage[role] = {
+                "rss": rss,
+                "loaded": is_loaded,
+                "ps_size": sum(loaded.values()) if loaded else 0,
+                "bytes": rss if rss is not None else (sum(loaded.values()) if loaded else 0),
+            }
+
+            if model.state == BUSY:
+                self.last_used[role] = time.monotonic()
+                self.last_used.move_to_end(role)
+
+            async with self.lock:
+                if is_loaded and role in self.evicted and role not in self.reloading:
+                    self.evicted.discard(role)
+                    async with model.state_lock:
+                        if model.state == UNLOADED:
+                            model.state = IDLE
+
+        self.usage = usage
+        return usage
+
+    async def enforce(self):
+        if not self.memory_budget:
+            return
+        usage = await self.sample()
+        total = sum(u["bytes"] for u in usage.values())
+        if total <= self.memory_budget:
+            return
+
+        await Logger.log_async(f"Model memory {total / 1024**2:.0f} MB is over the {self.memory_budget / 1024**2:.0f} MB budget, evicting idle models...", 'warn')
+        models = self._models()
+        never_used = [r for r in models if r not in self.last_used]
+        for role in never_used + list(self.last_used.keys()):
+            if total <= self.memory_budget:
+                break
+            if role in self.pinned_roles or role in self.evicted or role in self.reloading or not usage.get(role, {}).get("loaded"):
+                continue
+            if await self._evict(role, models[role]):
+                total -= usage[role]["bytes"]
+
+    async def run(self):
+        while not self.stop_event.is_set():
+            await asyncio.sleep(self.interval)
+            try:
+                await self.enforce()
+            except Exception as e:
+                await Logger.log_async(f"Residency check failed: {e}; {traceback.format_exc()}", 'error')
+
+    def metrics(self):
+        return {
+            **self.stats,
+            "memory_budget": self.memory_budget,
+            "memory_used": sum(u["bytes"] for u in self.usage.values()),
+            "evicted": sorted(self.evicted),
+            "usage": dict(self.usage),
+        }
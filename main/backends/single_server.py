@@ -8,8 +8,8 @@ import os
 from main.events import EventBus
 
 class SingleServer(Backend):
-    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt,  ollama_port:None | int = None, event_bus: None | EventBus = None,) -> None:
-        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus)
+    def __init__(self, models_list_path:str, system_prompts:dict[str, str], default_system_prompt,  ollama_port:None | int = None, event_bus: None | EventBus = None, **kwargs) -> None:
+        super().__init__(models_list_path, system_prompts, default_system_prompt, event_bus, **kwargs)
 
         if ollama_port is None:
             try:
@@ -25,7 +25,7 @@ class SingleServer(Backend):
         self.ollama_env["OLLAMA_HOST"] = f"http://localhost:{self.ollama_port}"
 
         
-        self.resource_manager = ResourceManager("Single Server")
+        self.resource_manager = ResourceManager("Single Server", self.ollama_env["OLLAMA_HOST"])
         
         self.generation_task = None
 
@@ -1,83 +1,184 @@
 import asyncio
-import hashlib
 import os
-import json
-import aiofiles
-import shutil
 import datetime
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .configs import IMAGE_EXTs, VIDEO_EXTs, FILE_NAME_KEY
+from .configs import GC_BATCH_SIZE, GC_SCAN_BATCH, GC_DELETE_WORKERS, GC_TICK_PAUSE_SECONDS, GC_ORPHAN_GRACE_SECONDS
 from .utils import Logger
-from copy import deepcopy
 from .events import EventBus
+from .media_index import MediaIndex, MediaEntry
+from .media_hash import FileHasher
+from .media_payloads import PayloadCache
+from .messages import freeze
 import traceback
 
 class GarbageCollector:
-    def __init__(self, image_cache_dir, video_cache_dir, time_limit, size_threshold_in_mbs, event_bus: None | EventBus = None) -> None:
+    '''
+    Incremental collector of the media cache. A collection is a series of ticks, each doing a bounded amount of work whatever
+    the size of the cache:
+
+    - up to `batch_size` entries that expired (unused for `time_limit`, or half of it for files over the size threshold), picked
+      through the index on `last_used` / `size`,
+    - while the running total is over the global budget, the least recently used entries that bring it back under, again at
+      most `batch_size`,
+    - the next `scan_batch` files of the cache folders checked against the index, files it doesn't know (and that weren't just
+      written) are orphans and deleted. The scan resumes where the previous tick stopped.
+
+    Files are deleted `batch_size` at a time on a small thread pool, and their index rows in one transaction.
+    '''
+    def __init__(self, image_cache_dir, video_cache_dir, time_limit, size_threshold_in_mbs, event_bus: None | EventBus = None,
+                 batch_size = GC_BATCH_SIZE, scan_batch = GC_SCAN_BATCH, workers = GC_DELETE_WORKERS,
+                 orphan_grace = GC_ORPHAN_GRACE_SECONDS) -> None:
         self.image_cache_dir = image_cache_dir
         self.video_cache_dir = video_cache_dir
         self.time_limit = time_limit
         self.size_threshold_in_mbs = size_threshold_in_mbs * 1024 * 1024
+        self.global_size_threshold = self.size_threshold_in_mbs * 100
         self.event_bus = event_bus
-    
-    async def gc(self, index):
-        image_dir_list = os.listdir(self.image_cache_dir)
-        image_dir_list = list(map(lambda f: os.path.join(self.image_cache_dir, f), image_dir_list))
-        video_dir_list = os.listdir(self.video_cache_dir)
-        video_dir_list = list(map(lambda f: os.path.join(self.video_cache_dir, f), video_dir_list))
-
-        total_dir = image_dir_list + video_dir_list
-
-        indexed_paths = {item['path'] for item in index.values()}
-        keys_to_delete = []
-
+        self.batch_size = batch_size
+        self.scan_batch = scan_batch
+        self.orphan_grace = orphan_grace
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="media-gc")
+        self._scan = None
+        self._failed: set[str] = set() # hashes whose file couldn't be deleted, skipped until the collection ends
+        self.stats = {"ticks": 0, "collections": 0, "deleted": 0, "deleted_bytes": 0, "orphans": 0, "errors": 0,
+                      "last_tick_seconds": 0.0, "max_tick_seconds": 0.0}
+
+    def _walk(self):
+        for folder in (self.image_cache_dir, self.video_cache_dir):
+            with os.scandir(folder) as it:
+                for e in it:
+                    try:
+                        if not e.is_file():
+                            continue
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue # collected since the folder was listed
+                    yield e.path, os.path.splitext(e.name)[0], max(st.st_mtime, st.st_ctime)
+
+    def _next_files(self):
+        return list(itertools.islice(self._scan, self.scan_batch)) # type:ignore
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return e
+        return None
+
+    async def _delete(self, paths: list[str]) -> list[str]:
+        '''Deletes the files on the pool. Returns the paths that are gone.'''
+        if not paths:
+            return []
+        loop = asyncio.get_running_loop()
+        errors = await asyncio.gather(*(loop.run_in_executor(self.pool, self._remove, p) for p in paths))
+        gone = []
+        for p, e in zip(paths, errors):
+            if e is None:
+                gone.append(p)
+            else:
+                self.stats["errors"] += 1
+                await Logger.log_async(f"Error deleting: {p}: {repr(e)}", "error")
+        if gone and self.event_bus:
+            await self.event_bus.sequence_emit(self.event_bus.GARBAGE_COLLECTOR, paths = gone)
+        return gone
+
+    async def _collect_entries(self, index: MediaIndex, entries: list[MediaEntry]) -> int:
+        '''Deletes the entries' files and rows. Returns how many were deleted.'''
+        gone = set(await self._delete([e.path for e in entries]))
+        deleted = [e for e in entries if e.path in gone]
+        self._failed.update(e.hash for e in entries if e.path not in gone)
+        await asyncio.to_thread(index.delete, [e.hash for e in deleted])
+        self.stats["deleted"] += len(deleted)
+        self.stats["deleted_bytes"] += sum(e.size for e in deleted)
+        return len(deleted)
+
+    async def _reconcile(self, index: MediaIndex) -> bool:
+        '''One step of the orphan scan. Returns whether the scan has more to do.'''
+        if self._scan is None:
+            return False
+        files = await asyncio.to_thread(self._next_files)
+        if not files:
+            self._scan = None
+            return False
+        known = await asyncio.to_thread(index.known, [h for _, h, _ in files])
+        recent = datetime.datetime.now().timestamp() - self.orphan_grace
+        # files written moments ago may be waiting for their index row
+        orphans = [p for p, h, changed in files if h not in known and changed < recent]
+        self.stats["orphans"] += len(await self._delete(orphans))
+        return True
+
+    async def tick(self, index: MediaIndex) -> bool:
+        '''One bounded step of a collection. Returns whether there is more to do.'''
+        start = time.perf_counter()
         now = datetime.datetime.now().timestamp()
 
-        for full_path in total_dir:
-            if full_path not in indexed_paths:
-                await asyncio.to_thread(os.remove, full_path)
-
-        for hash_key, data in index.items():
-            if (now - data['last_used']) > self.time_limit:
-                if os.path.exists(data['path']):
-                    if self.event_bus:
-                        await self.event_bus.sequence_emit(self.event_bus.GARBAGE_COLLECTOR, path = data['path'])
-                    await asyncio.to_thread(os.remove, data['path'])
-                keys_to_delete.append(hash_key)
-            
-            elif data['size'] > self.size_threshold_in_mbs and (now - data['last_used']) > (self.time_limit // 2):
-                if os.path.exists(data['path']):
-                    if self.event_bus:
-                        await self.event_bus.sequence_emit(self.event_bus.GARBAGE_COLLECTOR, path = data['path'])
-                    await asyncio.to_thread(os.remove, data['path'])
-                keys_to_delete.append(hash_key)
-            
-        for k in keys_to_delete:
-            del index[k]
-
-        global_size_threshold = self.size_threshold_in_mbs * 100
-
-        current_size = sum(item['size'] for item in index.values())
-        if current_size > global_size_threshold:
-            sorted_keys = sorted(index.keys(), key=lambda k: index[k]['last_used'])
-            
-            for k in sorted_keys:
-                if current_size <= global_size_threshold:
-                    break
-                try:
-                    if self.event_bus:
-                        await self.event_bus.sequence_emit(self.event_bus.GARBAGE_COLLECTOR, path = index[k]['path'])
-                    await asyncio.to_thread(os.remove, index[k]['path'])
-                    current_size -= index[k]['size']
-                    del index[k]
-                except Exception as e: await Logger.log_async(f"Error deleting: {index[k]['path']}: {repr(e)}; {traceback.format_exc()}", "error")
+        # expired entries, and big ones unused for half as long. Entries that failed to delete earlier in the collection are
+        # fetched again but skipped, the queries ask for that many more.
+        failed = len(self._failed)
+        batch = await asyncio.to_thread(index.expired, now - self.time_limit, self.batch_size + failed)
+        batch = [e for e in batch if e.hash not in self._failed][:self.batch_size]
+        if len(batch) < self.batch_size:
+            large = await asyncio.to_thread(index.large_unused, self.size_threshold_in_mbs, now - self.time_limit // 2,
+                                            self.batch_size - len(batch) + failed)
+            seen = {e.hash for e in batch} | self._failed
+            batch += [e for e in large if e.hash not in seen][:self.batch_size - len(batch)]
+        more = len(batch) >= self.batch_size
+
+        # least recently used entries while the cache is over the global budget
+        if not more:
+            over = await asyncio.to_thread(index.total_size) - sum(e.size for e in batch) - self.global_size_threshold
+            if over > 0:
+                seen = {e.hash for e in batch} | self._failed
+                for e in await asyncio.to_thread(index.oldest, self.batch_size + failed):
+                    if over <= 0:
+                        break
+                    if e.hash not in seen:
+                        batch.append(e)
+                        over -= e.size
+                more = over > 0
+
+        # a tick that deletes nothing (only files that can't be deleted are left) ends this part of the collection
+        more = await self._collect_entries(index, batch) > 0 and more
+        more = await self._reconcile(index) or more
+
+        took = time.perf_counter() - start
+        self.stats["ticks"] += 1
+        self.stats["last_tick_seconds"] = took
+        self.stats["max_tick_seconds"] = max(self.stats["max_tick_seconds"], took)
+        return more
+
+    async def gc(self, index: MediaIndex, pause = GC_TICK_PAUSE_SECONDS):
+        '''A full collection: ticks, `pause` seconds apart, until nothing is left to do.'''
+        if self._scan is None:
+            self._scan = self._walk()
+        try:
+            while await self.tick(index):
+                await asyncio.sleep(pause)
+        finally:
+            self._failed.clear()
+        self.stats["collections"] += 1
         if self.event_bus:
             await self.event_bus.sequence_emit(self.event_bus.GARBAGE_COLLECTED)
-        return index
+
+    def metrics(self):
+        return {**self.stats, "scanning": self._scan is not None}
+
+    def close(self):
+        if self._scan is not None:
+            self._scan.close()
+            self._scan = None
+        self.pool.shutdown(wait=True)
 
 class CacheManager:
     def __init__(self, gc_time_limit, gc_limit_size_MBs, gc_interval, cache_folder, event_bus: None | EventBus = None) -> None:
         self.gc_interval = gc_interval
-        self.lock = asyncio.Lock()
+        self.lock = asyncio.Lock() # serialises copies into the cache, index reads and writes don't need it
         self.cache_dir = cache_folder
         self.cache_index_file = os.path.join(self.cache_dir, 'index.json')
         self.images_dir = os.path.join(self.cache_dir, "images")
@@ -91,7 +192,11 @@ class CacheManager:
 
         self.gc = GarbageCollector(self.images_dir, self.videos_dir, gc_time_limit, gc_limit_size_MBs)
 
-        self.cache_index = {}
+        # `cache_index_file` is the index.json of older versions, imported into the database when it's first opened
+        self.index = MediaIndex(os.path.join(self.cache_dir, 'index.sqlite'), self.cache_index_file)
+        self.hasher = FileHasher()
+        # encodings of cached media, handed to the models' input handlers (see `AI.load_models`)
+        self.payloads = PayloadCache(os.path.join(self.cache_dir, "payloads"), self.hasher)
         self.event_bus = event_bus
 
     async def init(self):
@@ -102,31 +207,24 @@ class CacheManager:
     async def _garbage_collect(self):
         while True:
             await asyncio.sleep(self.gc_interval)
-            idx = await self.gc.gc(deepcopy(self.cache_index))
-            async with self.lock:
-                self.cache_index = idx
-            await self.save()
+            await self.gc.gc(self.index)
 
 
-    def _hash_file(self, file_path, sample_size=1024 * 1024):
-        file_size = os.path.getsize(file_path)
-        sha256_hash = hashlib.sha256()
+    def _hash_file(self, file_path):
+        return self.hasher.hash_file(file_path)
 
-        sha256_hash.update(str(file_size).encode())
-
-        with open(file_path, "rb") as f:
-            if file_size <= sample_size * 3:
-                sha256_hash.update(f.read())
-            else:
-                sha256_hash.update(f.read(sample_size))
+    def get_gc_stats(self):
+        return self.gc.metrics()
 
-                f.seek(file_size // 2)
-                sha256_hash.update(f.read(sample_size))
+    def get_hash_stats(self):
+        return self.hasher.metrics()
 
-                f.seek(-sample_size, 2)
-                sha256_hash.update(f.read(sample_size))
+    def get_payload_stats(self):
+        return self.payloads.metrics()
 
-        return sha256_hash.hexdigest()
+    async def get_ingest_stats(self):
+        '''Files and bytes in the cache per ingest strategy (reflink, hardlink, ...; "" for files cached before it was recorded).'''
+        return await asyncio.to_thread(self.index.strategies)
     
     async def cache_file(self, file_path:str, skip_if_missing = True):
         if not (file_path and os.path.exists(file_path)):
@@ -142,8 +240,10 @@ class CacheManager:
 
         if ext in IMAGE_EXTs:
             dest = self.images_dir
+            kind = "image"
         elif ext in VIDEO_EXTs:
             dest = self.videos_dir
+            kind = "video"
         else:
             await Logger.log_async(F"{file_path} isn't a supported format!", 'error')
             if skip_if_missing:
@@ -155,75 +255,74 @@ class CacheManager:
             await Logger.log_async(f"An error occurred processing the filename of {file_path}", 'error')
             return
         
-        try:
-            hashed = await asyncio.to_thread(self._hash_file, file_path)
-        except Exception as e:
-            await Logger.log_async(f"An error occurred while hashing: {repr(e)}; {traceback.format_exc()}", 'error')
-            hashed = None
-
-        if not hashed:
-            await Logger.log_async(f"Hashing for {file_path} failed.", 'error')
-            if skip_if_missing:
-                return
-            else:
-                raise Exception(f"Hashing for {file_path} failed.")
-        
         ext = f".{ext}" if not ext.startswith('.') else ext
 
-        cached = f"{hashed}{ext}"
-
-        dest = os.path.join(dest, cached)
-
         d = datetime.datetime.now()
 
         async with self.lock:
-            if not os.path.exists(dest):
-                await asyncio.to_thread(shutil.copy, src=file_path, dst=dest)
-                file_size = await asyncio.to_thread(os.path.getsize, dest)
-            else:
-                self.cache_index[hashed]['last_used'] = d.timestamp()
-                file_size = self.cache_index[hashed]['size']
+            # reflinked / hardlinked / copied in the kernel where possible, see `media_ingest`
+            try:
+                hashed, dest, strategy = await asyncio.to_thread(self.hasher.copy_into, file_path, dest, ext, self.cache_dir)
+            except Exception as e:
+                await Logger.log_async(f"An error occurred while hashing: {repr(e)}; {traceback.format_exc()}", 'error')
+                hashed = None
+
+            if not hashed:
+                await Logger.log_async(f"Hashing for {file_path} failed.", 'error')
+                if skip_if_missing:
+                    return
+                else:
+                    raise Exception(f"Hashing for {file_path} failed.")
+
+            if strategy is None and not await asyncio.to_thread(self.index.touch, [hashed], d.timestamp()):
+                return dest # already cached and indexed
 
-            self.cache_index[hashed] = {'path': dest, "last_used": d.timestamp(), 'size': file_size}
+            file_size = await asyncio.to_thread(os.path.getsize, dest)
+            await asyncio.to_thread(self.index.put, MediaEntry(hashed, dest, file_size, d.timestamp(), kind, strategy or ""))
 
-        await self.save()
         return dest
+
+    def _cached_hash(self, path):
+        '''Hash of a file inside the cache (its name without the extension), None for any other path.'''
+        folder = os.path.dirname(os.path.abspath(path))
+        if folder in (os.path.abspath(self.images_dir), os.path.abspath(self.videos_dir)):
+            return os.path.splitext(os.path.basename(path))[0]
+        return None
     
-    async def context_resolver(self, context, file_name_key=FILE_NAME_KEY, max_keeps=1):
-        resolved_context = deepcopy(context)
+    def prune_media(self, context, file_name_key=FILE_NAME_KEY, max_keeps=1):
+        '''
+        `context` with the media of all but the newest `max_keeps` media messages replaced by a note. Messages are not modified:
+        pruned ones are new records, the others are returned as they are.
+        '''
         found_files = 0
         l = []
-
-        def normalise_context(context):
-            resolved_context = []
-            # ...
-            return context
-        
-        resolved_context = normalise_context(resolved_context)
-
-        for msg in reversed(resolved_context):
+        for msg in reversed(context):
             if file_name_key in msg and msg[file_name_key]:
                 found_files += 1
                 if found_files > max_keeps:
-                    file_name = msg.pop(file_name_key, "Unknown File")
+                    file_name = msg.get(file_name_key, "Unknown File")
                     note = f"\n\n[System: Media '{file_name}' removed from active memory.]"
-                    if isinstance(msg["content"], str):
-                        msg["content"] += note
-                    elif isinstance(msg["content"], list):
-                        msg["content"].append({"type": "text", "text": note})
-                else:
-                    file_name = msg[file_name_key]
-                    async with self.lock:
-                        d = self.cache_index.get(file_name)
-                        if not d:
-                            await Logger.log_async(f"{file_name} doesn't exist in cache, attempting to cache...", 'warn')
-                            await self.cache_file(file_name,)
-                        else:
-                            d["last_used"] = datetime.datetime.now().timestamp()
-
+                    content = msg["content"]
+                    if isinstance(content, str):
+                        content = content + note
+                    elif isinstance(content, (list, tuple)):
+                        content = (*content, {"type": "text", "text": note})
+                    msg = freeze({**{k: v for k, v in msg.items() if k != file_name_key}, "content": content})
             l.append(msg)
+        l.reverse()
+        return l
 
-        l = list(reversed(l))
+    async def context_resolver(self, context, file_name_key=FILE_NAME_KEY, max_keeps=1):
+        '''Model ready copy of `context`: stale media pruned (see `prune_media`), kept media touched in the cache, bookkeeping fields dropped.'''
+        l = self.prune_media(context, file_name_key, max_keeps)
+
+        files = {msg[file_name_key]: self._cached_hash(msg[file_name_key]) for msg in l if msg.get(file_name_key)}
+        if files:
+            missing = await asyncio.to_thread(self.index.touch, [h for h in files.values() if h], datetime.datetime.now().timestamp())
+            for file_name, hashed in files.items():
+                if hashed is None or hashed in missing:
+                    await Logger.log_async(f"{file_name} doesn't exist in cache, attempting to cache...", 'warn')
+                    await self.cache_file(file_name,)
 
         c = []
         for msg in l:
@@ -252,37 +351,53 @@ class CacheManager:
             await Logger.log_async(f"Hashing for {file_path} failed.", 'error')
             raise Exception(f"Hashing for {file_path} failed.")
 
-        async with self.lock:
-            if hashed in self.cache_index:
-                self.cache_index[hashed]["last_used"] = datetime.datetime.now().timestamp()
-                return self.cache_index[hashed]['path']
+        entry = await asyncio.to_thread(self.index.get, hashed)
+        if entry and os.path.exists(entry.path):
+            await asyncio.to_thread(self.index.touch, [hashed], datetime.datetime.now().timestamp())
+            return entry.path
                 
         if auto_cache:
             return await self.cache_file(file_path)
 
-    async def save(self):
-        data_to_save = json.dumps(self.cache_index, indent=2)
-
-        async with aiofiles.open(self.cache_index_file,'w') as f:
-            await f.write(data_to_save)
+    def _remove_stale_temp_files(self, grace = GC_ORPHAN_GRACE_SECONDS):
+        '''
+        Deletes the `.<uuid>.tmp` files that copies into the cache (`FileHasher.copy_into`) and payload spills leave behind
+        when interrupted, the GC only scans the media folders. Returns the number of files and bytes deleted.
+        '''
+        before = time.time() - grace # another process may still be writing newer ones
+        removed, size = 0, 0
+        for folder in (self.cache_dir, self.payloads.folder):
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as it:
+                for e in it:
+                    if not (e.name.startswith(".") and e.name.endswith(".tmp")):
+                        continue
+                    try:
+                        st = e.stat()
+                        if st.st_mtime < before:
+                            os.remove(e.path)
+                            removed += 1
+                            size += st.st_size
+                    except FileNotFoundError:
+                        pass
+        return removed, size
 
     async def load(self):
-        try:
-            async with aiofiles.open(self.cache_index_file) as file:
-                content = await file.read()
-                content = json.loads(content)
-                self.cache_index = content
-        except (FileNotFoundError, json.JSONDecodeError):
-            await Logger.log_async("Cache index missing or corrupted. Starting over.", "warn")
-            self.cache_index = {}
+        '''Opens the index (importing an old index.json once) and deletes temporary files left by interrupted copies.'''
+        entries = await asyncio.to_thread(self.index.count)
+        await Logger.log_async(f"Media cache index: {entries} file(s)", "info")
+        removed, size = await asyncio.to_thread(self._remove_stale_temp_files)
+        if removed:
+            await Logger.log_async(f"Removed {removed} unfinished cache copies ({size / 1024 ** 2:.1f} MBs)", "info")
 
     async def shutdown(self):
-        index = await self.gc.gc(deepcopy(self.cache_index))
-        self.cache_index = index
-        await self.save()
         for task in list(self.running_tasks):
             task.cancel()
             try:
                 await task
             except asyncio.CancelledError:
-                pass
\ No newline at end of file
+                pass
+        await self.gc.gc(self.index)
+        await asyncio.to_thread(self.gc.close)
+        await asyncio.to_thread(self.index.close)
\ No newline at end of file
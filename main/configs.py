@@ -1,3 +1,5 @@
+import os
+
 STREAM_DISABLED= ["discord", "cli-no-stream", 'web-no-stream',]
 
 IMAGE_EXTs = ['.png', '.jpg', '.jpeg', ]
@@ -8,9 +10,93 @@ ERROR_TOKEN = "ERROR_TOKEN"
 FILE_NAME_KEY = 'file_path'
 EMBEDDING_MODEL_ROLE = "embedding"
 RAG_MIN_SCORE = 0.4
+TRIM_TURN_NUM = 3 # Oldest turns dropped when a conversation is far over the summariser budget.
 # May affect streaming speed:
 INSTANT_TOOL_EXEC: bool = False # Instantly execute the tool as soon it appears in the stream instead of collecting every tool call in the stream before execution.
 ENV_READ_PREFIX = '$'
+# Models are warmed up concurrently, at most WARMUP_CONCURRENCY at once, in this role order. Unlisted roles go last.
+# AI.init only blocks on WARMUP_CRITICAL_ROLES, the rest keep warming up in the background until the end of init.
+WARMUP_CONCURRENCY = 2
+WARMUP_PRIORITY = ["router", "chat", "cot", "summariser", "vision"]
+WARMUP_CRITICAL_ROLES = ["router", "chat"]
+# MultiServer only: unload idle models, least recently used first, when their servers use more than this many MBs (None disables it).
+# Pinned roles are never unloaded.
+RESIDENCY_MEMORY_BUDGET_MB: int | None = None
+RESIDENCY_CHECK_INTERVAL = 15
+RESIDENCY_PINNED_ROLES = ["router"]
+# Generations per model are admitted by priority (router > interactive > background summarisation). Local models run as many at once as
+# the server's OLLAMA_NUM_PARALLEL (SCHEDULER_DEFAULT_PARALLEL when unset), remote APIs SCHEDULER_REMOTE_PARALLEL.
+SCHEDULER_MAX_QUEUE = 32
+SCHEDULER_DEFAULT_PARALLEL = 1
+SCHEDULER_REMOTE_PARALLEL = 4
+# RAG embeddings are cached by (embedder model, sha256 of the text). None / "" keeps the cache in memory only.
+EMBEDDING_CACHE_PATH: str | None = "./RAG_DB_cache/embeddings.sqlite"
+EMBEDDING_CACHE_MEMORY_ITEMS = 4096
+# RAG embedding keeps up to EMBED_MAX_IN_FLIGHT batches in flight, sized to take about EMBED_TARGET_BATCH_SECONDS each.
+EMBED_MAX_IN_FLIGHT = 4
+EMBED_TARGET_BATCH_SECONDS = 1.0
+EMBED_MAX_BATCH_SIZE = 128
+EMBED_BATCH_RETRIES = 2
+# The RAG full-text index is rebuilt in a worker process once writes have been quiet for FTS_DEBOUNCE_SECONDS,
+# FTS_MAX_PENDING_WRITES rows are waiting or the oldest write is FTS_MAX_DELAY_SECONDS old.
+FTS_DEBOUNCE_SECONDS = 5
+FTS_MAX_PENDING_WRITES = 256
+FTS_MAX_DELAY_SECONDS = 60
+# Document ingestion streams groups of about INGEST_GROUP_CHARS characters through reader -> chunker -> embedder -> writer,
+# with at most INGEST_QUEUE_SIZE groups buffered between stages. Big PDFs are parsed in a process pool.
+INGEST_GROUP_CHARS = 200_000
+INGEST_QUEUE_SIZE = 2
+INGEST_TEXT_SEGMENT_BYTES = 1024 * 1024
+INGEST_PDF_PAGES_PER_TASK = 8
+INGEST_PDF_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+INGEST_PDF_PROCESS_MIN_PAGES = 64
+# Token counter for RAG chunking: None for the character estimate, or e.g. "tiktoken:cl100k_base" (needs `tiktoken`).
+CHUNK_TOKENIZER = None
+# Token counter for conversation budgets (when to summarise / trim), same options as CHUNK_TOKENIZER.
+CONVERSATION_TOKENIZER = None
+# Conversations are saved as a snapshot plus an append-only log; the log is compacted into a new snapshot once it holds
+# CONVERSATION_LOG_MAX_RECORDS records or CONVERSATION_LOG_MAX_BYTES bytes.
+CONVERSATION_LOG_MAX_RECORDS = 200
+CONVERSATION_LOG_MAX_BYTES = 1024 * 1024
+CONVERSATION_LOG_FSYNC = True
+# At most CONVERSATION_CACHE_MAX_LOADED conversations / CONVERSATION_CACHE_MAX_MBS of them keep their messages in memory,
+# idle ones beyond that are dropped (least recently used first) and re-read on their next access.
+CONVERSATION_CACHE_MAX_LOADED = 64
+CONVERSATION_CACHE_MAX_MBS = 256
+# Conversations are summarised in the background once they had no new turn for SUMMARY_DEBOUNCE_SECONDS, or at the latest
+# SUMMARY_MAX_DELAY_SECONDS after their first unsummarised turn.
+SUMMARY_DEBOUNCE_SECONDS = 3
+SUMMARY_MAX_DELAY_SECONDS = 30
+# Backlogs longer than one summariser window are summarised window by window (map) and merged (reduce) instead of being cut
+# to the first window. Windows run SUMMARY_MAP_CONCURRENCY at a time when the summariser model has no admission limit.
+SUMMARY_HIERARCHICAL = True
+SUMMARY_MAP_CONCURRENCY = 2
+# Conversations are saved write-behind: SAVE_WINDOW_SECONDS after their last change, at the latest SAVE_MAX_DELAY_SECONDS after
+# the first unsaved one, SAVE_CONCURRENCY at a time. A crash loses at most that much.
+SAVE_WINDOW_SECONDS = 1.0
+SAVE_MAX_DELAY_SECONDS = 5.0
+SAVE_CONCURRENCY = 4
+# Hash of cached media: "sha256", "blake3", "xxh3" (need the `blake3` / `xxhash` packages) or "auto" (blake3 when installed).
+# Files cached under a different algorithm are cached again on their next use, the old copies age out through the GC.
+# The MEDIA_HASH_MEMO_SIZE most recent digests are kept by (device, inode, size, mtime) so unchanged files aren't read again.
+MEDIA_HASH_ALGORITHM = "auto"
+MEDIA_HASH_MEMO_SIZE = 4096
+# New media goes into the cache as a reflink, then a hardlink, then an in-kernel copy, then a plain copy (main/media_ingest.py).
+# Hardlinks share the file with the original, so by default ("readonly") only sources without write permission are linked;
+# "always" / "never" to change that.
+MEDIA_INGEST_HARDLINK = "readonly"
+# Media cache GC: each tick deletes at most GC_BATCH_SIZE files (GC_DELETE_WORKERS threads) and checks GC_SCAN_BATCH files of
+# the cache folders for orphans, ticks run GC_TICK_PAUSE_SECONDS apart until the collection is done. Files changed less than
+# GC_ORPHAN_GRACE_SECONDS ago are never treated as orphans (they may be waiting for their index row).
+GC_BATCH_SIZE = 256
+GC_SCAN_BATCH = 1024
+GC_DELETE_WORKERS = 4
+GC_TICK_PAUSE_SECONDS = 0.05
+GC_ORPHAN_GRACE_SECONDS = 300
+# Encoded media (base64 images / audio, sampled video frames) is kept per (media hash, model, frame stride, format): the
+# most recent PAYLOAD_CACHE_MEMORY_MBS in memory, older encodings spilled to <cache folder>/payloads up to PAYLOAD_CACHE_DISK_MBS.
+PAYLOAD_CACHE_MEMORY_MBS = 256
+PAYLOAD_CACHE_DISK_MBS = 2048
 USERNAME = "User"
 
 DEFAULT_PROMPT: str = r"""
@@ -1,34 +1,55 @@
-from .utils import Logger, estimate_tokens
-from .configs import FILE_NAME_KEY, TRIM_TURN_NUM
+from .utils import Logger
+from .configs import FILE_NAME_KEY, TRIM_TURN_NUM, CONVERSATION_CACHE_MAX_LOADED, CONVERSATION_CACHE_MAX_MBS, CONVERSATION_TOKENIZER
 import json 
 import asyncio
 import uuid
-import aiofiles 
 from copy import deepcopy
 from .models.model_instance import LocalModel
 from .models.models_profile import RemoteModel
 from .summariser import Summariser
+from .summary_worker import SummaryWorker
+from .save_flusher import SaveFlusher
 from .cache_manager import CacheManager
 import os
 import traceback
 import datetime
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
 from .events import EventBus
+from .conversation_log import ConversationLog, write_atomic
+from .conversation_index import ConversationIndex, IndexEntry, stat_files, search_rows
+from .messages import Message, freeze, freeze_all, encode
+from .tokens import TokenLedger, make_token_counter
 
 class ContextManager:
     def __init__(self, context_dir, summary_model: LocalModel | RemoteModel | None, summary_max_tokens = 4000, keep_tokens_after_summary = 2000, 
                  min_recent_turns = 3, cache_folder = './cache', 
-                 gc_time_limit = 259200, gc_limit_size_MBs = 50, gc_interval = 1800, event_bus : None | EventBus = None):
+                 gc_time_limit = 259200, gc_limit_size_MBs = 50, gc_interval = 1800, event_bus : None | EventBus = None,
+                 max_loaded_conversations = CONVERSATION_CACHE_MAX_LOADED, max_loaded_MBs = CONVERSATION_CACHE_MAX_MBS,
+                 tokenizer = CONVERSATION_TOKENIZER):
         
         self.context_dir = context_dir
         self.conversations:dict[str, Conversation] = {}
 
+        # every saved conversation is registered, only the `loaded` ones (LRU order) hold their messages
+        self.loaded: OrderedDict[str, Conversation] = OrderedDict()
+        self.max_loaded_conversations = max_loaded_conversations
+        self.max_loaded_bytes = max_loaded_MBs * 1024 ** 2
+        self.memory_stats = {"loads": 0, "evictions": 0}
+
         self.lock = asyncio.Lock()
 
         self.summariser = Summariser(summary_model,  summary_max_tokens, keep_tokens_after_summary, min_recent_turns, TRIM_TURN_NUM, event_bus)
+        self.summary_worker = SummaryWorker(self._summarise)
+        self.token_counter = make_token_counter(tokenizer)
+        self.flusher = SaveFlusher(self._flush_one)
 
         self.cache_manager = CacheManager(gc_time_limit, gc_limit_size_MBs, gc_interval, cache_folder, event_bus)
 
         os.makedirs(self.context_dir, exist_ok=True)
+        self.index = ConversationIndex(os.path.join(self.context_dir, "conversations.sqlite"))
+        self.search_task: asyncio.Task | None = None
         self.event_bus = event_bus
 
     async def init(self):
@@ -39,15 +60,60 @@ class ContextManager:
             await Logger.log_async(f"'{cid}' isn't in the registry", 'warn')
             return []
         c = self.conversations[cid]
-        await c.flush_queue()
-        async with c.lock:
-            
-            context = await self.cache_manager.context_resolver(c.messages, file_name_key ,max_keeps)
-            
-            if auto_save:
-                c.messages = context
+        async with c.in_use():
+            await c.flush_queue()
+            async with c.lock:
+                records = self.cache_manager.prune_media(c.messages, file_name_key, max_keeps)
+                context = await self.cache_manager.context_resolver(records, file_name_key ,max_keeps)
+                
+                if auto_save and any(a is not b for a, b in zip(records, c.messages)):
+                    c.messages = records
+                    self._changed(c)
             
         return context
+
+    def _touch(self, convo: 'Conversation'):
+        '''Access hook of every saved conversation: marks it most recently used and evicts idle ones over the budget.'''
+        if convo.temp or not convo.loaded:
+            return
+        key = convo.key
+        if key in self.loaded:
+            self.loaded.move_to_end(key)
+        else:
+            self.loaded[key] = convo
+            self.memory_stats["loads"] += 1
+        self._evict(convo)
+
+    def _changed(self, convo: 'Conversation'):
+        '''Change hook of every saved conversation: leaves the save to the write-behind flusher.'''
+        if not convo.temp:
+            self.flusher.mark(convo.key)
+
+    async def _flush_one(self, cid):
+        c = self.conversations.get(cid)
+        if c is not None and not c.temp:
+            await c.save()
+
+    def _evict(self, keep: 'Conversation | None' = None):
+        total = sum(c.byte_size for c in self.loaded.values())
+        for key, c in list(self.loaded.items()):
+            if len(self.loaded) <= self.max_loaded_conversations and total <= self.max_loaded_bytes:
+                break
+            if c is keep or not c.is_idle:
+                continue
+            total -= c.byte_size
+            c.unload()
+            del self.loaded[key]
+            self.memory_stats["evictions"] += 1
+
+    def get_memory_stats(self):
+        return {**self.memory_stats, "registered": len(self.conversations), "loaded": len(self.loaded),
+                "loaded_bytes": sum(c.byte_size for c in self.loaded.values()), "max_loaded": self.max_loaded_conversations,
+                "max_loaded_bytes": self.max_loaded_bytes}
+
+    def get_save_stats(self):
+        '''Write-behind state: conversations waiting to be saved (`dirty`), saves in progress and save / flush latencies.'''
+        return self.flusher.metrics()
     
 
     async def add_and_maintain(self, cid, data:dict | list[dict] | tuple[dict], update:bool = False):
@@ -56,32 +122,100 @@ class ContextManager:
             return
         
         convo = self.conversations[cid]
-        await convo.append(data, update)
-        await convo.flush_queue()
-
-        meta = await convo.get_states()
+        async with convo.in_use():
+            await convo.append(data, update)
+            await convo.flush_queue()
+            self._changed(convo)
+
+        # summarising is left to the background worker, generations keep using the last finished summary meanwhile
+        self.summary_worker.request(cid)
+
+    async def _summarise(self, cid):
+        '''
+        `SummaryWorker` job: summarises a copy of the conversation without holding its lock and applies the result if the messages
+        were only appended to meanwhile (the new ones are kept after the summarised part). Returns False, to be retried, if the
+        messages were replaced (edit, reset, an earlier trim) while the summariser ran.
+        '''
+        convo = self.conversations.get(cid)
+        if convo is None:
+            return True
+
+        async with convo.in_use():
+            meta = await convo.get_states()
+            async with convo.lock:
+                base = convo.messages
+                gen = convo._rewrite_gen
+                tokens = convo.token_count
 
-        r = await self.summariser.maybe_summarise_context(convo.messages, meta)
-        if r:
+            r = await self.summariser.maybe_summarise_context(base, meta, tokens=tokens)
+            if not r:
+                return True
             meta, c = r
-
-            if estimate_tokens(" ".join([m.get('content', '') for m in c])) >= self.summariser.summary_max_tokens * 3:
-                c = c[TRIM_TURN_NUM:]
+            # the summariser hands the same sequence back when it didn't summarise, only replaced messages need a snapshot rewrite
+            replaced = c is not base
 
             async with convo.lock:
-                s = meta['summary']
-                f = meta['facts']
-                d = meta.get('key_decisions', [])
-                o = meta.get('open_threads', [])
-                c = convo.attach_meta(c)
-                convo.summary = s
-                convo.facts = f
-                convo.decisions = d
-                convo.threads = o
-                convo.messages = c
-
-        if not convo.temp:
-            await self.save(cid)
+                if self.conversations.get(cid) is not convo:
+                    return True
+                if convo._rewrite_gen != gen:
+                    await Logger.log_async(f"{cid} changed while it was summarised, discarding the summary", 'warn')
+                    return False
+
+                convo.summary = meta['summary']
+                convo.facts = meta['facts']
+                convo.decisions = meta.get('key_decisions', [])
+                convo.threads = meta.get('open_threads', [])
+                if replaced:
+                    convo.messages = convo.attach_meta(list(c)) + list(convo._messages[len(base):])
+                if convo.tokens.total >= self.summariser.summary_max_tokens * 3:
+                    convo.messages = convo._messages[TRIM_TURN_NUM:]
+
+            self._changed(convo)
+        return True
+
+    async def search(self, query: str, limit = 20, cid = None):
+        '''Full-text search over the messages of all saved conversations (or of `cid`), best matches first.'''
+        hits = await asyncio.to_thread(self.index.search, query, limit, cid)
+        results = []
+        for h in hits:
+            c = self.conversations.get(h.id)
+            if c is None:
+                continue
+            results.append({"id": h.id, "name": c.name, "msg_idx": h.msg_idx, "msg_id": h.msg_id, "role": h.role,
+                            "snippet": h.snippet, "score": -h.score})
+        return results
+
+    async def rebuild_search_index(self, cids = None):
+        '''
+        Reindexes the saved messages of `cids` (all saved conversations by default) from their files, or from memory for loaded
+        ones. Runs in the background at startup for conversations the index is behind on. Returns the number of messages indexed.
+        '''
+        total = 0
+        for cid in list(cids if cids is not None else self.conversations):
+            c = self.conversations.get(cid)
+            if c is None or c.temp or c.store is None:
+                continue
+            async with c.save_lock:
+                if c.loaded:
+                    messages = c._messages[:c._persisted]
+                else:
+                    try:
+                        state = await asyncio.to_thread(ConversationLog(c.path).read)
+                    except (OSError, json.JSONDecodeError) as e:
+                        await Logger.log_async(f"Skipping {cid} while indexing for search: {e}", 'warn')
+                        continue
+                    messages = (state or {}).get("conversation", [])
+                rows = search_rows(messages)
+                await asyncio.to_thread(self.index.index_messages, c.key, rows, len(messages), True)
+            total += len(rows)
+        return total
+
+    async def _index_behind(self, cids):
+        try:
+            n = await self.rebuild_search_index(cids)
+            await Logger.log_async(f"Search index caught up on {len(cids)} conversation(s), {n} message(s)", 'info')
+        except Exception as e:
+            await Logger.log_async(f"Building the search index failed: {e}; {traceback.format_exc()}", 'error')
 
     async def get_context(self, cid):
         if not cid in self.conversations:
@@ -116,7 +250,7 @@ class ContextManager:
         while cid in self.conversations.keys():
             cid = str(uuid.uuid4())
 
-        convo = Conversation("", cid)
+        convo = Conversation("", cid, counter=self.token_counter)
         convo.id = cid
         convo.name = "Temporary chat"
         convo.set_temp(True)
@@ -131,14 +265,14 @@ class ContextManager:
 
         path = os.path.join(self.context_dir, f"{cid}.json")
         
-        convo = Conversation(path, cid)
+        convo = Conversation(path, cid, self.index, self._touch, self.token_counter, self._changed)
         convo.id = cid
         convo.name = name
         
         async with self.lock:
             self.conversations[cid] = convo
             
-        await convo.save()
+        self._changed(convo)
         return convo
     
     async def delete_conversation(self, cid):
@@ -149,14 +283,19 @@ class ContextManager:
         async with self.lock:
             c = self.conversations[cid]
             if not c.temp:
-                p = c.path
-                await c.save()
-                if not os.path.exists(p):
+                # a conversation whose first save is still pending has no file yet
+                unsaved = self.flusher.cancel(cid)
+                if not os.path.exists(c.path) and not unsaved:
                     await Logger.log_async(f"'{cid}'doesn't exist.", 'warn')
                     return
                 
-                if not c.temp and os.path.exists(c.path):
-                    await asyncio.to_thread(os.remove, c.path)
+                async with c.save_lock:
+                    await asyncio.to_thread(c.store.delete) # type:ignore
+                    c.store = None
+                await asyncio.to_thread(self.index.delete, [cid])
+                self.loaded.pop(cid, None)
+
+            self.summary_worker.cancel(cid)
 
             del self.conversations[cid]
     
@@ -168,8 +307,9 @@ class ContextManager:
             {
                 'id': c.id,
                 'name': c.name,
-                'last_used': c.last_used
-             
+                'last_used': c.last_used,
+                'message_count': c.message_count,
+                'byte_size': c.byte_size
             }
             for c in convos if not c.temp
         ]
@@ -185,7 +325,16 @@ class ContextManager:
         return self.conversations[cid]
 
     async def shut_down(self): 
+        await self.summary_worker.close()
+        if self.search_task is not None:
+            self.search_task.cancel()
+            try:
+                await self.search_task
+            except asyncio.CancelledError:
+                pass
         await self.save_all()
+        await self.flusher.close()
+        await asyncio.to_thread(self.index.close)
         await self.cache_manager.shutdown()
         await Logger.log_async("Context saved and context manager shut down.", "info")
 
@@ -207,59 +356,235 @@ class ContextManager:
             return 
         
         files = await asyncio.to_thread(os.listdir, self.context_dir)
+        paths = {i.removesuffix('.json'): os.path.join(self.context_dir, i) for i in files if i.endswith('.json')}
+        entries = await asyncio.to_thread(self.index.all)
+        stats = await asyncio.to_thread(lambda: {cid: stat_files(p, ConversationLog(p).log_path) for cid, p in paths.items()})
+
+        # conversations whose files match their index row are registered from the row alone, the rest are parsed once
         convos = []
-        for i in files:
-            if not i.endswith('.json'): continue
-            path = os.path.join(self.context_dir, i)
-            cid = i.removesuffix('.json')
-            convo = Conversation(path, cid)
-            await convo.load()
+        stale = []
+        legacy = []
+        for cid, path in paths.items():
+            entry = entries.get(cid)
+            if entry and (entry.snapshot_mtime_ns, entry.snapshot_size, entry.log_size) == stats[cid]:
+                convo = Conversation.from_index(path, entry, self.index, self._touch, self.token_counter, self._changed)
+            else:
+                convo = Conversation(path, cid, self.index, self._touch, self.token_counter, self._changed)
+                await convo.load()
+                if convo.store and convo.store.legacy:
+                    legacy.append(convo)
+                else:
+                    stale.append(convo)
             convos.append((cid, convo))
 
+        for convo in legacy:
+            await convo.save()
+        if legacy:
+            await Logger.log_async(f"Migrated {len(legacy)} conversation(s) to snapshot + log storage", 'info')
+        if stale:
+            await asyncio.to_thread(self.index.upsert, [c.index_entry() for c in stale])
+        for convo in stale + legacy:
+            convo.unload()
+
+        missing = [cid for cid in entries if cid not in paths]
+        if missing:
+            await asyncio.to_thread(self.index.delete, missing)
+
         convos = sorted(convos, key=lambda x: x[1].last_used, reverse=True)
         async with self.lock:
             for i, c in convos:
                 self.conversations[i] = c
+
+        # conversations saved before the search index existed, or whose last index update was lost
+        indexed = await asyncio.to_thread(self.index.search_state)
+        behind = [cid for cid, c in convos if indexed.get(c.key) != c.message_count]
+        if behind:
+            self.search_task = asyncio.create_task(self._index_behind(behind))
     
     async def save_all(self):
-        for i in list(self.conversations.values()):
-            if not i.temp:
-                await i.save()
+        '''Saves every loaded conversation now, in parallel (unloaded ones have nothing unsaved).'''
+        for cid, c in list(self.conversations.items()):
+            if c.loaded and not c.temp:
+                self.flusher.mark(cid)
+        await self.flusher.flush()
 
 class Conversation:
-    def __init__(self, path:str, uuid_= None) -> None:
+    def __init__(self, path:str, uuid_= None, index: ConversationIndex | None = None, on_access = None, counter = None,
+                 on_change = None) -> None:
         self.path = path
         self.summary = ""
         self.threads = []
         self.decisions = []
         self.facts = []
-        self.messages = []
+        self._messages: tuple[Message, ...] = ()
         self.lock = asyncio.Lock()
+        self.save_lock = asyncio.Lock()
         self.queue = asyncio.Queue()
         self.id = uuid_ or str(uuid.uuid4())
         self.name = "New chat"
         self.last_used = -1
         self.temp = False
+        self.store = ConversationLog(path) if path else None
+        self.key = os.path.basename(path).removesuffix('.json') if path else self.id
+        self.index = index
+
+        # conversations registered from the index start unloaded: messages and summary data are read on first access,
+        # and `on_access(self)` lets the owner keep them in its LRU
+        self.loaded = True
+        self.on_access = on_access
+        # `on_change(self)` is told about changes to save (write-behind), without it they are saved right away
+        self.on_change = on_change
+        self.load_lock = asyncio.Lock()
+        self.users = 0
+        self._message_count = 0
+        self._byte_size = 0
+
+        # token counts of the loaded messages, kept up to date by every change of `_messages`
+        self.tokens = TokenLedger(counter)
+
+        # what the store already holds: messages[:_persisted] and _persisted_meta. Assigning `messages` bumps _rewrite_gen,
+        # which makes the next save compact instead of append.
+        self._persisted = 0
+        self._persisted_meta = {}
+        self._rewrite_gen = 1
+        self._persisted_gen = 0
+
+    @classmethod
+    def from_index(cls, path: str, entry: IndexEntry, index: ConversationIndex | None = None, on_access = None, counter = None,
+                   on_change = None):
+        c = cls(path, entry.id, index, on_access, counter, on_change)
+        c.name = entry.name
+        c.last_used = entry.last_used
+        c._message_count = entry.message_count
+        c._byte_size = entry.byte_size
+        c.loaded = False
+        return c
+
+    @property
+    def messages(self) -> tuple[Message, ...]:
+        '''Immutable snapshot (a tuple of read-only records). Assign a new sequence to change it.'''
+        if not self.loaded:
+            # callers should `await ensure_loaded()` first, this keeps direct attribute access working
+            self._apply(self.store.read() if self.store else None)
+            if self.on_access:
+                self.on_access(self)
+        return self._messages
+
+    @messages.setter
+    def messages(self, value):
+        value = freeze_all(value)
+        self.tokens.replace(self._messages, value)
+        self._messages = value
+        self._rewrite_gen += 1
+
+    @property
+    def token_count(self) -> float:
+        '''Tokens of the loaded messages plus summary, facts, decisions and open threads. O(1) unless those were replaced.'''
+        return self.tokens.total + self.tokens.meta_tokens(self.summary, self.facts, self.decisions, self.threads)
+
+    def _meta(self):
+        return {"summary":self.summary, "facts": self.facts,"key_decisions": self.decisions, "open_threads": self.threads,
+                "id": self.id, 'name': self.name, 'last_used': self.last_used}
+
+    @property
+    def message_count(self):
+        return len(self._messages) + self.queue.qsize() if self.loaded else self._message_count
+
+    @property
+    def byte_size(self):
+        if self.loaded and self.store:
+            return self.store.snapshot_bytes + self.store.log_bytes
+        return self._byte_size
+
+    @property
+    def dirty(self):
+        return (self._rewrite_gen != self._persisted_gen or self._persisted != len(self._messages) or not self.queue.empty()
+                or self._meta() != self._persisted_meta)
+
+    @property
+    def is_idle(self):
+        '''Loaded, saved and nobody is using it, so `unload` loses nothing.'''
+        return (self.loaded and not self.temp and self.users == 0 and not self.lock.locked() and not self.save_lock.locked()
+                and not self.dirty)
+
+    @asynccontextmanager
+    async def in_use(self):
+        '''Keeps the conversation loaded for the duration of the block.'''
+        self.users += 1
+        try:
+            await self.ensure_loaded()
+            yield self
+        finally:
+            self.users -= 1
+
+    async def ensure_loaded(self):
+        if not self.loaded:
+            async with self.load_lock:
+                if not self.loaded:
+                    await self.load()
+        if self.on_access:
+            self.on_access(self)
+
+    def unload(self):
+        '''Drops messages and summary data, keeping what `list_conversations` needs. Only call on idle conversations.'''
+        if not self.loaded or self.temp:
+            return
+        self._message_count = len(self._messages)
+        self._byte_size = self.byte_size
+        self._messages = ()
+        self.tokens.clear()
+        self.summary = None
+        self.facts = None
+        self.decisions = []
+        self.threads = []
+        self._persisted_meta = {}
+        self.loaded = False
+
+    def _update_index(self, messages, count, replace):
+        '''Blocking: the metadata row and the search rows of `messages` for the save that just happened.'''
+        self.index.upsert([self.index_entry()]) # type:ignore
+        self.index.index_messages(self.key, search_rows(messages), count, replace) # type:ignore
+
+    def index_entry(self) -> IndexEntry:
+        mtime, size, log_size = stat_files(self.path, self.store.log_path) if self.store else (0, 0, 0)
+        return IndexEntry(self.key, self.name, self.last_used, self.message_count, size + log_size, mtime, size, log_size)
+
+    def to_dict(self):
+        meta = self._meta()
+        return {"summary": meta.pop("summary"), "facts": meta.pop("facts"), "key_decisions": meta.pop("key_decisions"),
+                "open_threads": meta.pop("open_threads"), "conversation": self._messages, **meta}
 
     def set_temp(self, val:bool):
         self.temp = val
 
     async def load(self):
+        '''Reads the snapshot and replays the log on top of it.'''
         try:
-            async with aiofiles.open(self.path) as file:
-                content = await file.read()
-                content = json.loads(content)
-                self.summary = content.get("summary")
-                self.facts = content.get("facts")
-                self.messages = content.get("conversation",[])
-                self.id = content.get("id", self.id or str(uuid.uuid4()))
-                self.name = content.get("name", "New chat")
-                self.last_used = content.get('last_used', -1)
-                self.decisions = content.get("key_decisions", [])
-                self.threads = content.get("open_threads", [])
-
-        except (FileNotFoundError, json.JSONDecodeError):
-            await Logger.log_async("Context missing or corrupted. Starting over.", "warn")
+            content = await asyncio.to_thread(self.store.read) if self.store else None
+        except json.JSONDecodeError:
+            content = None
+        self._apply(content)
+        await Logger.log_async(f"Loading conversation: {self.name} ({self.id})", 'info')
+
+    def _apply(self, content: dict | None):
+        try:
+            if content is None:
+                raise FileNotFoundError(self.path)
+            self.summary = content.get("summary")
+            self.facts = content.get("facts")
+            self.messages = content.get("conversation",[])
+            self.id = content.get("id", self.id or str(uuid.uuid4()))
+            self.name = content.get("name", "New chat")
+            self.last_used = content.get('last_used', -1)
+            self.decisions = content.get("key_decisions", [])
+            self.threads = content.get("open_threads", [])
+
+            self._persisted = len(self._messages)
+            self._persisted_meta = deepcopy(self._meta())
+            self._persisted_gen = self._rewrite_gen
+
+        except FileNotFoundError:
+            Logger.log_sync("Context missing or corrupted. Starting over.", "warn")
             self.messages = [] 
             self.summary = None
             self.facts = None
@@ -268,28 +593,65 @@ class Conversation:
             self.last_used = -1
             self.decisions = []
             self.threads = []
-
-        await Logger.log_async(f"Loading conversation: {self.name} ({self.id})", 'info')
+        self.loaded = True
 
     async def save(self, path:str | None = None):
+        '''
+        Appends the messages added since the last save and the changed metadata to the conversation's log, or compacts everything
+        into a new snapshot when the log is due for it or the messages were replaced. With `path`, writes a full copy there instead.
+        '''
         if self.temp:
             await Logger.log_async("Temporary conversations cannot be saved", 'warn')
             return
+        if not self.loaded and not path:
+            return # unloaded conversations have nothing unsaved
         await Logger.log_async(f"Saving conversation: {self.name} ({self.id})", 'info')
         try:
             await self.flush_queue()
-            async with self.lock:
-                data = {"summary":self.summary, "facts": self.facts,"key_decisions": self.decisions, "open_threads": self.threads, 
-                        "conversation": self.messages, "id": self.id, 'name': self.name, 'last_used': self.last_used}
-                data_to_save = json.dumps(data, indent=2)
 
-            async with aiofiles.open(path or self.path, "w") as file:
-                await file.write(data_to_save)
+            if path and os.path.abspath(path) != os.path.abspath(self.path):
+                async with self.lock:
+                    data_to_save = json.dumps(self.to_dict(), indent=2, default=encode)
+                await asyncio.to_thread(write_atomic, path, data_to_save)
+                return
+
+            if self.store is None:
+                return
+
+            async with self.save_lock:
+                if self.store is None:
+                    return # deleted while this save waited
+                async with self.lock:
+                    meta = self._meta()
+                    gen = self._rewrite_gen
+                    count = len(self._messages)
+                    rewritten = gen != self._persisted_gen or count < self._persisted
+                    compact = rewritten or self.store.should_compact()
+                    searchable = self._messages if rewritten else self._messages[self._persisted:count]
+                    if compact:
+                        state = self.to_dict()
+                    else:
+                        new = self._messages[self._persisted:]
+                        changed = {k: v for k, v in meta.items() if k not in self._persisted_meta or self._persisted_meta[k] != v}
+                        if not new and not changed:
+                            return
+                    persisted_meta = deepcopy(meta)
+
+                if compact:
+                    await asyncio.to_thread(self.store.compact, state) # type:ignore
+                    self._persisted_gen = gen
+                else:
+                    await asyncio.to_thread(self.store.append, new, changed) # type:ignore
+                self._persisted = count
+                self._persisted_meta = persisted_meta
+                if self.index:
+                    await asyncio.to_thread(self._update_index, searchable, count, rewritten)
 
         except IOError as e:
             await Logger.log_async(f"Error saving context: {e}; {traceback.format_exc()}", "error")
 
     async def append(self, data:dict | list[dict] | tuple[dict], update:bool = False): 
+        await self.ensure_loaded()
         if not update:
             if isinstance(data, dict):
         
@@ -314,6 +676,7 @@ class Conversation:
                 self.last_used = datetime.datetime.now().timestamp()
 
     async def flush_queue(self):
+        await self.ensure_loaded()
         if self.queue.empty():
             return
 
@@ -326,14 +689,15 @@ class Conversation:
                 except asyncio.QueueEmpty:
                     break
 
-            items = self.attach_meta(items)
-            self.messages.extend(items)
+            # appending shares every existing record, only the tuple of references is new
+            new = tuple(self.attach_meta(items))
+            self.tokens.append(new)
+            self._messages = self._messages + new
 
     async def get_context(self):
         await self.flush_queue()
         async with self.lock:
-            context = deepcopy(list(self.messages))
-            return context
+            return list(self._messages)
         
     async def get_states(self):
         meta = {
@@ -354,40 +718,40 @@ class Conversation:
         return meta
         
     async def get_summary(self):
+        await self.ensure_loaded()
         async with self.lock:
             return str(self.summary) if self.summary is not None else ""
 
     async def get_facts(self):
+        await self.ensure_loaded()
         async with self.lock:
             return deepcopy(self.facts) if self.facts is not None else []
         
     async def get_threads(self):
+        await self.ensure_loaded()
         async with self.lock:
             return deepcopy(self.threads) if self.threads is not None else []
         
     async def get_key_decisions(self):
+        await self.ensure_loaded()
         async with self.lock:
             return deepcopy(self.decisions) if self.decisions is not None else []
         
     def attach_meta(self, new_messages:list[dict] | dict):
-        new_messages = deepcopy(new_messages)
+        '''Read-only copies of `new_messages` with the bookkeeping fields filled in.'''
+        def with_meta(m, idx):
+            return freeze({**m, 'edited': m.get('edited') or False, 'gen_idx': m.get("gen_idx") or 0,
+                           'msg_id': m.get('msg_id') or str(uuid.uuid4()), 'msg_idx': m.get("msg_idx") or idx})
+
         if isinstance(new_messages, (list, tuple)):
             c = []
             for m in new_messages:
-                m['edited'] =  m.get('edited') or False
-                m['gen_idx'] = m.get("gen_idx") or 0
-                m['msg_id'] = m.get('msg_id') or str(uuid.uuid4())
-                m['msg_idx'] = m.get("msg_idx") or ((len(c) + len(self.messages)) + 1)
-                c.append(m)
+                c.append(with_meta(m, (len(c) + len(self._messages)) + 1))
 
             return c
         
-        elif isinstance(new_messages, dict):
-            new_messages['edited'] =  new_messages.get('edited') or False
-            new_messages['gen_idx'] = new_messages.get("gen_idx") or 0
-            new_messages['msg_id'] = new_messages.get('msg_id') or str(uuid.uuid4())
-            new_messages['msg_idx'] = new_messages.get("msg_idx") or (len(self.messages) + 1)
-            return new_messages
+        elif isinstance(new_messages, Mapping): # a dict or a `Message`
+            return with_meta(new_messages, len(self._messages) + 1)
 
     def attach_msg_extra_meta(self, new_messages:list[dict] | dict, new_meta: list[dict | None] | dict | None = None):
         m = self.attach_meta(new_messages)
@@ -396,25 +760,30 @@ class Conversation:
             if len(m) > len(new_meta):
                 new_meta.extend(None for _ in range(len(m) - len(new_meta)))
             
-            for msg, meta in zip(m, new_meta):
-                if meta:
-                    msg.update(meta)
-            return m
+            return [msg.evolve(**meta) if meta else msg for msg, meta in zip(m, new_meta)]
 
-        elif new_meta and isinstance(m, dict) and isinstance(new_meta, dict):
-            m.update(new_meta)
-            return m
+        elif new_meta and isinstance(m, Message) and isinstance(new_meta, dict):
+            return m.evolve(**new_meta)
 
         return m
 
     async def rename(self, name):
+        await self.ensure_loaded()
         async with self.lock: 
             self.name = name
-        await self.save()
+        await self.persist()
 
     async def reset(self):
+        await self.ensure_loaded()
         async with self.lock:
             self.messages = []
             self.facts = None
             self.summary = None
-        await self.save()
+        await self.persist()
+
+    async def persist(self):
+        '''Saves the changes just made, through `on_change` when the owner batches saves.'''
+        if self.on_change:
+            self.on_change(self)
+        else:
+            await self.save()
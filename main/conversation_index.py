@@ -0,0 +1,156 @@
+from typing import NamedTuple
+import os
+import re
+import sqlite3
+import threading
+from .tokens import message_text
+
+class IndexEntry(NamedTuple):
+    id: str
+    name: str
+    last_used: float
+    message_count: int
+    byte_size: int
+    snapshot_mtime_ns: int # stat of the snapshot / log when the row was written, to spot saves the index missed
+    snapshot_size: int
+    log_size: int
+
+class SearchHit(NamedTuple):
+    id: str
+    msg_idx: int
+    msg_id: str
+    role: str
+    snippet: str
+    score: float
+
+def fts_query(text: str) -> str:
+    '''FTS5 query for free text: every word must match, the last one as a prefix (search as you type). Empty without words.'''
+    words = re.findall(r"\w+", text)
+    if not words:
+        return ""
+    return " ".join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+
+def search_rows(messages) -> list[tuple[int, str, str, str]]:
+    '''`(msg_idx, msg_id, role, text)` of the messages that have text to search.'''
+    rows = []
+    for m in messages:
+        text = message_text(m)
+        if text and m.get("role") != "system":
+            rows.append((m.get("msg_idx") or 0, m.get("msg_id") or "", m.get("role") or "", text))
+    return rows
+
+def stat_files(snapshot_path: str, log_path: str) -> tuple[int, int, int]:
+    '''`(snapshot mtime_ns, snapshot size, log size)`, zeros for missing files.'''
+    try:
+        st = os.stat(snapshot_path)
+        mtime, size = st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        mtime, size = 0, 0
+    try:
+        log_size = os.stat(log_path).st_size
+    except FileNotFoundError:
+        log_size = 0
+    return mtime, size, log_size
+
+class ConversationIndex:
+    '''
+    SQLite table with one row of metadata per saved conversation (`<context_dir>/conversations.sqlite`), so the conversation list
+    can be built at startup without parsing any conversation. Rows also keep the file stats they were written for; a conversation
+    whose files changed behind the index's back is parsed once and its row rewritten.
+
+    The same database holds the full-text search index over message text: `search_messages` (one row per message) with an FTS5
+    index kept in sync by triggers, and `search_state` with the number of messages indexed per conversation, to spot
+    conversations that need reindexing.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS conversations (id TEXT PRIMARY KEY, name TEXT, last_used REAL, message_count INTEGER, "
+                         "byte_size INTEGER, snapshot_mtime_ns INTEGER, snapshot_size INTEGER, log_size INTEGER)")
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS search_messages (id INTEGER PRIMARY KEY, cid TEXT, msg_idx INTEGER, msg_id TEXT, role TEXT, content TEXT);
+                CREATE INDEX IF NOT EXISTS search_messages_cid ON search_messages (cid);
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(content, content='search_messages', content_rowid='id',
+                                                                         tokenize='unicode61 remove_diacritics 2');
+                CREATE TRIGGER IF NOT EXISTS search_messages_ai AFTER INSERT ON search_messages BEGIN
+                    INSERT INTO search_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS search_messages_ad AFTER DELETE ON search_messages BEGIN
+                    INSERT INTO search_fts (search_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END;
+                CREATE TABLE IF NOT EXISTS search_state (id TEXT PRIMARY KEY, indexed INTEGER);
+            ''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def all(self) -> dict[str, IndexEntry]:
+        with self._lock:
+            rows = self._connect().execute(f"SELECT {', '.join(IndexEntry._fields)} FROM conversations").fetchall()
+        return {r[0]: IndexEntry(*r) for r in rows}
+
+    def upsert(self, entries: list[IndexEntry]):
+        if not entries:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(f"INSERT OR REPLACE INTO conversations VALUES ({', '.join('?' * len(IndexEntry._fields))})", entries)
+            conn.commit()
+
+    def delete(self, ids: list[str]):
+        if not ids:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM conversations WHERE id = ?", [(i,) for i in ids])
+            conn.executemany("DELETE FROM search_messages WHERE cid = ?", [(i,) for i in ids])
+            conn.executemany("DELETE FROM search_state WHERE id = ?", [(i,) for i in ids])
+            conn.commit()
+
+    def index_messages(self, cid: str, rows: list[tuple[int, str, str, str]], indexed: int, replace = False):
+        '''
+        Adds `(msg_idx, msg_id, role, text)` rows of `cid` to the search index, after dropping its old rows with `replace`.
+        `indexed` is the conversation's message count once these are in.
+        '''
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM search_messages WHERE cid = ?", (cid,))
+                conn.executemany("INSERT INTO search_messages (cid, msg_idx, msg_id, role, content) VALUES (?, ?, ?, ?, ?)",
+                                 [(cid, *r) for r in rows])
+                conn.execute("INSERT OR REPLACE INTO search_state VALUES (?, ?)", (cid, indexed))
+
+    def search_state(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._connect().execute("SELECT id, indexed FROM search_state").fetchall())
+
+    def search(self, text: str, limit = 20, cid: str | None = None) -> list[SearchHit]:
+        '''Best matching messages first (bm25), with a snippet around the match.'''
+        query = fts_query(text)
+        if not query:
+            return []
+        sql = ("SELECT m.cid, m.msg_idx, m.msg_id, m.role, snippet(search_fts, 0, '[', ']', '…', 12), bm25(search_fts) "
+               "FROM search_fts JOIN search_messages m ON m.id = search_fts.rowid WHERE search_fts MATCH ?")
+        args: list = [query]
+        if cid is not None:
+            sql += " AND m.cid = ?"
+            args.append(cid)
+        sql += " ORDER BY bm25(search_fts) LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, args).fetchall()
+        return [SearchHit(*r) for r in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
\ No newline at end of file
@@ -0,0 +1,133 @@
+from .configs import CONVERSATION_LOG_MAX_RECORDS, CONVERSATION_LOG_MAX_BYTES, CONVERSATION_LOG_FSYNC
+from .messages import encode
+import json
+import os
+
+SNAPSHOT_FORMAT = 2
+
+def write_atomic(path: str, data: str, fsync = True):
+    '''Writes `data` to a temp file next to `path` and renames it over `path`, so readers see the old or the new file, never half of one.'''
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class ConversationLog:
+    '''
+    On-disk storage of one conversation: a JSON snapshot (`<cid>.json`) plus an append-only JSONL log (`<cid>.wal.jsonl`).
+
+    Every save appends one record with the messages added since the last save and the metadata fields that changed. Once the
+    log passes `max_records` records or `max_bytes` bytes (or the messages were rewritten rather than appended) the whole state
+    is compacted into a new snapshot, written atomically, and the log is truncated. Records carry a sequence number and the
+    snapshot stores the last one it contains, so a crash between the two steps cannot replay a record twice. Snapshots without a
+    `format` field are the old single-file format and are read as-is.
+
+    The methods do blocking IO; `Conversation` calls them through `asyncio.to_thread`.
+    '''
+    def __init__(self, snapshot_path: str, max_records = CONVERSATION_LOG_MAX_RECORDS, max_bytes = CONVERSATION_LOG_MAX_BYTES,
+                 fsync = CONVERSATION_LOG_FSYNC) -> None:
+        self.snapshot_path = snapshot_path
+        self.log_path = f"{snapshot_path.removesuffix('.json')}.wal.jsonl"
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.seq = 0
+        self.records = 0
+        self.log_bytes = 0
+        self.snapshot_bytes = 0
+        self.legacy = False
+        self.broken = False
+
+    def read(self) -> dict | None:
+        '''Returns the snapshot with the log replayed on top, or None if there is no snapshot. A torn last line is cut off.'''
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+
+        state = json.loads(raw)
+        self.snapshot_bytes = len(raw)
+        self.legacy = "format" not in state
+        self.seq = state.pop("seq", 0)
+        state.pop("format", None)
+        messages = state.setdefault("conversation", [])
+        self.records = 0
+        self.log_bytes = 0
+
+        try:
+            with open(self.log_path, "rb") as f:
+                good = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    good += len(line)
+                    if record.get("seq", 0) <= self.seq:
+                        continue
+                    messages.extend(record.get("messages", ()))
+                    state.update(record.get("meta", {}))
+                    self.seq = record["seq"]
+                    self.records += 1
+                torn = good < f.seek(0, os.SEEK_END)
+            if torn:
+                with open(self.log_path, "r+b") as f:
+                    f.truncate(good)
+            self.log_bytes = good
+        except FileNotFoundError:
+            pass
+
+        return state
+
+    def should_compact(self):
+        return self.legacy or self.broken or self.records >= self.max_records or self.log_bytes >= self.max_bytes
+
+    def append(self, messages: list, meta: dict):
+        '''Appends one record. Returns its size in bytes. After a failed write the log may end in a partial line, so it is compacted next.'''
+        record = {"seq": self.seq + 1}
+        if messages:
+            record["messages"] = messages
+        if meta:
+            record["meta"] = meta
+        line = (json.dumps(record, default=encode) + "\n").encode("utf-8")
+        try:
+            with open(self.log_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        except OSError:
+            self.broken = True
+            raise
+        self.seq += 1
+        self.records += 1
+        self.log_bytes += len(line)
+        return len(line)
+
+    def compact(self, state: dict):
+        '''Writes `state` (the full conversation) as the new snapshot and empties the log.'''
+        data = json.dumps({**state, "format": SNAPSHOT_FORMAT, "seq": self.seq}, default=encode)
+        write_atomic(self.snapshot_path, data, self.fsync)
+        with open(self.log_path, "w", encoding="utf-8"):
+            pass
+        self.snapshot_bytes = len(data)
+        self.records = 0
+        self.log_bytes = 0
+        self.legacy = False
+        self.broken = False
+
+    def delete(self):
+        for p in (self.snapshot_path, self.log_path, f"{self.snapshot_path}.tmp"):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def metrics(self):
+        return {"seq": self.seq, "log_records": self.records, "log_bytes": self.log_bytes, "snapshot_bytes": self.snapshot_bytes}
\ No newline at end of file
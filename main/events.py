@@ -7,6 +7,7 @@ import traceback
 class EventBus:
     GENERATION_CHUNK = "generation chunk"
     GENERATION_CANCELLED = "generation cancelled"
+    GENERATION_QUEUED = "generation queued"
     TOOL_EXECUTING = "tool executing"
     TOOLS_EXECUTED = "tools executed"
     GENERATION_STARTED = "generation started"
@@ -16,6 +17,7 @@ class EventBus:
     SUMMARISING = "summarising"
     SUMMARISING_FAILED = "summarisation failed"
     SUMMARISED = 'summarised'
+    INDEXING_PROGRESS = "indexing progress"
     INITIALISING = "initialising"
     INITIALISED = "initialised"
     PROPOSED_MEMORY = 'proposed memory'
@@ -31,6 +33,9 @@ class EventBus:
 
     MODELS_LOADING = "loading models"
     MODELS_LOADED = "loaded models"
+    MODEL_READY = "model ready"
+    MODEL_EVICTED = "model evicted"
+    MODEL_RELOADED = "model reloaded"
     INFO = "info"
     WARN = "warn"
     ERROR = "error"
@@ -5,12 +5,13 @@ from .tools import ToolRegistry, Tool
 from typing import Iterable
 from .utils import Logger, strip_thinking
 import json
-from copy import deepcopy
+from .messages import freeze_all
 import uuid
 import datetime
 import inspect
 from .configs import ERROR_TOKEN, FILE_NAME_KEY, INSTANT_TOOL_EXEC
 from .events import EventBus
+from .scheduler import admit, AdmissionQueueFull, INTERACTIVE
 import traceback
 
 CREATED = "CREATED"
@@ -23,7 +24,7 @@ CANCELLING = "CANCELLING"
 
 class GenerationSession:
     def __init__(self, query:str | None, context:list[dict], tools_regis:ToolRegistry, model: LocalModel | RemoteModel, system_prompt_override: str | None = None, 
-                options: dict | None = None, format_: dict | None = None, max_turns = 10, abs_max_turns = 50, regen_consent_callback= None, tools_override=None, event_bus: None | EventBus = None,) -> None:
+                options: dict | None = None, format_: dict | None = None, max_turns = 10, abs_max_turns = 50, regen_consent_callback= None, tools_override=None, event_bus: None | EventBus = None, priority = INTERACTIVE) -> None:
         self.query = query
         self.original_context = context
         self.context:list[dict] = []
@@ -49,6 +50,7 @@ class GenerationSession:
         self.regen_consent_callback = regen_consent_callback
         self.regen = False
         self.event_bus = event_bus
+        self.priority = priority
     
     async def change_state(self, new, use_lock = True):
         if use_lock:
@@ -82,16 +84,20 @@ class GenerationSession:
             queue = asyncio.Queue(maxsize=256)
             async def producer():
                 try:
-                    async for (thinking_chunk, content_chunk, tools_chunk) in self.model.generate(query, context, True,
-                                                                                                        think=think, file_path=image_path, mod_ = mod_, 
-                                                                                                        system_prompt_override=self.sys_override, options=self.options,
-                                                                                                        format_=self.format,  tools_override=self.tools_override):
-
-                        if content_chunk == ERROR_TOKEN:
-                            await self.change_state(FAIL)
-                            
-                            break
-                        await queue.put((thinking_chunk, content_chunk, tools_chunk))
+                    async with admit(self.model, self.priority):
+                        async for (thinking_chunk, content_chunk, tools_chunk) in self.model.generate(query, context, True,
+                                                                                                            think=think, file_path=image_path, mod_ = mod_, 
+                                                                                                            system_prompt_override=self.sys_override, options=self.options,
+                                                                                                            format_=self.format,  tools_override=self.tools_override):
+
+                            if content_chunk == ERROR_TOKEN:
+                                await self.change_state(FAIL)
+                                
+                                break
+                            await queue.put((thinking_chunk, content_chunk, tools_chunk))
+                except AdmissionQueueFull as e:
+                    await Logger.log_async(f"Generation rejected: {e}", "error")
+                    await self.change_state(FAIL)
                 except asyncio.CancelledError:
                     raise
                 finally:
@@ -131,30 +137,35 @@ class GenerationSession:
                 raise  
 
         else:
-           async for (thinking_chunk, content_chunk, tools_chunk) in self.model.generate(query, context, False,
-                                                                                                        think=think, file_path=image_path, mod_ = mod_, 
-                                                                                                        system_prompt_override=self.sys_override, options=self.options,
-                                                                                                        format_=self.format,  tools_override=self.tools_override):
+            try:
+                async with admit(self.model, self.priority):
+                    async for (thinking_chunk, content_chunk, tools_chunk) in self.model.generate(query, context, False,
+                                                                                                                think=think, file_path=image_path, mod_ = mod_, 
+                                                                                                                system_prompt_override=self.sys_override, options=self.options,
+                                                                                                                format_=self.format,  tools_override=self.tools_override):
 
-                await Logger.log_async(f"Got non-streaming response chunk", "info")
-                if content_chunk == ERROR_TOKEN:
-                    await self.change_state(FAIL)
-                    break
+                        await Logger.log_async(f"Got non-streaming response chunk", "info")
+                        if content_chunk == ERROR_TOKEN:
+                            await self.change_state(FAIL)
+                            break
 
-                if tools_chunk:
-                    if INSTANT_TOOL_EXEC:
-                        await self.execute_tools(tools_chunk)
-                    else:
-                        tools_called.extend(tools_chunk)
+                        if tools_chunk:
+                            if INSTANT_TOOL_EXEC:
+                                await self.execute_tools(tools_chunk)
+                            else:
+                                tools_called.extend(tools_chunk)
 
-                thinking_final += thinking_chunk or ""
-                content_final += content_chunk or ""
+                        thinking_final += thinking_chunk or ""
+                        content_final += content_chunk or ""
 
-                tool_names = [t.get('function', {}).get('name', "") for t in tools_chunk] if tools_chunk else []
+                        tool_names = [t.get('function', {}).get('name', "") for t in tools_chunk] if tools_chunk else []
 
-                yield (thinking_chunk or "", content_chunk or "", tool_names)
-                if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.GENERATION_CHUNK, False, 
-                                                                      chunk = (thinking_chunk or "", content_chunk or "")) 
+                        yield (thinking_chunk or "", content_chunk or "", tool_names)
+                        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.GENERATION_CHUNK, False, 
+                                                                              chunk = (thinking_chunk or "", content_chunk or "")) 
+            except AdmissionQueueFull as e:
+                await Logger.log_async(f"Generation rejected: {e}", "error")
+                await self.change_state(FAIL)
 
         if self.query and self.query.strip(): 
             async with self.context_lock:
@@ -220,7 +231,7 @@ class GenerationSession:
 
     async def get_context(self, include_original = False):
         async with self.context_lock:
-            return deepcopy((self.original_context + self.context) if include_original else self.context) 
+            return list(freeze_all((self.original_context + self.context) if include_original else self.context))
     
     async def set_context(self, context, set_original = False):
         async with self.context_lock:
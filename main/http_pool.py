@@ -0,0 +1,117 @@
+import aiohttp
+import asyncio
+from urllib.parse import urlsplit
+from .utils import Logger
+import traceback
+
+LOCAL = "local"
+REMOTE = "remote"
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "0.0.0.0")
+
+class ConnectionPool:
+    '''
+    Process wide `aiohttp.ClientSession`s shared by every model, embedder and health check.
+
+    Local Ollama servers and remote APIs (OpenRouter) get separate connectors so their limits and keep-alive can be tuned
+    independently. Sessions handed out here are borrowed: callers must never close them, `ConnectionPool.close` does that on shutdown.
+    '''
+    configs: dict[str, dict] = {
+        LOCAL: {"limit": 64, "limit_per_host": 8, "keepalive_timeout": 75, "use_dns_cache": True, "ttl_dns_cache": None},
+        REMOTE: {"limit": 32, "limit_per_host": 16, "keepalive_timeout": 30, "use_dns_cache": True, "ttl_dns_cache": 300,
+                 "enable_cleanup_closed": True},
+    }
+    _sessions: dict[str, aiohttp.ClientSession] = {}
+    _loops: dict[str, asyncio.AbstractEventLoop] = {}
+    _stats: dict[str, dict[str, int]] = {}
+
+    @classmethod
+    def configure(cls, pool: str = LOCAL, **connector_kwargs):
+        '''
+        Overrides `aiohttp.TCPConnector` arguments (`limit`, `limit_per_host`, `keepalive_timeout`, `ttl_dns_cache`, ...) for `pool`.
+        Takes effect the next time the pool's session is created.
+        '''
+        if pool not in cls.configs:
+            raise KeyError(f"Unknown pool: {pool}")
+        cls.configs[pool] = {**cls.configs[pool], **connector_kwargs}
+
+    @classmethod
+    def pool_for(cls, host: str | None) -> str:
+        if not host:
+            return LOCAL
+        hostname = urlsplit(host if "://" in host else f"http://{host}").hostname or ""
+        return LOCAL if hostname in LOCAL_HOSTS else REMOTE
+
+    @classmethod
+    def _trace_config(cls, pool: str):
+        stats = cls._stats[pool]
+
+        async def on_queued_start(session, ctx, params):
+            stats["waiting"] += 1
+
+        async def on_queued_end(session, ctx, params):
+            stats["waiting"] = max(0, stats["waiting"] - 1)
+
+        async def on_create_end(session, ctx, params):
+            stats["created"] += 1
+
+        async def on_reuse(session, ctx, params):
+            stats["reused"] += 1
+
+        async def on_dns_hit(session, ctx, params):
+            stats["dns_cache_hits"] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_dns_cache_hit.append(on_dns_hit)
+        return trace
+
+    @classmethod
+    def get_session(cls, host: str | None = None) -> aiohttp.ClientSession:
+        '''Returns the shared session for `host`'s pool, creating it on first use. Must be called from inside the running loop.'''
+        pool = cls.pool_for(host)
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(pool)
+        if session is not None and not session.closed and cls._loops.get(pool) is loop:
+            return session
+
+        cls._stats[pool] = {"waiting": 0, "created": 0, "reused": 0, "dns_cache_hits": 0}
+        connector = aiohttp.TCPConnector(**cls.configs[pool])
+        session = aiohttp.ClientSession(connector=connector, trace_configs=[cls._trace_config(pool)])
+        cls._sessions[pool] = session
+        cls._loops[pool] = loop
+        Logger.log_sync(f"Created shared HTTP session for the '{pool}' pool ({cls.configs[pool]})", 'info', stdout=False)
+        return session
+
+    @classmethod
+    def metrics(cls) -> dict[str, dict]:
+        '''Open (idle + in use), idle, in use and waiting connections per pool, plus lifetime connect / reuse counters.'''
+        out = {}
+        for pool, session in cls._sessions.items():
+            connector = session.connector
+            if session.closed or connector is None:
+                continue
+            idle = sum(len(c) for c in getattr(connector, "_conns", {}).values())
+            in_use = len(getattr(connector, "_acquired", ()))
+            out[pool] = {
+                "open": idle + in_use,
+                "idle": idle,
+                "in_use": in_use,
+                "limit": connector.limit,
+                "limit_per_host": connector.limit_per_host,
+                **cls._stats.get(pool, {}),
+            }
+        return out
+
+    @classmethod
+    async def close(cls):
+        for pool, session in list(cls._sessions.items()):
+            try:
+                if not session.closed:
+                    await session.close()
+            except Exception as e:
+                await Logger.log_async(f"An error occurred while closing the '{pool}' HTTP pool: {e}; {traceback.format_exc()}", "error")
+        cls._sessions.clear()
+        cls._loops.clear()
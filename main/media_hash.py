@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from .configs import MEDIA_HASH_ALGORITHM, MEDIA_HASH_MEMO_SIZE, MEDIA_INGEST_HARDLINK
+from .media_ingest import ingest, COPY, COPY_FILE_RANGE, SENDFILE
+import hashlib
+import os
+import threading
+import uuid
+
+try:
+    import blake3 # optional, several times faster than sha256 on multi-MB media
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash # optional, non-cryptographic and faster still
+except ImportError:
+    xxhash = None
+
+SAMPLE_SIZE = 1024 * 1024
+
+def make_hasher(algorithm = "auto"):
+    '''`(name, constructor)` of a hashlib-style hasher: "sha256", "blake3", "xxh3" or "auto" (blake3 when installed, else sha256).'''
+    if algorithm == "auto":
+        algorithm = "blake3" if blake3 is not None else "sha256"
+    if algorithm == "sha256":
+        return algorithm, hashlib.sha256
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ImportError("blake3 is not installed, install it or use MEDIA_HASH_ALGORITHM = 'sha256'")
+        return algorithm, blake3.blake3
+    if algorithm == "xxh3":
+        if xxhash is None:
+            raise ImportError("xxhash is not installed, install it or use MEDIA_HASH_ALGORITHM = 'sha256'")
+        return algorithm, xxhash.xxh3_128
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+class SampledDigest:
+    '''
+    The cache key of a file of `size` bytes: its size and, for files of up to three samples, all of its content, for bigger ones
+    the first, middle and last sample. Fed with `feed(offset, chunk)`, every byte once and in any order, so it can be computed
+    while copying.
+    '''
+    def __init__(self, size: int, new_hasher, sample_size = SAMPLE_SIZE) -> None:
+        self.hasher = new_hasher()
+        self.hasher.update(str(size).encode())
+        if size <= sample_size * 3:
+            self.regions = [(0, size)]
+        else:
+            self.regions = [(0, sample_size), (size // 2, size // 2 + sample_size), (size - sample_size, size)]
+        self.parts = [bytearray() for _ in self.regions]
+
+    def spans(self) -> list[tuple[int, int]]:
+        '''The byte ranges to feed, samples that overlap (files of 3 to 4 samples) merged.'''
+        merged = []
+        for start, stop in self.regions:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def feed(self, offset: int, chunk: bytes):
+        end = offset + len(chunk)
+        for (start, stop), part in zip(self.regions, self.parts):
+            lo, hi = max(start, offset), min(stop, end)
+            if lo < hi:
+                part += chunk[lo - offset:hi - offset]
+
+    def hexdigest(self) -> str:
+        for part in self.parts:
+            self.hasher.update(part)
+        return self.hasher.hexdigest()
+
+class FileHasher:
+    '''
+    Content hashes of media files, memoised by `(device, inode, size, mtime_ns)`: a file that wasn't touched since it was last
+    hashed costs one `stat` instead of reading up to 3 MB. The memo keeps the `memo_size` most recently used digests (0
+    disables it). `copy_into` puts a file into the cache (see `media_ingest`). Methods are blocking, call them in a thread.
+    '''
+    def __init__(self, algorithm = MEDIA_HASH_ALGORITHM, memo_size = MEDIA_HASH_MEMO_SIZE) -> None:
+        self.algorithm, self.new_hasher = make_hasher(algorithm)
+        self.memo_size = memo_size
+        self.memo: OrderedDict[tuple[int, int, int, int], str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memo_hits": 0, "memo_misses": 0, "bytes_hashed": 0, "bytes_copied": 0}
+        self.strategies: dict[str, int] = {} # ingest strategy -> files
+
+    @staticmethod
+    def stat_key(st: os.stat_result) -> tuple[int, int, int, int]:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _recall(self, key) -> str | None:
+        with self._lock:
+            digest = self.memo.get(key)
+            if digest is None:
+                self.stats["memo_misses"] += 1
+            else:
+                self.memo.move_to_end(key)
+                self.stats["memo_hits"] += 1
+            return digest
+
+    def _remember(self, key, digest: str):
+        if self.memo_size <= 0:
+            return
+        with self._lock:
+            self.memo[key] = digest
+            self.memo.move_to_end(key)
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+    def hash_file(self, path: str) -> str:
+        st = os.stat(path)
+        key = self.stat_key(st)
+        digest = self._recall(key)
+        if digest is None:
+            digest = self._read_digest(path, st.st_size)
+            self._remember(key, digest)
+        return digest
+
+    def _read_digest(self, path: str, size: int) -> str:
+        d = SampledDigest(size, self.new_hasher)
+        with open(path, "rb") as f:
+            for start, stop in d.spans():
+                f.seek(start)
+                chunk = f.read(stop - start)
+                d.feed(start, chunk)
+                self.stats["bytes_hashed"] += len(chunk)
+        return d.hexdigest()
+
+    def copy_into(self, src: str, dest_dir: str, ext: str, tmp_dir: str,
+                  hardlink_policy = MEDIA_INGEST_HARDLINK) -> tuple[str, str, str | None]:
+        '''
+        Puts `src` at `<dest_dir>/<digest><ext>` unless it's already there and returns `(digest, path, strategy)`, with the
+        `media_ingest` strategy used or None if nothing was written. The file goes through a temporary name in `tmp_dir` (same
+        filesystem). An unknown file that has to be copied in user space is hashed in the same pass instead of read twice.
+        '''
+        st = os.stat(src)
+        key = self.stat_key(st)
+        digest = self._recall(key)
+        dest = os.path.join(dest_dir, f"{digest}{ext}") if digest is not None else None
+        if dest is not None and os.path.exists(dest):
+            strategy = None
+        else:
+            tmp = os.path.join(tmp_dir, f".{uuid.uuid4().hex}.tmp")
+            d = SampledDigest(st.st_size, self.new_hasher) if digest is None else None
+            try:
+                strategy = ingest(src, tmp, hardlink_policy, d.feed if d else None)
+                if digest is None:
+                    digest = d.hexdigest() if strategy == COPY else self._read_digest(src, st.st_size) # type:ignore
+                    self._remember(key, digest)
+                dest = os.path.join(dest_dir, f"{digest}{ext}")
+                if os.path.exists(dest):
+                    os.remove(tmp)
+                    strategy = None
+                else:
+                    os.replace(tmp, dest)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            if strategy in (COPY, COPY_FILE_RANGE, SENDFILE):
+                self.stats["bytes_copied"] += st.st_size
+            if strategy is not None:
+                self.strategies[strategy] = self.strategies.get(strategy, 0) + 1
+
+        self._remember(self.stat_key(os.stat(dest)), digest)
+        return digest, dest, strategy
+
+    def metrics(self):
+        return {**self.stats, "algorithm": self.algorithm, "memo_entries": len(self.memo), "strategies": dict(self.strategies)}
\ No newline at end of file
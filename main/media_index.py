@@ -0,0 +1,159 @@
+from typing import NamedTuple
+import json
+import os
+import sqlite3
+import threading
+
+class MediaEntry(NamedTuple):
+    hash: str
+    path: str
+    size: int
+    last_used: float
+    kind: str # "image" / "video"
+    strategy: str = "" # how the file got into the cache (`media_ingest`), empty if unknown
+
+class MediaIndex:
+    '''
+    SQLite index of the media cache (`<cache_dir>/index.sqlite`, WAL mode), one row per cached file keyed by its content hash.
+    Caching or touching a file is a single row write, and the garbage collector picks its candidates with queries on the
+    `last_used` / `size` indexes instead of walking (and rewriting) the whole index. Rows also record how the file was ingested.
+    The total size of the cache is summed once when the database is opened and kept up to date by `put` / `delete`.
+
+    An `index.json` written by older versions is imported the first time the database is created and renamed to
+    `index.json.imported`.
+    '''
+    def __init__(self, path: str, legacy_json: str | None = None) -> None:
+        self.path = path
+        self.legacy_json = legacy_json
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._total = 0
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS media (hash TEXT PRIMARY KEY, path TEXT, size INTEGER, last_used REAL, kind TEXT,
+                                                  strategy TEXT DEFAULT '');
+                CREATE INDEX IF NOT EXISTS media_last_used ON media (last_used);
+                CREATE INDEX IF NOT EXISTS media_size ON media (size);
+            ''')
+            if "strategy" not in {r[1] for r in conn.execute("PRAGMA table_info(media)")}:
+                conn.execute("ALTER TABLE media ADD COLUMN strategy TEXT DEFAULT ''")
+            conn.commit()
+            self._conn = conn
+            self._import_legacy(conn)
+            self._total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+        return self._conn
+
+    def _import_legacy(self, conn: sqlite3.Connection):
+        if not (self.legacy_json and os.path.exists(self.legacy_json)):
+            return
+        try:
+            with open(self.legacy_json, encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            legacy = {}
+        rows = []
+        for h, d in (legacy.items() if isinstance(legacy, dict) else ()):
+            if isinstance(d, dict) and d.get("path"):
+                kind = "video" if os.path.basename(os.path.dirname(d["path"])) == "videos" else "image"
+                rows.append(MediaEntry(h, d["path"], d.get("size", 0), d.get("last_used", 0), kind))
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO media VALUES (?, ?, ?, ?, ?, ?)", rows)
+        os.replace(self.legacy_json, f"{self.legacy_json}.imported")
+
+    def get(self, hash_: str) -> MediaEntry | None:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM media WHERE hash = ?", (hash_,)).fetchone()
+        return MediaEntry(*row) if row else None
+
+    def put(self, entry: MediaEntry):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                old = conn.execute("SELECT size FROM media WHERE hash = ?", (entry.hash,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)", entry)
+            self._total += entry.size - (old[0] if old else 0)
+
+    def touch(self, hashes: list[str], now: float) -> set[str]:
+        '''Marks the entries used at `now`. Returns the hashes that are not in the index.'''
+        if not hashes:
+            return set()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("UPDATE media SET last_used = ? WHERE hash = ?", [(now, h) for h in hashes])
+                found = {r[0] for r in conn.execute(f"SELECT hash FROM media WHERE hash IN ({', '.join('?' * len(hashes))})", hashes)}
+        return set(hashes) - found
+
+    def delete(self, hashes: list[str]):
+        if not hashes:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                freed = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM media WHERE hash IN ({', '.join('?' * len(hashes))})",
+                                     hashes).fetchone()[0]
+                conn.executemany("DELETE FROM media WHERE hash = ?", [(h,) for h in hashes])
+            self._total -= freed
+
+    def known(self, hashes: list[str]) -> set[str]:
+        '''The hashes of `hashes` that are in the index.'''
+        if not hashes:
+            return set()
+        with self._lock:
+            rows = self._connect().execute(f"SELECT hash FROM media WHERE hash IN ({', '.join('?' * len(hashes))})", hashes)
+            return {r[0] for r in rows}
+
+    def paths(self) -> set[str]:
+        with self._lock:
+            return {r[0] for r in self._connect().execute("SELECT path FROM media")}
+
+    def unused_since(self, before: float, larger_than = -1) -> list[MediaEntry]:
+        '''Entries last used before `before` (and bigger than `larger_than` bytes), least recently used first.'''
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM media WHERE last_used < ? AND size > ? ORDER BY last_used",
+                                           (before, larger_than)).fetchall()
+        return [MediaEntry(*r) for r in rows]
+
+    def expired(self, before: float, limit: int) -> list[MediaEntry]:
+        '''Up to `limit` entries last used before `before`, least recently used first.'''
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM media WHERE last_used < ? ORDER BY last_used LIMIT ?", (before, limit)).fetchall()
+        return [MediaEntry(*r) for r in rows]
+
+    def large_unused(self, larger_than: int, before: float, limit: int) -> list[MediaEntry]:
+        '''Up to `limit` entries bigger than `larger_than` bytes and last used before `before`, found through the size index.'''
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM media INDEXED BY media_size WHERE size > ? AND last_used < ? LIMIT ?",
+                                           (larger_than, before, limit)).fetchall()
+        return [MediaEntry(*r) for r in rows]
+
+    def oldest(self, limit: int) -> list[MediaEntry]:
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM media ORDER BY last_used LIMIT ?", (limit,)).fetchall()
+        return [MediaEntry(*r) for r in rows]
+
+    def total_size(self) -> int:
+        with self._lock:
+            self._connect()
+            return self._total
+
+    def strategies(self) -> dict[str, tuple[int, int]]:
+        '''Ingest strategy -> (files, bytes) of the cached files.'''
+        with self._lock:
+            rows = self._connect().execute("SELECT strategy, COUNT(*), COALESCE(SUM(size), 0) FROM media GROUP BY strategy").fetchall()
+        return {r[0]: (r[1], r[2]) for r in rows}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
\ No newline at end of file
@@ -0,0 +1,102 @@
+from .configs import MEDIA_INGEST_HARDLINK
+import os
+import stat
+
+try:
+    import fcntl # POSIX only, for the FICLONE reflink
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+COPY_CHUNK_SIZE = 1024 * 1024
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+COPY = "copy"
+
+def hardlink_allowed(st: os.stat_result, policy = MEDIA_INGEST_HARDLINK) -> bool:
+    '''"always", "never", or "readonly": only sources nobody can write to, so the cached copy can't change under the cache.'''
+    if policy == "always":
+        return True
+    if policy == "readonly":
+        return not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    return False
+
+def reflink(src: str, dst: str) -> bool:
+    '''Copy-on-write clone (btrfs, XFS, bcachefs, ...), no data is read or written.'''
+    if fcntl is None:
+        return False
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        try:
+            fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+def hardlink(src: str, dst: str) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
+
+def _kernel_copy(src: str, dst: str, copy_range) -> bool:
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        size = os.fstat(fi.fileno()).st_size
+        done = 0
+        try:
+            while done < size:
+                n = copy_range(fi.fileno(), fo.fileno(), done, size - done)
+                if n == 0:
+                    break
+                done += n
+        except OSError:
+            done = -1
+    if done == size:
+        return True
+    os.remove(dst)
+    return False
+
+def copy_file_range(src: str, dst: str) -> bool:
+    '''In-kernel copy, offloaded to the filesystem / storage where it can (server-side copies, reflinks on some filesystems).'''
+    if not hasattr(os, "copy_file_range"):
+        return False
+    return _kernel_copy(src, dst, lambda fi, fo, offset, count: os.copy_file_range(fi, fo, count, offset))
+
+def sendfile(src: str, dst: str) -> bool:
+    '''In-kernel copy without the user space buffers, for kernels / filesystems without copy_file_range.'''
+    if not hasattr(os, "sendfile"):
+        return False
+    return _kernel_copy(src, dst, lambda fi, fo, offset, count: os.sendfile(fo, fi, offset, count))
+
+def copy(src: str, dst: str, on_chunk = None) -> bool:
+    '''Plain chunked copy. `on_chunk(offset, chunk)` sees the content as it's copied (to hash it in the same pass).'''
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        offset = 0
+        while chunk := fi.read(COPY_CHUNK_SIZE):
+            fo.write(chunk)
+            if on_chunk:
+                on_chunk(offset, chunk)
+            offset += len(chunk)
+    return True
+
+def ingest(src: str, dst: str, hardlink_policy = MEDIA_INGEST_HARDLINK, on_chunk = None) -> str:
+    '''
+    Puts the content of `src` at `dst` (which must not exist) the cheapest way available and returns how: a reflink, a hardlink
+    (same filesystem, allowed by `hardlink_policy`), `copy_file_range`, `sendfile`, or a plain copy as the last resort. Only the
+    plain copy reads the data in user space, so only it calls `on_chunk`. Blocking, call it in a thread.
+    '''
+    if reflink(src, dst):
+        return REFLINK
+    if hardlink_allowed(os.stat(src), hardlink_policy) and hardlink(src, dst):
+        return HARDLINK
+    if copy_file_range(src, dst):
+        return COPY_FILE_RANGE
+    if sendfile(src, dst):
+        return SENDFILE
+    copy(src, dst, on_chunk)
+    return COPY
\ No newline at end of file
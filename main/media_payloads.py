@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from .configs import PAYLOAD_CACHE_MEMORY_MBS, PAYLOAD_CACHE_DISK_MBS, ERROR_TOKEN
+from .media_hash import FileHasher
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+def payload_size(value) -> int:
+    '''Bytes of an encoding: a base64 string or a list of them (sampled video frames).'''
+    if isinstance(value, str):
+        return len(value)
+    return sum(len(v) for v in value)
+
+class PayloadCache:
+    '''
+    Ready-to-send encodings of media (base64 images and audio, base64 videos or their sampled JPEG frames), keyed by
+    `(media hash, target model, kind, frame stride, format)`, so a file sent again on a later turn isn't read, decoded and
+    encoded again. The most recently used encodings stay in memory up to `max_memory_MBs`, older ones are spilled to `folder`
+    (least recently used removed past `max_disk_MBs`) and read back from there.
+    '''
+    def __init__(self, folder: str, hasher: FileHasher, max_memory_MBs = PAYLOAD_CACHE_MEMORY_MBS,
+                 max_disk_MBs = PAYLOAD_CACHE_DISK_MBS) -> None:
+        self.folder = folder
+        self.hasher = hasher
+        self.max_memory_bytes = int(max_memory_MBs * 1024 ** 2)
+        self.max_disk_bytes = int(max_disk_MBs * 1024 ** 2)
+        self.memory: OrderedDict[tuple, str | list[str]] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk: OrderedDict[str, int] | None = None # file name -> size, read from the folder on first use
+        self.disk_bytes = 0
+        self._lock = threading.Lock() # the disk side runs in threads
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "spilled": 0, "disk_evictions": 0, "bytes_served": 0}
+
+    @staticmethod
+    def file_name(key: tuple) -> str:
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest() + ".b64"
+
+    @staticmethod
+    def dump(value) -> str:
+        '''One line per frame (base64 has no newlines) after an "S" (string) or "L" (list) header line.'''
+        if isinstance(value, str):
+            return "S\n" + value
+        return "L\n" + "\n".join(value)
+
+    @staticmethod
+    def parse(text: str):
+        kind, _, body = text.partition("\n")
+        if kind == "S":
+            return body
+        if kind == "L":
+            return body.split("\n") if body else []
+        raise ValueError(f"Not a payload file: {kind[:16]!r}")
+
+    async def get_or_encode(self, path: str, model: str, kind: str, encode, stride = None, format_ = None):
+        '''
+        The `(encoding, error)` of `path` for `model`, from the cache or from `encode()` (a coroutine returning the same) on a
+        miss. Failed encodings aren't kept, and files that can't be hashed go straight to `encode()`.
+        '''
+        try:
+            digest = await asyncio.to_thread(self.hasher.hash_file, path)
+        except OSError:
+            return await encode()
+        key = (digest, model, kind, stride, format_)
+
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+        else:
+            value = await asyncio.to_thread(self._read, key)
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                await self._keep(key, value)
+        if value is not None:
+            self.stats["bytes_served"] += payload_size(value)
+            return (list(value) if isinstance(value, list) else value), None
+
+        self.stats["misses"] += 1
+        value, e = await encode()
+        if not (isinstance(value, str) and value == ERROR_TOKEN) and e is None:
+            await self._keep(key, value)
+            if isinstance(value, list):
+                value = list(value)
+        return value, e
+
+    async def _keep(self, key: tuple, value):
+        self.memory[key] = value
+        self.memory_bytes += payload_size(value)
+        spill = []
+        while self.memory_bytes > self.max_memory_bytes and self.memory:
+            old_key, old = self.memory.popitem(last=False)
+            self.memory_bytes -= payload_size(old)
+            spill.append((old_key, old))
+        if spill:
+            await asyncio.to_thread(self._spill, spill)
+
+    def _load_disk(self):
+        if self.disk is not None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        files = []
+        with os.scandir(self.folder) as it:
+            for e in it:
+                if e.name.endswith(".b64"):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, e.name, st.st_size))
+        files.sort()
+        self.disk = OrderedDict((name, size) for _, name, size in files)
+        self.disk_bytes = sum(self.disk.values())
+
+    def _read(self, key: tuple):
+        name = self.file_name(key)
+        with self._lock:
+            self._load_disk()
+            if name not in self.disk: # type: ignore
+                return None
+            self.disk.move_to_end(name) # type: ignore
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                value = self.parse(f.read())
+            os.utime(path) # keeps the least recently used order across restarts
+            return value
+        except (OSError, ValueError):
+            with self._lock:
+                if self.disk is not None and name in self.disk:
+                    self.disk_bytes -= self.disk.pop(name)
+            return None
+
+    def _spill(self, entries: list[tuple[tuple, str | list[str]]]):
+        with self._lock:
+            self._load_disk()
+        for key, value in entries:
+            if payload_size(value) > self.max_disk_bytes:
+                continue
+            name = self.file_name(key)
+            with self._lock:
+                if name in self.disk: # type: ignore
+                    continue # read back from there, encodings of a key don't change
+            path = os.path.join(self.folder, name)
+            tmp = os.path.join(self.folder, f".{uuid.uuid4().hex}.tmp")
+            with open(tmp, "w", encoding="ascii", newline="") as f:
+                f.write(self.dump(value))
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                self.disk_bytes += size - self.disk.pop(name, 0) # type: ignore
+                self.disk[name] = size # type: ignore
+                self.stats["spilled"] += 1
+                evict = []
+                while self.disk_bytes > self.max_disk_bytes and self.disk:
+                    old, old_size = self.disk.popitem(last=False)
+                    self.disk_bytes -= old_size
+                    evict.append(old)
+                self.stats["disk_evictions"] += len(evict)
+            for old in evict:
+                try:
+                    os.remove(os.path.join(self.folder, old))
+                except FileNotFoundError:
+                    pass
+
+    def metrics(self):
+        return {**self.stats, "memory_entries": len(self.memory), "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk) if self.disk is not None else None,
+                "disk_bytes": self.disk_bytes if self.disk is not None else None}
\ No newline at end of file
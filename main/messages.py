@@ -0,0 +1,184 @@
+from collections.abc import Mapping
+import sys
+import uuid
+
+class FrozenDict(dict):
+    '''
+    Read-only dict for the values nested inside a message (tool calls, content parts). Item assignment and the mutating methods
+    raise `TypeError`, and `copy` / `deepcopy` return the object itself.
+    '''
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Message records are read-only, use `evolve()` / `without()` to get a changed copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly # type:ignore
+    setdefault = pop = popitem = clear = update = _readonly # type:ignore
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+_MISSING = object()
+_FIELDS = ("role", "content", "thinking", "tool_calls")
+_META_FIELDS = ("edited", "gen_idx", "msg_id", "msg_idx")
+_SLOTS = {"role": "_role", "content": "_content", "thinking": "_thinking", "tool_calls": "_tool_calls", "edited": "_edited",
+          "gen_idx": "_gen_idx", "msg_id": "_msg_id", "msg_idx": "_msg_idx"}
+
+def _compact_id(value):
+    '''UUID strings are kept as their 16 raw bytes, anything else as it is.'''
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            u = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(u) == value:
+            return u.bytes
+    return value
+
+class Message(Mapping):
+    '''
+    Read-only chat message record.
+
+    The usual keys (`role`, `content`, `thinking`, `tool_calls`, `edited`, `gen_idx`, `msg_id`, `msg_idx`) live in slots, roles
+    are interned and UUID `msg_id`s are stored as 16 bytes; any other key goes to a small `extra` dict. It reads like the plain
+    message dicts (`m["content"]`, `m.get(...)`, `**m`, `dict(m)`) but is not one: `to_dict()` converts it where a real dict is
+    needed (JSON, model payloads, see `encode` / `as_payload`).
+
+    Records never change, so conversation snapshots share them and `copy` / `deepcopy` return the record itself. `evolve` /
+    `without` return changed copies.
+    '''
+    __slots__ = ("_role", "_content", "_thinking", "_tool_calls", "_edited", "_gen_idx", "_msg_id", "_msg_idx", "_extra")
+
+    def __init__(self, data: Mapping | None = None, **kwargs) -> None:
+        data = {**(data or {}), **kwargs}
+        setter = object.__setattr__
+        for key, slot in _SLOTS.items():
+            value = data.pop(key, _MISSING)
+            if value is not _MISSING:
+                if key == "role" and isinstance(value, str):
+                    value = sys.intern(value)
+                elif key == "msg_id":
+                    value = _compact_id(value)
+                else:
+                    value = _freeze_value(value)
+            setter(self, slot, value)
+        setter(self, "_extra", FrozenDict({k: _freeze_value(v) for k, v in data.items()}) if data else None)
+
+    def __setattr__(self, name, value):
+        raise TypeError("Message records are read-only, use `evolve()` / `without()` to get a changed copy")
+
+    __delattr__ = __setattr__ # type:ignore
+
+    def get(self, key, default = None):
+        slot = _SLOTS.get(key)
+        if slot is None:
+            extra = self._extra
+            return default if extra is None else extra.get(key, default)
+        value = object.__getattribute__(self, slot)
+        if value is _MISSING:
+            return default
+        if type(value) is bytes and key == "msg_id":
+            return str(uuid.UUID(bytes=value))
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in _FIELDS:
+            if object.__getattribute__(self, _SLOTS[key]) is not _MISSING:
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+        for key in _META_FIELDS:
+            if object.__getattribute__(self, _SLOTS[key]) is not _MISSING:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        slot = _SLOTS.get(key)
+        if slot is not None:
+            return object.__getattribute__(self, slot) is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return thaw(self) == thaw(other)
+        return NotImplemented
+
+    __hash__ = None # type:ignore
+
+    def __repr__(self):
+        return f"Message({self.to_dict()!r})"
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Message, (self.to_dict(),))
+
+    def to_dict(self) -> dict:
+        '''Plain dict (nested values stay read-only, which JSON and the HTTP clients treat as dicts / lists).'''
+        return {k: self[k] for k in self}
+
+    def evolve(self, **changes) -> 'Message':
+        return Message({**self.to_dict(), **changes})
+
+    def without(self, *keys) -> 'Message':
+        return Message({k: v for k, v in self.items() if k not in keys})
+
+    def thaw(self) -> dict:
+        '''Mutable deep copy, with lists back as lists.'''
+        return thaw(self)
+
+def _freeze_value(value):
+    if isinstance(value, (FrozenDict, str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, Mapping):
+        return FrozenDict({k: _freeze_value(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    return value
+
+def freeze(message) -> Message:
+    '''Read-only record of a message dict. Records are returned as they are.'''
+    if isinstance(message, Message):
+        return message
+    return Message(message)
+
+def freeze_all(messages) -> tuple[Message, ...]:
+    '''Frozen tuple of messages. Costs one pointer per already frozen record.'''
+    if isinstance(messages, tuple) and all(type(m) is Message for m in messages):
+        return messages
+    return tuple(freeze(m) for m in messages)
+
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+def encode(value):
+    '''`default=` hook for `json.dumps` of anything holding records.'''
+    if isinstance(value, Message):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def as_payload(messages) -> list:
+    '''Messages as plain dicts for a model request.'''
+    return [m.to_dict() if isinstance(m, Message) else m for m in messages]
\ No newline at end of file
@@ -10,6 +10,9 @@ from io import BytesIO
 import base64
 import aiofiles
 import av
+import time
+from contextlib import contextmanager
+from main.messages import as_payload
 from main.configs import IMAGE_EXTs, VIDEO_EXTs, ERROR_TOKEN
 
 class Model:
@@ -33,7 +36,14 @@ class Model:
         self.input_handler = InputHandler()
         self.event_bus = event_bus
         self.details_cache = None
-        self.resource_manager: ResourceManager | SessionManager = SessionManager(model_name)
+        self.warmup_timings: dict[str, float] = {}
+        self.admission = None
+        self.resource_manager: ResourceManager | SessionManager = SessionManager(model_name, host)
+
+        # how much of each prompt could come from the server's prompt cache, see `record_prompt_eval`
+        self.prompt_stats = {"requests": 0, "prompt_eval_count": 0, "prompt_eval_seconds": 0.0, "last_prompt_eval_count": None,
+                             "last_prompt_eval_seconds": None, "last_messages": 0, "last_shared_prefix_messages": 0}
+        self._last_messages: list = []
 
     async def __aenter__(self):
         await self.warm_up()
@@ -60,6 +70,15 @@ class Model:
     async def shutdown(self):
         raise NotImplementedError
     
+    @contextmanager
+    def timed_phase(self, phase: str):
+        '''Adds the wall time of the block to `warmup_timings[phase]`, used for the startup report.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.warmup_timings[phase] = self.warmup_timings.get(phase, 0.0) + (time.perf_counter() - start)
+
     async def clear_details_cache(self):
         async with self.state_lock: self.details_cache = None
 
@@ -78,7 +97,16 @@ class Model:
         else:
             messages.append({'role': "system", 'content': system_prompt_override})
 
-        if query and query.strip(): messages += context + [{"role": "user", "content": query}]
+        if query and query.strip(): messages += as_payload(context) + [{"role": "user", "content": query}]
+
+        shared = 0
+        for a, b in zip(messages, self._last_messages):
+            if a != b:
+                break
+            shared += 1
+        self._last_messages = messages
+        self.prompt_stats["last_messages"] = len(messages)
+        self.prompt_stats["last_shared_prefix_messages"] = shared
 
         data = {
             "model": self.model_name,
@@ -91,6 +119,20 @@ class Model:
 
         return data
 
+    def record_prompt_eval(self, final: dict):
+        '''
+        Keeps the prompt numbers of a finished Ollama request (its last chunk). `prompt_eval_count` only counts the prompt tokens
+        the server had to evaluate, tokens of a prefix it still had cached are skipped, so it drops as prompts share more prefix.
+        '''
+        count = final.get("prompt_eval_count", 0) # left out by Ollama when the whole prompt was cached
+        seconds = final.get("prompt_eval_duration", 0) / 1e9
+        s = self.prompt_stats
+        s["requests"] += 1
+        s["prompt_eval_count"] += count
+        s["prompt_eval_seconds"] += seconds
+        s["last_prompt_eval_count"] = count
+        s["last_prompt_eval_seconds"] = seconds
+
     async def _get_model_details_helper(self, res:dict, default_capability = "completion", auto_add_completion = True):
         capabilities:list = res.get("capabilities", [default_capability])
         inp = res.get("input_modalities", [])
@@ -159,12 +201,19 @@ class Model:
     
 
 class InputHandler:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, payloads = None) -> None:
+        '''`payloads`: a `PayloadCache` the `cached` encodings go through, None to encode every time.'''
+        self.payloads = payloads
 
     def is_url(self, url:str):
         url = url.lower()
         return url.startswith('http://') or url.startswith('https://') or url.startswith('www.')
+
+    async def cached(self, path, model, kind, encode, stride = None, format_ = None):
+        '''`encode()` through the payload cache, URLs and handlers without one encode every time.'''
+        if self.payloads is None or not path or self.is_url(path):
+            return await encode()
+        return await self.payloads.get_or_encode(path, model, kind, encode, stride, format_)
     
     async def encode_frames_from_vid(self, video_path, url_valid = False, mod_ = 1, format_ = "JPEG", max_video_size_mbs = 5):
         if url_valid:
@@ -4,6 +4,7 @@ from .ollama_models import OllamaModel, IDLE, BUSY, SHUTTING_DOWN, DOWN, OllamaE
 from main.utils import Logger
 from main.events import EventBus
 from main.resource_manager import ResourceManager
+from main.http_pool import ConnectionPool
 
 class LocalModel(OllamaModel):
     def __init__(self, role: str, name: str, model_name: str, has_tools: bool, has_CoT: bool, has_vision: bool, has_audio, port: int, system_prompt: str, 
@@ -17,7 +18,7 @@ class LocalModel(OllamaModel):
         self.use_custom_keep_alive_timeout = True
         self.custom_keep_alive_timeout = "-1"
         self.use_mmap = False
-        self.resource_manager:ResourceManager = ResourceManager(self.model_name)
+        self.resource_manager:ResourceManager = ResourceManager(self.model_name, self.host)
 
     async def warm_up(
         self,
@@ -28,14 +29,15 @@ class LocalModel(OllamaModel):
         has_video_processing=False,
         warmup_video_path="main/test.mp4"):
 
-        self.resource_manager.create_process(self.start_command, self.ollama_env)
+        self.warmup_timings = {}
+        with self.timed_phase("spawn"):
+            self.resource_manager.create_process(self.start_command, self.ollama_env)
 
         is_actually_alive = False
         try:
-            async with aiohttp.ClientSession(
-                timeout=aiohttp.ClientTimeout(total=2)
-            ) as session:
-                async with session.get(f"{self.host}/api/tags") as res:
+            with self.timed_phase("liveness_check"):
+                session = ConnectionPool.get_session(self.host)
+                async with session.get(f"{self.host}/api/tags", timeout=aiohttp.ClientTimeout(total=2)) as res:
                     if res.status == 200:
                         js = await res.json(encoding='utf-8')
                         downloaded_models = [m['name'] for m in js.get("models", [])]
@@ -118,7 +120,7 @@ class LocalEmbedder(OllamaEmbedder):
         self.ollama_env = os.environ.copy()
         self.ollama_env["OLLAMA_HOST"] = self.host
         self.warmed_up = False
-        self.resource_manager:ResourceManager = ResourceManager(self.model_name)
+        self.resource_manager:ResourceManager = ResourceManager(self.model_name, self.host)
 
     async def warm_up(self):
         self.resource_manager.create_process(self.start_command, self.ollama_env)
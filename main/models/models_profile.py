@@ -8,7 +8,7 @@ class RemoteModel(OllamaModel):
                  api_key: None | str = None, event_bus: None | EventBus = None) -> None:
         super().__init__(role,name,model_name, has_tools, has_CoT, has_vision, has_audio, port, system_prompt, 
                          api_key, event_bus)
-        self.resource_manager = SessionManager(self.model_name)
+        self.resource_manager = SessionManager(self.model_name, self.host)
         
     async def warm_up(
         self,
@@ -19,6 +19,7 @@ class RemoteModel(OllamaModel):
         has_video_processing=False,
         warmup_video_path="main/test.mp4"):
 
+        self.warmup_timings = {}
         await self._warmer(use_mmap=use_mmap, custom_keep_alive_timeout="-1", use_custom_keep_alive_timeout=True, has_video_processing=has_video_processing, 
                            warmup_image_path=warmup_image_path,warmup_video_path=warmup_video_path)
         if self.warmed_up:
@@ -58,7 +59,7 @@ class RemoteModel(OllamaModel):
 class RemoteEmbedder(OllamaEmbedder):
     def __init__(self, role, name: str, model_name: str, port:int, api_key, event_bus, **kwargs) -> None:
         super().__init__(role, name, model_name, port, api_key, event_bus)
-        self.resource_manager = SessionManager(self.model_name)
+        self.resource_manager = SessionManager(self.model_name, self.host)
 
     async def warm_up(self):
         await self._warmer()
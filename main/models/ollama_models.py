@@ -5,6 +5,7 @@ import json
 from main.utils import Logger, strip_thinking
 from main.configs import IMAGE_EXTs, VIDEO_EXTs, AUDIO_EXTs, ERROR_TOKEN
 from main.events import EventBus
+from main.stream_decoder import StreamDecoder, NDJSON
 from .base_model import Model
 import traceback
 import sys
@@ -18,6 +19,7 @@ BUSY = "busy"
 SHUTTING_DOWN = "shutting_down"
 DOWN = "down"
 WARMING_UP = "warming_up"
+UNLOADED = "unloaded"
 
 class OllamaModel(Model):
     def __init__(self, role: str, name: str, model_name: str, has_tools: bool, has_CoT: bool, has_vision: bool, has_audio, port: int, system_prompt: str, 
@@ -59,16 +61,17 @@ class OllamaModel(Model):
         if not self.has_vision:
             return [], None
         try:
-            return await self.input_handler.encode_frames_from_vid(video_path, False, mod_, format_, 5)
+            return await self.input_handler.cached(video_path, self.model_name, "video",
+                                                   lambda: self.input_handler.encode_frames_from_vid(video_path, False, mod_, format_, 5), mod_, format_)
         except Exception as e:
             await Logger.log_async(f"Error in video frame encoding for {self.name}: {e}; {traceback.format_exc()}", 'error')
             return ERROR_TOKEN, repr(e)
     
     async def _encode_image(self, image_path):
-        return await self.input_handler.encode_image(image_path, False)
+        return await self.input_handler.cached(image_path, self.model_name, "image", lambda: self.input_handler.encode_image(image_path, False))
     
     async def _encode_audio(self, audio_path):
-        return await self.input_handler.encode_audio(audio_path, False)
+        return await self.input_handler.cached(audio_path, self.model_name, "audio", lambda: self.input_handler.encode_audio(audio_path, False))
 
 
     def cancel_global(self):
@@ -150,7 +153,7 @@ class OllamaModel(Model):
 
         await self.change_state(BUSY)
 
-        buffer = ""
+        decoder = StreamDecoder(NDJSON)
 
         if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.INFO, msg = f"Generating response for {self.name}({self.model_name}) [{self.role}]...")
 
@@ -161,41 +164,33 @@ class OllamaModel(Model):
 
                 if stream:
                     try:
-                        async for raw_chunk in response.content.iter_chunked(1024):
+                        async for raw_chunk in response.content.iter_any():
 
                             if self.generation_cancelled:
                                 await Logger.log_async(f"Cancellation requested for {self.name}, breaking stream", "info")
                                 break
 
-                            chunk = raw_chunk.decode("utf-8", errors='ignore')
-                            buffer += chunk
-
-                            while "\n" in buffer and not self.generation_cancelled and (not self.resource_manager.session.closed):
-                                line, buffer = buffer.split("\n", 1)
-                                line = line.strip()
-                                if not line:
-                                    continue
-
-                                try:
-                                    json_line = json.loads(line)
-                                    if 'error' in json_line:
-                                        e = json_line['error']
-                                        await Logger.log_async(f"Ollama API Request Error: {e}; {traceback.format_exc()}", "error")
-                                        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.ERROR, msg = f"Ollama API Request Error: {e}")
-
-                                    thinking_chunk = json_line.get("message", {}).get("thinking", "")
-                                    content_chunk = json_line.get("message", {}).get("content", "")
-                                    tools_chunk = json_line.get("message", {}).get("tool_calls", []) 
-                                    yield (thinking_chunk, content_chunk, tools_chunk)
-                                except json.JSONDecodeError:
-                                    continue
+                            for json_line in decoder.feed(raw_chunk):
+                                if self.generation_cancelled or self.resource_manager.closed:
+                                    break
+
+                                if 'error' in json_line:
+                                    e = json_line['error']
+                                    await Logger.log_async(f"Ollama API Request Error: {e}; {traceback.format_exc()}", "error")
+                                    if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.ERROR, msg = f"Ollama API Request Error: {e}")
+
+                                if json_line.get("done"):
+                                    self.record_prompt_eval(json_line)
+
+                                message = json_line.get("message", {})
+                                yield (message.get("thinking", ""), message.get("content", ""), message.get("tool_calls", []))
 
                             if self.generation_cancelled:
                                 await response.release()
                                 self.generation_cancelled = False
                                 break
 
-                            if self.resource_manager.session.closed: # type:ignore
+                            if self.resource_manager.closed:
                                 await response.release()
 
                     except asyncio.CancelledError:
@@ -211,6 +206,8 @@ class OllamaModel(Model):
                             e = res_json['error']
                             await Logger.log_async(f"Ollama API Request Error: {e}; {traceback.format_exc()}", "error")
                             if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.ERROR, msg = f"Ollama API Request Error: {e}")
+                        elif res_json.get("done"):
+                            self.record_prompt_eval(res_json)
                             
                         thinking = res_json.get("message", {}).get("thinking", "")
                         content = res_json.get("message", {}).get("content", "")
@@ -246,6 +243,7 @@ class OllamaModel(Model):
     def update_port(self, port):
         self.port = port
         self.host =  f"http://localhost:{self.port}"
+        self.resource_manager.host = self.host
 
     async def _warmer(self,
         use_mmap=False,
@@ -258,7 +256,7 @@ class OllamaModel(Model):
         self.has_video = has_video_processing
 
         async with self.state_lock:
-            if self.state not in (IDLE, DOWN):
+            if self.state not in (IDLE, DOWN, UNLOADED):
                 raise RuntimeError(f"{self.name} cannot warm up from state={self.state}")
 
         await self.change_state(WARMING_UP)
@@ -266,7 +264,8 @@ class OllamaModel(Model):
 
         try:
 
-            await self.resource_manager.wait_until_ready(self.host)
+            with self.timed_phase("server_ready"):
+                await self.resource_manager.wait_until_ready(self.host)
 
             data = {
                 "model": self.model_name,
@@ -314,42 +313,31 @@ class OllamaModel(Model):
                 raise RuntimeError(f"No active aiohttp session for {self.name} ({self.model_name})")
 
             await Logger.log_async('Trying Non-Streaming...' ,'info')
-            async with self.resource_manager.session.post(url, headers=headers, data=json.dumps(data)) as response: 
-                response.raise_for_status()
-                try:
-                    resp = await response.json()
-                    await Logger.log_async(f"Raw non-streaming chunk: {resp}", 'info')
-                except Exception as e:
-                    await Logger.log_async(f"Failed to load model's response while non streaming: {repr(e)}", 'error')
-                    raise Exception(f"Failed to load model's response while non streaming: {repr(e)}") from e
+            with self.timed_phase("non_stream"):
+                async with self.resource_manager.session.post(url, headers=headers, data=json.dumps(data)) as response: 
+                    response.raise_for_status()
+                    try:
+                        resp = await response.json()
+                        await Logger.log_async(f"Raw non-streaming chunk: {resp}", 'info')
+                    except Exception as e:
+                        await Logger.log_async(f"Failed to load model's response while non streaming: {repr(e)}", 'error')
+                        raise Exception(f"Failed to load model's response while non streaming: {repr(e)}") from e
 
             data['stream'] = True
 
             await Logger.log_async('Trying Streaming...' ,'info')
-            buffer = ""
-            try:
-                async with self.resource_manager.session.post(url, headers=headers, data=json.dumps(data)) as response:
-                    response.raise_for_status()
+            decoder = StreamDecoder(NDJSON)
+            with self.timed_phase("stream"):
+                try:
+                    async with self.resource_manager.session.post(url, headers=headers, data=json.dumps(data)) as response:
+                        response.raise_for_status()
 
-                    async for chunk in response.content.iter_any():
-                        buffer += chunk.decode("utf-8")
-                        while "\n" in buffer:
-                            line, buffer = buffer.split("\n", 1)
-                            line = line.strip()
-                            if not line:
-                                continue
-                            try:
-                                json_line = json.loads(line)
-
-                                _ = json_line.get("message", {}).get("thinking", "")
-                                _ = json_line.get("message", {}).get("content", "")
-                                _ = json_line.get("message", {}).get("tool_calls", []) 
+                        async for chunk in response.content.iter_any():
+                            for json_line in decoder.feed(chunk):
                                 await Logger.log_async(f"Raw streaming chunk: {json_line}", 'info')
-                            except json.JSONDecodeError:
-                                continue
-            except Exception as e:
-                    await Logger.log_async(f"Failed to load model's response while streaming: {repr(e)}; {traceback.format_exc()}", 'error')
-                    raise Exception(f"Failed to load model's response while streaming: {repr(e)}") from e
+                except Exception as e:
+                        await Logger.log_async(f"Failed to load model's response while streaming: {repr(e)}; {traceback.format_exc()}", 'error')
+                        raise Exception(f"Failed to load model's response while streaming: {repr(e)}") from e
                     
             self.warmed_up = True
             await Logger.log_async(f"{self.name} ({self.model_name}) warmed up!", "success")
@@ -362,8 +350,8 @@ class OllamaModel(Model):
         finally: 
             await self.change_state(IDLE if self.warmed_up else DOWN)
 
-            if self.resource_manager.session and not self.warmed_up:
-                await self.resource_manager.session.close()
+            if not self.warmed_up:
+                self.resource_manager.release()
 
 
 
@@ -373,6 +361,7 @@ class OllamaEmbedder(Model):
         self.host =  f"http://localhost:{self.port}"
         super().__init__(role, self.host, name, model_name, api_key, DOWN, event_bus, port = port)
         self.generation_cancelled = False
+        self.in_flight = 0
                 
     def cancel_global(self):
         self.generation_cancelled = True
@@ -383,6 +372,7 @@ class OllamaEmbedder(Model):
     def update_port(self, port):
         self.port = port
         self.host =  f"http://localhost:{self.port}"
+        self.resource_manager.host = self.host
 
     async def get_model_details(self):
         if self.details_cache: return self.details_cache
@@ -421,14 +411,14 @@ class OllamaEmbedder(Model):
             "input": input_
         }
 
-        await self.change_state(BUSY)
-
         if not self.resource_manager.session:
             raise RuntimeError(f"No active aiohttp session for {self.name} ({self.model_name})")
 
         if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.INFO, msg = f"Embedding input(s) with {self.name}({self.model_name})")
 
+        self.in_flight += 1
         try:
+            await self.change_state(BUSY)
             timeout = aiohttp.ClientTimeout(total=120)
             async with self.resource_manager.session.post(url, headers=headers, data=json.dumps(data), timeout=timeout) as response:
                 response.raise_for_status()
@@ -437,7 +427,7 @@ class OllamaEmbedder(Model):
                     await response.release()
                     self.generation_cancelled = False
 
-                if self.resource_manager.session.closed:
+                if self.resource_manager.closed:
                     await response.release()
 
                 try:
@@ -460,12 +450,13 @@ class OllamaEmbedder(Model):
         
         finally:
             self.generation_cancelled = False
-            await self.change_state(IDLE)
+            self.in_flight -= 1
+            if not self.in_flight: await self.change_state(IDLE)
 
     async def _warmer(self):
 
         async with self.state_lock:
-            if self.state not in (IDLE, DOWN):
+            if self.state not in (IDLE, DOWN, UNLOADED):
                 raise RuntimeError(f"{self.name} cannot warm up from state={self.state}")
 
         await self.change_state(WARMING_UP)
@@ -503,7 +494,7 @@ class OllamaEmbedder(Model):
                     await response.release()
                     self.generation_cancelled = False
 
-                if self.resource_manager.session.closed:
+                if self.resource_manager.closed:
                     await response.release()
 
                 try:
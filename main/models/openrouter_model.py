@@ -3,6 +3,7 @@ import aiohttp
 import json
 from main.resource_manager import SessionManager
 from main.events import EventBus
+from main.stream_decoder import StreamDecoder, SSE
 from .base_model import Model
 from main.utils import Logger, strip_thinking
 from main.configs import IMAGE_EXTs, VIDEO_EXTs, AUDIO_EXTs, ERROR_TOKEN
@@ -25,7 +26,7 @@ class OpenRouterModel(Model):
         self.url_media_valid = False
         self.system = system_prompt
         self.has_video = False
-        self.resource_manager = SessionManager(self.model_name)
+        self.resource_manager = SessionManager(self.model_name, self.host)
 
     def update_port(self, port):
         pass
@@ -67,16 +68,17 @@ class OpenRouterModel(Model):
         if not self.has_vision:
             return [], None
         try:
-            return await self.input_handler.encode_frames_from_vid(video_path, self.url_media_valid, mod_, format_, 5)
+            return await self.input_handler.cached(video_path, self.model_name, "video",
+                                                   lambda: self.input_handler.encode_frames_from_vid(video_path, self.url_media_valid, mod_, format_, 5), mod_, format_)
         except Exception as e:
             await Logger.log_async(f"Error in video frame encoding for {self.name}: {e}; {traceback.format_exc()}", 'error')
             return ERROR_TOKEN, repr(e)
     
     async def _encode_image(self, image_path):
-        return await self.input_handler.encode_image(image_path, self.url_media_valid)
+        return await self.input_handler.cached(image_path, self.model_name, "image", lambda: self.input_handler.encode_image(image_path, self.url_media_valid))
     
     async def _encode_audio(self, audio_path):
-        return await self.input_handler.encode_audio(audio_path, self.url_media_valid)
+        return await self.input_handler.cached(audio_path, self.model_name, "audio", lambda: self.input_handler.encode_audio(audio_path, self.url_media_valid))
 
     async def get_multimodal_data(self, data, query:str | None, file_path, mod_, video_save_buffer_format):
         data = data.copy()
@@ -216,7 +218,7 @@ class OpenRouterModel(Model):
         await self.change_state(BUSY)
         if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.INFO, msg = f"Generating response for {self.name}({self.model_name}) [{self.role}]...")
 
-        buffer = ""
+        decoder = StreamDecoder(SSE)
 
         try:
             timeout = aiohttp.ClientTimeout(total=None)
@@ -232,47 +234,35 @@ class OpenRouterModel(Model):
 
                 if stream:
                     try:
-                        async for raw_chunk in response.content.iter_chunked(1024):
+                        async for raw_chunk in response.content.iter_any():
 
-                            chunk = raw_chunk.decode("utf-8", errors='ignore')
-                            buffer += chunk
+                            for json_line in decoder.feed(raw_chunk):
+                                if self.resource_manager.closed:
+                                    break
 
-                            while "\n" in buffer and (not self.resource_manager.session.closed):
-                                line, buffer = buffer.split("\n", 1)
-                                if line:
-                                    line = line.strip()
+                                if "error" in json_line:
+                                    await Logger.log_async(f"Error during generation of {self.name} ({self.model_name}) [{self.role}]: {json_line['error']['message']}", 'error')
+                                    if self.event_bus: await self.event_bus.sequence_emit(self.event_bus.ERROR, msg = f"Error during generation of {self.name} ({self.model_name}) [{self.role}]: {json_line['error']['message']}")
+                                    yield (ERROR_TOKEN, ERROR_TOKEN, [])
+                                    await self.change_state(IDLE)
+                                    return
 
-                                if line.startswith('data: '):
-                                    line = line[6:]
-                                    if line == '[DONE]':
-                                        break
-
-                                if not line:
+                                choices = json_line.get('choices')
+                                if not choices:
                                     continue
+                                message = choices[0].get('delta', choices[0].get('message'))
+                                thinking = message.get('reasoning', message.get('thinking', message.get("reasoning_content" ,"")))
+                                content = message.get('content', "")
+                                tools = message.get("tool_calls", message.get('tools',[]))
+                                if not isinstance(tools, (list, tuple)):
+                                    tools = [tools]
 
-                                try:
-                                    json_line = json.loads(line)
-
-                                    if "error" in json_line:
-                                        await Logger.log_async(f"Error during generation of {self.name} ({self.model_name}) [{self.role}]: {json_line['error']['message']}", 'error')
-                                        if self.event_bus: await self.event_bus.sequence_emit(self.event_bus.ERROR, msg = f"Error during generation of {self.name} ({self.model_name}) [{self.role}]: {json_line['error']['message']}")
-                                        yield (ERROR_TOKEN, ERROR_TOKEN, [])
-                                        await self.change_state(IDLE)
-                                        return
-
-                                    choices = list(json_line['choices'])
-                                    message = choices[0].get('delta', choices[0].get('message'))
-                                    thinking = message.get('reasoning', message.get('thinking', message.get("reasoning_content" ,"")))
-                                    content = message.get('content', "")
-                                    tools = message.get("tool_calls", message.get('tools',[]))
-                                    if not isinstance(tools, (list, tuple)):
-                                        tools = [tools]
-
-                                    yield (thinking, content, tools)
-                                except json.JSONDecodeError:
-                                    continue
+                                yield (thinking, content, tools)
+
+                            if decoder.done:
+                                break
 
-                            if self.resource_manager.session.closed:
+                            if self.resource_manager.closed:
                                 await response.release()
 
                     except asyncio.CancelledError:
@@ -325,7 +315,8 @@ class OpenRouterEmbedder(Model):
     def __init__(self, role, name: str, model_name: str, api_key:str, event_bus: None | EventBus = None, **kwargs) -> None:
         self.host =  f"https://openrouter.ai/api/v1/embeddings"
         super().__init__(role, self.host, name, model_name, api_key, DOWN, event_bus, **kwargs)
-        self.resource_manager = SessionManager(self.model_name)
+        self.resource_manager = SessionManager(self.model_name, self.host)
+        self.in_flight = 0
     
     def update_port(self, port):
         pass
@@ -385,8 +376,6 @@ class OpenRouterEmbedder(Model):
             }
         }
 
-        await self.change_state(BUSY)
-
         if not self.resource_manager.session:
             self.resource_manager.create_session()
         if not self.resource_manager.session:
@@ -394,11 +383,13 @@ class OpenRouterEmbedder(Model):
 
         if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.INFO, msg = f"Embedding input(s) with {self.name}({self.model_name})")
 
+        self.in_flight += 1
         try:
+            await self.change_state(BUSY)
             timeout = aiohttp.ClientTimeout(total=120)
             async with self.resource_manager.session.post(self.host, headers=headers, data=json.dumps(data), timeout=timeout) as response:
                 response.raise_for_status()
-                if self.resource_manager.session.closed:
+                if self.resource_manager.closed:
                     await response.release()
 
                 try:
@@ -419,4 +410,5 @@ class OpenRouterEmbedder(Model):
             return (ERROR_TOKEN)
         
         finally:
-            await self.change_state(IDLE)
\ No newline at end of file
+            self.in_flight -= 1
+            if not self.in_flight: await self.change_state(IDLE)
\ No newline at end of file
@@ -0,0 +1,101 @@
+from functools import lru_cache
+from .messages import Message
+
+class PromptBuilder:
+    '''
+    Lays out the context of a turn so consecutive requests share the longest possible prefix, which is what the server's prompt
+    cache (Ollama's KV cache) can reuse:
+
+        system prompt (added by the model) -> persisted memory block -> history -> retrieved memory + user query
+
+    Only the last message changes from turn to turn. The memory block is rendered once per distinct summary / facts / decisions /
+    threads and handed out as the same record afterwards, so its bytes stay identical until the summariser replaces them. The
+    retrieved chunks are volatile and stay inside the final user message, after everything cacheable.
+    '''
+    def __init__(self, max_rag_chars: int) -> None:
+        self.max_rag_chars = max_rag_chars
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def render_memory_block(summary: str, facts: tuple, key_decisions: tuple, open_threads: tuple) -> Message:
+        f = f"""
+            The system has also generated a set of facts extracted from the previous turns. These are still lossy facts and maybe inaccurate. 
+            For reference only, use for user profile modeling.
+            <FACTS>
+                {"\n\n-".join(facts).strip()}
+            </FACTS>
+            """ if facts and "".join(facts).strip() else ''
+        
+        o = f"""
+            The system has also generated a set of open threads (unresolved or open discussion, debate, tasks, etc) extracted from the previous turns. These are still lossy and maybe inaccurate. 
+            For reference only, use for user profile modeling.
+            <OPEN_THREADS>
+                {"\n\n-".join(open_threads).strip()}
+            </OPEN_THREADS>
+            """ if open_threads and "".join(open_threads).strip() else ''
+        
+        k = f"""
+            The system has also generated a set of key decisions (decisions, commitments, willingness, etc) extracted from the previous turns. These are still lossy and maybe inaccurate. 
+            For reference only, use for user profile modeling.
+            <KEY_DECISONS>
+                {"\n\n-".join(key_decisions).strip()}
+            </KEY_DECISONS>
+            """ if key_decisions and "".join(key_decisions).strip() else ''
+
+        return Message({"role": "assistant", "content": f"""[PERSISTED MEMORY - NOT DIALogger.log_asyncUE]
+                [INTERNAL MEMORY - DO NOT REPEAT - NOT PART OF CONVERSATION]
+
+                The system generated summary of previous messages/turns. **Do NOT** treat this as the part of the conversation. For reference only. 
+                <SUMMARY>
+                    {summary}
+                </SUMMARY>
+
+                {f}
+
+                {k}
+
+                {o}
+                                           
+                THESE ARE NOT A PART OF THE CONVERSATION. THESE ARE SYSTEM GENERATED PERSISTED MEMORY
+                [END INTERNAL DATA]""".strip()}) # role:system is fatal.
+
+    def memory_block(self, summary, facts = None, key_decisions = None, open_threads = None) -> Message | None:
+        if not summary:
+            return None
+        return self.render_memory_block(str(summary), tuple(facts or ()), tuple(key_decisions or ()), tuple(open_threads or ()))
+
+    def assemble(self, context, summary, facts = None, key_decisions = None, open_threads = None) -> list:
+        '''Memory block (when there is a summary) followed by the history. Records are read-only, a new list is enough.'''
+        block = self.memory_block(summary, facts, key_decisions, open_threads)
+        return ([block] if block else []) + list(context or [])
+
+    def rag_text(self, rag_results) -> str:
+        '''Retrieved chunks, best first, up to `max_rag_chars` characters.'''
+        current_chars = 0
+        rag_text = ""
+        for r in rag_results:
+            score = r["score"]
+            text = r["text"]
+            meta = r["metadata"]
+            if not text.strip():
+                continue
+            if current_chars + len(text) > self.max_rag_chars:
+                break
+            source = meta.get('source', 'unknown') if meta else 'unknown'
+            rag_text += f"\n\nSource: {source} | Score: {score:.3f} | {text}"
+            current_chars += len(text)
+        return rag_text
+
+    def query_with_memory(self, query, rag_text) -> str:
+        return f'''
+                    The system has retrieved a few *maybe* relevent user memory, saved by the system.
+                    <important>
+                    THESE ARE **NOT** PART OF THE CONVERSATION. THESE ARE SYSTEM MAINTAINED MEMORY.
+                    </important>
+                    <RETRIEVED CHUNKS>
+                    {rag_text}
+                    </RETRIEVED CHUNKS>
+                    <UserQuery>
+                    {query}
+                    </UserQuery>
+                    '''
\ No newline at end of file
@@ -2,38 +2,35 @@ import aiohttp
 import subprocess
 import psutil
 from .utils import Logger
+from .http_pool import ConnectionPool
 import asyncio
 import os
 import sys
 import traceback
 
 class SessionManager:
-    def __init__(self, model_name) -> None:
+    def __init__(self, model_name, host: str | None = None) -> None:
         self.session:None | aiohttp.ClientSession = None
         self.model_name = model_name
+        self.host = host
+
+    @property
+    def closed(self):
+        return self.session is None or self.session.closed
     
     def create_session(self,):
         if not self.session or self.session.closed:
-            self.session = aiohttp.ClientSession()
+            self.session = ConnectionPool.get_session(self.host)
+
+    def release(self):
+        '''Drops the borrowed pooled session, the session itself stays open for the other models.'''
+        self.session = None
     
     async def shutdown(self, send_shutdown_paylod = True, url= None, headers:dict | None = None, payload=None, set_session_to_None=False):
-        if self.session is not None:
-            if not send_shutdown_paylod:
-                try:
-                    await self.session.close()
-                except Exception as e:
-                    await Logger.log_async(f"An error occurred during session cleanup: {e}; {traceback.format_exc()}", "error")
-                
-                if set_session_to_None and (self.session and (not self.session.closed)):
-                    try:
-                        await self.session.close()
-                        await asyncio.sleep(0.5)
-                    except Exception as e:
-                        await Logger.log_async(f"An error occurred during session closing: {e}; {traceback.format_exc()}", "error") 
-                    self.session = None
-                
-                return
+        if self.session is None:
+            return
 
+        if send_shutdown_paylod:
             if url is None:
                 await Logger.log_async("url cannot be none during session cleanup, aborting...", 'warn')
                 return
@@ -43,54 +40,38 @@ class SessionManager:
             except Exception as e:
                 await Logger.log_async(f"An error occurred during session cleanup: {e}; {traceback.format_exc()}", "error")
 
-            await asyncio.sleep(1.5) 
-            try:
-                await self.session.close()
-            except Exception as e:
-                await Logger.log_async(f"An error occurred during session cleanup: {e}; {traceback.format_exc()}", "error")
-
-        if set_session_to_None and (self.session and (not self.session.closed)):
-            try:
-                await self.session.close()
-                await asyncio.sleep(0.5)
-            except Exception as e:
-                await Logger.log_async(f"An error occurred during session closing: {e}; {traceback.format_exc()}", "error") 
-            self.session = None
+        self.release()
 
     async def wait_until_ready(self, url: str, timeout: int = 30):
         await Logger.log_async(f"Waiting for {self.model_name} on {url}...", "info")
-        try:
-            check_session = self.session if self.session and not self.session.closed else aiohttp.ClientSession()
-            for i in range(timeout):
-                try:
-                    async with check_session.get(f"{url}/api/tags") as res:
-                        if res.status == 200:
-                            await Logger.log_async(f"{self.model_name} is alive! Testing response...", "success")
-                            js = await res.json(encoding='utf-8')
-                            models = [m['name'] for m in js.get("models", [])]
-                            if self.model_name in models or f'{self.model_name}:latest' in models:
-                                    
-                                await Logger.log_async(f'{self.model_name} is online!', 'info')
-                                return
-                            else:
-                                await Logger.log_async(f"Model not found in the HTTP model library! Avaliable models: {', '.join(models)}", 'warn')
-                                raise ModuleNotFoundError("Model not found in the HTTP model library")
-                            
+        check_session = self.session if self.session and not self.session.closed else ConnectionPool.get_session(url)
+        for i in range(timeout):
+            try:
+                async with check_session.get(f"{url}/api/tags") as res:
+                    if res.status == 200:
+                        await Logger.log_async(f"{self.model_name} is alive! Testing response...", "success")
+                        js = await res.json(encoding='utf-8')
+                        models = [m['name'] for m in js.get("models", [])]
+                        if self.model_name in models or f'{self.model_name}:latest' in models:
                                 
-                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-                    await Logger.log_async(f"Retries: {i+1} / {timeout}", "info")
-                await asyncio.sleep(1)
-            raise TimeoutError(f"🟥 Ollama server for {self.model_name} did not start in time.")
-        finally:
-            if check_session is not self.session:
-                await check_session.close()
+                            await Logger.log_async(f'{self.model_name} is online!', 'info')
+                            return
+                        else:
+                            await Logger.log_async(f"Model not found in the HTTP model library! Avaliable models: {', '.join(models)}", 'warn')
+                            raise ModuleNotFoundError("Model not found in the HTTP model library")
+                        
+                            
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                await Logger.log_async(f"Retries: {i+1} / {timeout}", "info")
+            await asyncio.sleep(1)
+        raise TimeoutError(f"🟥 Ollama server for {self.model_name} did not start in time.")
 
 class ResourceManager(SessionManager):
-    def __init__(self, ref_name) -> None:
+    def __init__(self, ref_name, host: str | None = None) -> None:
         self.ref_name = ref_name
         self.process = None
         self._log_file = None
-        super().__init__(self.ref_name)
+        super().__init__(self.ref_name, host)
 
     def create_process(self, command, env):
         try:
@@ -6,6 +6,7 @@ from .models.ollama_models import DOWN
 from .models.model_instance import LocalModel
 from .models.models_profile import RemoteModel
 from .models.openrouter_model import OpenRouterModel
+from .scheduler import admit, ROUTER
 
 class Router:
     def __init__(self, model: RemoteModel | LocalModel | OpenRouterModel | None, fallback_role, *available_roles, manual_prefix="!", auto_warmup=False):
@@ -55,12 +56,13 @@ class Router:
                 raise Exception("No role provided for router")
 
             try:
-                async for _, part, _ in self.model.generate(query=query, context=context, stream=False, format_ = self.format, tools_override=[]):
-                    if part == ERROR_TOKEN:
-                        await Logger.log_async("Router API call failed. Falling back to default role.", "error")
-                        return query, self.fallback_role
-                    if part:
-                        router_resp_parts.append(part)
+                async with admit(self.model, ROUTER):
+                    async for _, part, _ in self.model.generate(query=query, context=context, stream=False, format_ = self.format, tools_override=[]):
+                        if part == ERROR_TOKEN:
+                            await Logger.log_async("Router API call failed. Falling back to default role.", "error")
+                            return query, self.fallback_role
+                        if part:
+                            router_resp_parts.append(part)
             except Exception as e:
                 await Logger.log_async(f"Exception during routing: {e}; {traceback.format_exc()}", "error")
                 return query, self.fallback_role
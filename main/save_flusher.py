@@ -0,0 +1,122 @@
+from .configs import SAVE_WINDOW_SECONDS, SAVE_MAX_DELAY_SECONDS, SAVE_CONCURRENCY
+from .utils import Logger
+import asyncio
+import time
+import traceback
+
+class SaveFlusher:
+    '''
+    Write-behind saving of conversations.
+
+    `mark(cid)` only records that a conversation has unsaved changes. It is saved once no change came for `window_seconds`, or
+    `max_delay_seconds` after its first unsaved change, so a turn, its background summary and a rename in quick succession cost
+    one write. Up to `concurrency` conversations are saved at the same time; `save(cid)` does the work (for conversations that is
+    `Conversation.save`, which serialises and writes atomically in a thread).
+
+    `flush()` saves everything pending right away. A crash loses at most the changes of the last window.
+    '''
+    def __init__(self, save, window_seconds = SAVE_WINDOW_SECONDS, max_delay_seconds = SAVE_MAX_DELAY_SECONDS,
+                 concurrency = SAVE_CONCURRENCY) -> None:
+        self.save = save
+        self.window_seconds = window_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending: dict[str, tuple[float, float]] = {} # cid -> (first, last) change time
+        self.saving: set[asyncio.Task] = set()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.stats = {"marks": 0, "saves": 0, "failures": 0, "flushes": 0, "last_save_seconds": 0.0, "max_save_seconds": 0.0,
+                      "last_lag_seconds": 0.0, "max_lag_seconds": 0.0, "last_flush_seconds": 0.0}
+
+    def mark(self, cid: str):
+        now = time.monotonic()
+        first = self.pending[cid][0] if cid in self.pending else now
+        self.pending[cid] = (first, now)
+        self.stats["marks"] += 1
+        self.wakeup.set()
+        self._ensure_running()
+
+    def cancel(self, cid: str) -> bool:
+        '''Drops the pending save of `cid` (e.g. a deleted conversation). Returns whether there was one.'''
+        return self.pending.pop(cid, None) is not None
+
+    def _ensure_running(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def _due(self, now: float) -> tuple[list[str], float]:
+        '''The conversations that are due, and the seconds until the next one will be.'''
+        due = []
+        wait = self.max_delay_seconds
+        for cid, (first, last) in self.pending.items():
+            at = min(last + self.window_seconds, first + self.max_delay_seconds)
+            if at <= now:
+                due.append(cid)
+            else:
+                wait = min(wait, at - now)
+        return due, wait
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            due, wait = self._due(time.monotonic())
+            for cid in due:
+                self._start(cid)
+            if not due:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _start(self, cid: str):
+        first, _ = self.pending.pop(cid)
+        task = asyncio.create_task(self._save_one(cid, first))
+        self.saving.add(task)
+        task.add_done_callback(self.saving.discard)
+
+    async def _save_one(self, cid: str, first: float):
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                await self.save(cid)
+            except Exception as e:
+                self.stats["failures"] += 1
+                await Logger.log_async(f"Saving {cid} failed: {e}; {traceback.format_exc()}", 'error')
+            else:
+                self.stats["saves"] += 1
+            finally:
+                took = time.perf_counter() - start
+                lag = time.monotonic() - first
+                self.stats["last_save_seconds"] = took
+                self.stats["max_save_seconds"] = max(self.stats["max_save_seconds"], took)
+                self.stats["last_lag_seconds"] = lag
+                self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], lag)
+
+    async def flush(self):
+        '''Saves every pending conversation now (`concurrency` at a time) and waits for all saves in progress.'''
+        start = time.perf_counter()
+        while self.pending or self.saving:
+            for cid in list(self.pending):
+                self._start(cid)
+            await asyncio.gather(*self.saving)
+        self.stats["flushes"] += 1
+        self.stats["last_flush_seconds"] = time.perf_counter() - start
+
+    async def close(self):
+        '''Stops the timer and saves whatever is still pending.'''
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def metrics(self):
+        return {**self.stats, "dirty": len(self.pending), "saving": len(self.saving)}
\ No newline at end of file
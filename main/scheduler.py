@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from .utils import Logger
+from .events import EventBus
+from .http_pool import ConnectionPool, LOCAL
+from .configs import SCHEDULER_MAX_QUEUE, SCHEDULER_DEFAULT_PARALLEL, SCHEDULER_REMOTE_PARALLEL
+
+ROUTER = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {ROUTER: "router", INTERACTIVE: "interactive", BACKGROUND: "background"}
+ROLE_PRIORITIES = {"router": ROUTER, "summariser": BACKGROUND, "summarizer": BACKGROUND}
+
+class AdmissionQueueFull(Exception):
+    pass
+
+def priority_for_role(role):
+    return ROLE_PRIORITIES.get(role, INTERACTIVE)
+
+class ModelQueue:
+    '''
+    Admission gate in front of a single model. At most `limit` generations run at once, the rest wait in a bounded priority queue
+    (lower priority value first, FIFO within a class). Waiting generations that get cancelled leave the queue without taking a slot.
+    '''
+    def __init__(self, name: str, limit: int, max_queue: int, event_bus: None | EventBus = None) -> None:
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.event_bus = event_bus
+        self.active = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "cancelled": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        self.per_priority = {p: {"admitted": 0, "wait_seconds": 0.0} for p in PRIORITY_NAMES}
+
+    @property
+    def depth(self):
+        return sum(1 for *_, f in self.waiters if not f.done())
+
+    def _wake_next(self):
+        while self.waiters and self.active < self.limit:
+            _, _, fut = heapq.heappop(self.waiters)
+            if fut.done():
+                continue
+            self.active += 1
+            fut.set_result(True)
+
+    def _record(self, priority, waited):
+        self.stats["admitted"] += 1
+        self.stats["wait_seconds"] += waited
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+        p = self.per_priority.setdefault(priority, {"admitted": 0, "wait_seconds": 0.0})
+        p["admitted"] += 1
+        p["wait_seconds"] += waited
+
+    async def acquire(self, priority = INTERACTIVE):
+        if self.active < self.limit and not self.depth:
+            self.active += 1
+            self._record(priority, 0.0)
+            return
+
+        if self.depth >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise AdmissionQueueFull(f"{self.name}: admission queue is full ({self.max_queue} waiting)")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), fut))
+        self.stats["queued"] += 1
+        start = time.perf_counter()
+        if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.GENERATION_QUEUED, False, model = self.name,
+                                                              priority = PRIORITY_NAMES.get(priority, priority), depth = self.depth)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        self._record(priority, time.perf_counter() - start)
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+        self._wake_next()
+
+    def metrics(self):
+        admitted = self.stats["admitted"]
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "depth": self.depth,
+            "max_queue": self.max_queue,
+            **self.stats,
+            "avg_wait_seconds": self.stats["wait_seconds"] / admitted if admitted else 0.0,
+            "by_priority": {PRIORITY_NAMES.get(p, str(p)): dict(v) for p, v in self.per_priority.items()},
+        }
+
+class AdmissionScheduler:
+    '''
+    Hands out a `ModelQueue` per model. Local Ollama models get a concurrency limit matching the server's `OLLAMA_NUM_PARALLEL`
+    (`SCHEDULER_DEFAULT_PARALLEL` when unset), remote APIs get `SCHEDULER_REMOTE_PARALLEL`.
+    '''
+    def __init__(self, max_queue = SCHEDULER_MAX_QUEUE, event_bus: None | EventBus = None) -> None:
+        self.max_queue = max_queue
+        self.event_bus = event_bus
+        self.queues: dict[str, ModelQueue] = {}
+
+    def _limit_for(self, model):
+        if ConnectionPool.pool_for(model.host) != LOCAL:
+            return SCHEDULER_REMOTE_PARALLEL
+        env = getattr(model, "ollama_env", None) or os.environ
+        value = env.get("OLLAMA_NUM_PARALLEL")
+        if value:
+            try:
+                return int(value)
+            except ValueError:
+                Logger.log_sync(f"Ignoring invalid OLLAMA_NUM_PARALLEL={value!r} for {model.name}", 'warn')
+        return SCHEDULER_DEFAULT_PARALLEL
+
+    def register(self, model, limit: int | None = None) -> ModelQueue:
+        queue = ModelQueue(f"{model.name} ({model.role})", limit or self._limit_for(model), self.max_queue, self.event_bus)
+        self.queues[model.role] = queue
+        model.admission = queue
+        return queue
+
+    def metrics(self):
+        return {role: q.metrics() for role, q in self.queues.items()}
+
+@asynccontextmanager
+async def admit(model, priority = INTERACTIVE):
+    '''Holds one of `model`'s generation slots for the duration of the block. Models without a queue are admitted immediately.'''
+    queue: ModelQueue | None = getattr(model, "admission", None)
+    if queue is None:
+        yield
+        return
+    await queue.acquire(priority)
+    try:
+        yield
+    finally:
+        queue.release()
@@ -0,0 +1,134 @@
+import json
+from typing import Any, Callable, Literal
+
+try:
+    import orjson # optional, noticeably faster on the token stream
+except ImportError:
+    orjson = None
+
+NDJSON = "ndjson"
+SSE = "sse"
+
+_SSE_DATA = b"data:"
+_SSE_DONE = b"[DONE]"
+
+_json_decode = json.JSONDecoder().decode
+
+def _json_loads(raw: memoryview):
+    return _json_decode(str(raw, "utf-8", "ignore"))
+
+def _orjson_loads(raw: memoryview):
+    return orjson.loads(raw) # type: ignore
+
+_default_loads: Callable[[memoryview], Any] = _orjson_loads if orjson is not None else _json_loads
+
+def set_json_decoder(loads: Callable[[memoryview], Any] | None):
+    '''
+    Swaps the process wide decoder used by every `StreamDecoder` created without an explicit `loads`.
+    `loads` receives a memoryview over the line, pass `None` to restore the default (orjson when installed).
+    '''
+    global _default_loads
+    if loads is None:
+        _default_loads = _orjson_loads if orjson is not None else _json_loads
+    else:
+        _default_loads = loads
+
+def get_json_decoder():
+    return _default_loads
+
+class StreamDecoder:
+    '''
+    Incremental line decoder for Ollama NDJSON (`framing="ndjson"`) and OpenRouter SSE (`framing="sse"`) bodies.
+
+    Raw network chunks are appended to a single `bytearray`, newlines are searched only in the bytes that haven't been scanned yet
+    and every complete line is handed to the JSON decoder as a memoryview, so the buffer is never decoded to `str` or re-split.
+    Lines that fail to parse are skipped, same as the old per-call-site loops.
+    '''
+    def __init__(self, framing: Literal['ndjson', 'sse'] = NDJSON, loads: Callable[[memoryview], Any] | None = None) -> None:
+        if framing not in (NDJSON, SSE):
+            raise ValueError(f"Unknown stream framing: {framing}")
+        self.framing = framing
+        self.loads = loads
+        self.buffer = bytearray()
+        self._scan = 0
+        self.done = False
+        self.lines = 0
+        self.skipped = 0
+
+    def _parse(self, view: memoryview, start: int, end: int):
+        buf = self.buffer
+        if end > start and buf[end - 1] == 0x0D: # '\r'
+            end -= 1
+        if start == end:
+            return None
+
+        if self.framing == SSE:
+            if buf.startswith(_SSE_DATA, start, end):
+                start += len(_SSE_DATA)
+                if start < end and buf[start] == 0x20:
+                    start += 1
+                if end - start == len(_SSE_DONE) and buf.startswith(_SSE_DONE, start, end):
+                    self.done = True
+                    return None
+            elif buf[start] == 0x3A: # ':' comment / keep-alive
+                return None
+
+        self.lines += 1
+        try:
+            return (self.loads or _default_loads)(view[start:end])
+        except ValueError:
+            self.skipped += 1
+            return None
+
+    def feed(self, data: bytes | bytearray | memoryview) -> list:
+        if self.done:
+            return []
+
+        buf = self.buffer
+        buf += data
+        out = []
+        start = 0
+        find = buf.find
+
+        with memoryview(buf) as view:
+            while not self.done:
+                nl = find(b"\n", self._scan)
+                if nl == -1:
+                    self._scan = len(buf)
+                    break
+                obj = self._parse(view, start, nl)
+                if obj is not None:
+                    out.append(obj)
+                start = nl + 1
+                self._scan = start
+
+        if start:
+            del buf[:start]
+            self._scan -= start
+        if self.done:
+            buf.clear()
+            self._scan = 0
+        return out
+
+    def flush(self) -> list:
+        '''Parses whatever is left in the buffer, for bodies that don't end with a newline.'''
+        if self.done or not self.buffer:
+            self.buffer.clear()
+            self._scan = 0
+            return []
+        with memoryview(self.buffer) as view:
+            obj = self._parse(view, 0, len(self.buffer))
+        self.buffer.clear()
+        self._scan = 0
+        return [obj] if obj is not None else []
+
+async def iter_stream(content, framing: Literal['ndjson', 'sse'] = NDJSON, loads: Callable[[memoryview], Any] | None = None):
+    '''Yields decoded objects from an `aiohttp.StreamReader` (`response.content`).'''
+    decoder = StreamDecoder(framing, loads)
+    async for raw_chunk in content.iter_any():
+        for obj in decoder.feed(raw_chunk):
+            yield obj
+        if decoder.done:
+            return
+    for obj in decoder.flush():
+        yield obj
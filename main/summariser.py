@@ -2,17 +2,61 @@ from .models.model_instance import LocalModel
 from .models.ollama_models import DOWN
 from .models.models_profile import RemoteModel
 from .models.openrouter_model import OpenRouterModel
-from .configs import ERROR_TOKEN, SUMMARIZER_PROMPT
+from .configs import ERROR_TOKEN, SUMMARIZER_PROMPT, SUMMARY_HIERARCHICAL, SUMMARY_MAP_CONCURRENCY
 from .utils import Logger, estimate_tokens
 import traceback
 import re
 import json
+import asyncio
 from .events import EventBus
+from .scheduler import admit, BACKGROUND
 
 TURNS_TO_MSG_MULTIPLIER = 2.5
 
+def extract_json_payload(raw_text):
+    start = raw_text.find('{')
+    if start == -1:
+        return None
+    stack = []
+    for idx, ch in enumerate(raw_text[start:], start):
+        if ch == '{':
+            stack.append('{')
+        elif ch == '}':
+            if stack:
+                stack.pop()
+                if not stack:
+                    return raw_text[start:idx + 1]
+    return None
+
+def safe_json_load(raw_text):
+    try:
+        return json.loads(raw_text)
+    except json.JSONDecodeError:
+        payload = extract_json_payload(raw_text)
+        if not payload:
+            return None
+        try:
+            return json.loads(payload)
+        except json.JSONDecodeError:
+            normalized = re.sub(r",\s*([\]}])", r"\1", payload)
+            try:
+                return json.loads(normalized)
+            except json.JSONDecodeError:
+                return None
+
+def parse_entry(entry: str):
+    entry = re.sub(r"```json\n?|```", "", entry).strip().replace("\n\n\n\n", "\n")
+    return safe_json_load(entry)
+
+CONVERSATION_INTRO = "(user/assistant messages below are the ONLY new information)\nOutput ONLY the updated summary and facts text / array. No commentary."
+PARTS_INTRO = ("(the partial summaries below cover consecutive parts of the new conversation, oldest first, and are the ONLY new information)\n"
+               "Merge them into one summary, facts, key decisions and open threads: keep every distinct detail, deduplicate, and drop threads "
+               "a later part resolved. Output ONLY the merged summary and facts text / array. No commentary.")
+
 class Summariser:
-    def __init__(self, model:RemoteModel | LocalModel | OpenRouterModel | None,  summary_max_tokens, summary_keep_tokens_after, min_recent_turns, trim_turn_num = 3, event_bus : None | EventBus = None) -> None:
+    def __init__(self, model:RemoteModel | LocalModel | OpenRouterModel | None,  summary_max_tokens, summary_keep_tokens_after, min_recent_turns, trim_turn_num = 3, event_bus : None | EventBus = None,
+                 hierarchical = SUMMARY_HIERARCHICAL) -> None:
+        self.hierarchical = hierarchical
         self.summary_max_tokens = summary_max_tokens
         self.summary_keep_tokens_after = summary_keep_tokens_after
         self.min_recent_msgs = round(min_recent_turns * TURNS_TO_MSG_MULTIPLIER)
@@ -49,6 +93,128 @@ class Summariser:
         
         self.event_bus = event_bus
 
+    def convo_tokens(self, convo) -> float:
+        return sum(estimate_tokens(f"<{t['role']}> {t['content']} </{t['role']}>") for t in convo)
+
+    def split_windows(self, convo, budget) -> list[list]:
+        '''Consecutive runs of `convo` that fit `budget` tokens each (as counted by `build_convo_text`). A bigger message gets a window to itself.'''
+        windows, current, used = [], [], 0
+        for t in convo:
+            n = estimate_tokens(f"<{t['role']}> {t['content']} </{t['role']}>")
+            if current and used + n > budget:
+                windows.append(current)
+                current, used = [], 0
+            current.append(t)
+            used += n
+        if current:
+            windows.append(current)
+        return windows
+
+    def build_prompt(self, text, prev_summary = None, prev_facts = None, prev_open_threads = None, prev_key_decisions = None,
+                     intro = CONVERSATION_INTRO, tag = "NEW_CONVERSATION"):
+        text = f"""{intro}
+            <{tag}>
+                {text}
+            </{tag}>"""  
+
+        if prev_summary: text = f"""Below is the previous rolling summary of the conversation.\nIt represents persisted memory. 
+            Treat this as a lossy compression of the earlier conversation window.
+            Update it ONLY if the new conversation content adds facts or contradicts it. If nothing changes, reproduce it verbatim.
+            
+            <PREVIOUS_SUMMARY>
+                {prev_summary}
+            </PREVIOUS_SUMMARY>""" + text  
+
+
+        if prev_facts: text = f"Below are the previous facts extracted from the previous conversation turns. Change the facts only when explicitly contradicted or explicitly stated to forget. Do NOT invent facts or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge facts only when they explicitly overlap.\n<PREVIOUS_FACTS>\n{"\n".join(prev_facts)}\n</PREVIOUS_FACTS>".strip() + text
+            
+        if prev_open_threads:
+            text = f"Below are the previous open threads extracted from the previous conversation turns. Change the open threads only when explicitly contradicted or explicitly stated to forget. Do NOT invent threads or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge threads only when they explicitly overlap\n<THREADS>\n{"\n".join(prev_open_threads)}\n<THREADS>".strip() + text
+
+        if prev_key_decisions:
+            text = f"Below are the previous key decisions extracted from the previous conversation turns. Change the key decisions only when explicitly contradicted or explicitly stated to forget. Do NOT invent key decisions or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge decisions only when they explicitly overlap\n<DECISIONS>\n{"\n".join(prev_key_decisions)}\n<DECISIONS>".strip() + text
+
+
+        text += ("\n\nPrefer recent evidence (conversation) over prior system generated summary / facts / open threads / key decisions. \n"
+        "If nothing changes, preserve it verbatim, don't say 'Orginal summary / facts / open threads / key decisions unchanged.' produce it as is (1:1) verbatim.")
+
+        return text
+
+    async def generate(self, text, system):
+        '''One summariser call, returns the raw output or None.'''
+        entry = None  
+        try:
+            async with admit(self.model, BACKGROUND):
+                async for (_, out, _ )in self.model.generate(text, [], stream=False, system_prompt_override=system, format_=self.format):  
+                    if out != ERROR_TOKEN and (out and isinstance(out, str) and out.strip()):
+                        entry = out
+
+        except Exception as e:  
+            await Logger.log_async(f"Error during summarization: {e}; {traceback.format_exc()}", "error")
+            if self.event_bus:
+                await self.event_bus.sequence_emit(self.event_bus.SUMMARISING_FAILED, error=str(e))
+        return entry
+
+    def map_concurrency(self):
+        '''Windows summarised at once: the summariser model's admission limit, so the map step never queues behind itself.'''
+        queue = getattr(self.model, "admission", None)
+        return max(1, queue.limit if queue is not None else SUMMARY_MAP_CONCURRENCY)
+
+    def render_parts(self, parts: list[dict]):
+        out = []
+        for i, p in enumerate(parts, 1):
+            text = f"<PART {i}>\nSummary: {p.get('summary') or ''}\n"
+            for label, key in (("Facts", "facts"), ("Key decisions", "key_decisions"), ("Open threads", "open_threads")):
+                items = [str(x) for x in p.get(key) or []]
+                if items:
+                    text += f"{label}:\n" + "\n".join(f"- {x}" for x in items) + "\n"
+            out.append(text + f"</PART {i}>")
+        return "\n".join(out)
+
+    async def summarise_windows(self, convo, budget, system, prev_summary = None, prev_facts = None, prev_open_threads = None,
+                                prev_key_decisions = None) -> dict | None:
+        '''
+        Hierarchical summary of a backlog longer than `budget`. Map: every budget sized window of `convo` is summarised on its own,
+        `map_concurrency()` at a time. Reduce: the partial results are merged (in groups that fit `budget`, repeated until one group
+        is left), the last merge also folding in the previous summary, facts, decisions and threads. Returns the merged result, or
+        None if any call failed, in which case nothing should be dropped.
+        '''
+        semaphore = asyncio.Semaphore(self.map_concurrency())
+
+        async def run(text):
+            async with semaphore:
+                entry = await self.generate(text, system)
+            obj = parse_entry(entry) if entry else None
+            return obj if isinstance(obj, dict) else None
+
+        windows = self.split_windows(convo, budget)
+        await Logger.log_async(f"Summarising {len(convo)} messages in {len(windows)} windows", 'info')
+        parts = await asyncio.gather(*(run(self.build_prompt(self.build_convo_text("\n", w, float("inf")))) for w in windows))
+
+        while True:
+            if not all(parts):
+                await Logger.log_async(f"{parts.count(None)} of {len(parts)} summary windows failed, keeping the conversation as is", 'warn')
+                if self.event_bus:
+                    await self.event_bus.sequence_emit(self.event_bus.SUMMARISING_FAILED, error="Summary window failed")
+                return None
+
+            groups, current = [], []
+            for p in parts:
+                if current and estimate_tokens(self.render_parts(current + [p])) > budget:
+                    groups.append(current)
+                    current = []
+                current.append(p)
+            groups.append(current)
+
+            if len(groups) == 1 or len(groups) == len(parts):
+                break
+            parts = await asyncio.gather(*(run(self.build_prompt(self.render_parts(g), intro=PARTS_INTRO, tag="PARTIAL_SUMMARIES"))
+                                           for g in groups))
+
+        text = self.build_prompt(self.render_parts(parts), prev_summary, prev_facts, prev_open_threads, prev_key_decisions,
+                                 intro=PARTS_INTRO, tag="PARTIAL_SUMMARIES")
+        return await run(text)
+
     def build_convo_text(self, text, convo:list[dict], chunk_budget):
         text = text
 
@@ -79,7 +245,13 @@ class Summariser:
 
         return text
 
-    async def maybe_summarise_context(self, context, prev_meta = {}, summary_system_prompt = SUMMARIZER_PROMPT, auto_warm_up = False):
+    async def maybe_summarise_context(self, context, prev_meta = {}, summary_system_prompt = SUMMARIZER_PROMPT, auto_warm_up = False,
+                                      tokens: float | None = None):
+        '''
+        Summarises the older part of `context` once it (with the previous summary, facts, decisions and threads) reaches
+        `summary_max_tokens`. `tokens` is that total when the caller keeps count (see `Conversation.token_count`), otherwise it
+        is estimated here. Returns the new meta and the messages to keep.
+        '''
         if auto_warm_up and self.model and self.model.state == DOWN: 
             await self.model.warm_up()
         
@@ -102,13 +274,16 @@ class Summariser:
 
             return meta, context
         
-        contents = [x.get("content", "").strip() for x in context if x.get("content")]
-        if prev_summary: contents.append(prev_summary)
-        if prev_facts: contents.extend(prev_facts)
-        if prev_open_threads: contents.extend(prev_open_threads)
-        if prev_key_decisions: contents.extend(prev_key_decisions)
+        if tokens is not None:
+            est = tokens
+        else:
+            contents = [x.get("content", "").strip() for x in context if x.get("content")]
+            if prev_summary: contents.append(prev_summary)
+            if prev_facts: contents.extend(prev_facts)
+            if prev_open_threads: contents.extend(prev_open_threads)
+            if prev_key_decisions: contents.extend(prev_key_decisions)
 
-        est = estimate_tokens(" ".join(contents))
+            est = estimate_tokens(" ".join(contents))
 
         if est >= self.summary_max_tokens:  
             text = '\n'
@@ -140,41 +315,14 @@ class Summariser:
 
                 return meta, context
 
-            text = self.build_convo_text(text, summarize_part, chunk_budget)
+            # a backlog longer than one window is summarised window by window and merged, instead of cutting it to the first window
+            hierarchical = self.hierarchical and self.convo_tokens(summarize_part) > chunk_budget
 
             if self.event_bus:
                 await self.event_bus.sequence_emit(self.event_bus.SUMMARISING)
                 
             await Logger.log_async("Summarising started", 'info')
 
-            est = round(estimate_tokens(text))
-
-            await Logger.log_async(f"Estimated tokens of the convo: {est}",'info')
-
-            if est >= self.summary_max_tokens * 3:
-                await Logger.log_async(f"Conversation too big, trimming the oldest {self.trim_turn_num} messages", 'warn')
-                if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.WARN, msg = f"Conversation too big, trimming the oldest {self.trim_turn_num} messages")
-
-                summarize_part = summarize_part[self.trim_turn_num:]
-
-                if not summarize_part:
-                    meta = {
-                    'facts': prev_facts,
-                    'summary': prev_summary,
-                    'open_threads': prev_open_threads,
-                    'key_decisions': prev_key_decisions
-                    }
-
-                    return meta, context
-
-                text = self.build_convo_text(text, summarize_part, chunk_budget)
-
-                to_keep = to_keep[self.trim_turn_num:]
-
-            text = f"""(user/assistant messages below are the ONLY new information)\nOutput ONLY the updated summary and facts text / array. No commentary.
-            <NEW_CONVERSATION>
-                {text}
-            </NEW_CONVERSATION>"""  
             system = self.model.system or summary_system_prompt or ( 
             "This is a conversation Logger.log_async. Produce a factual, neutral summary.\n"
             "Your only job: summarize.\n"
@@ -183,78 +331,47 @@ class Summariser:
             "DO NOT INVENT CONTEXT. TREAT THE GIVEN CONTEXT AS GROUND TRUTH."
             )
 
-            if prev_summary: text = f"""Below is the previous rolling summary of the conversation.\nIt represents persisted memory. 
-            Treat this as a lossy compression of the earlier conversation window.
-            Update it ONLY if the new conversation content adds facts or contradicts it. If nothing changes, reproduce it verbatim.
-            
-            <PREVIOUS_SUMMARY>
-                {prev_summary}
-            </PREVIOUS_SUMMARY>""" + text  
+            entry_obj = None
+            if hierarchical:
+                entry = entry_obj = await self.summarise_windows(summarize_part, chunk_budget, system, prev_summary, prev_facts,
+                                                                 prev_open_threads, prev_key_decisions)
+            else:
+                text = self.build_convo_text(text, summarize_part, chunk_budget)
 
+                est = round(estimate_tokens(text))
 
-            if prev_facts: text = f"Below are the previous facts extracted from the previous conversation turns. Change the facts only when explicitly contradicted or explicitly stated to forget. Do NOT invent facts or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge facts only when they explicitly overlap.\n<PREVIOUS_FACTS>\n{"\n".join(prev_facts)}\n</PREVIOUS_FACTS>".strip() + text
-            
-            if prev_open_threads:
-                text = f"Below are the previous open threads extracted from the previous conversation turns. Change the open threads only when explicitly contradicted or explicitly stated to forget. Do NOT invent threads or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge threads only when they explicitly overlap\n<THREADS>\n{"\n".join(prev_open_threads)}\n<THREADS>".strip() + text
+                await Logger.log_async(f"Estimated tokens of the convo: {est}",'info')
 
-            if prev_key_decisions:
-                text = f"Below are the previous key decisions extracted from the previous conversation turns. Change the key decisions only when explicitly contradicted or explicitly stated to forget. Do NOT invent key decisions or context. treat the given conversation aa ground truth.\n Never invent or assume context unless provided in the previous lossy summary or the provided conversation. You're allowed to merge decisions only when they explicitly overlap\n<DECISIONS>\n{"\n".join(prev_key_decisions)}\n<DECISIONS>".strip() + text
+                if est >= self.summary_max_tokens * 3:
+                    await Logger.log_async(f"Conversation too big, trimming the oldest {self.trim_turn_num} messages", 'warn')
+                    if self.event_bus: await self.event_bus.parallel_emit(self.event_bus.WARN, msg = f"Conversation too big, trimming the oldest {self.trim_turn_num} messages")
 
+                    summarize_part = summarize_part[self.trim_turn_num:]
 
-            text += ("\n\nPrefer recent evidence (conversation) over prior system generated summary / facts / open threads / key decisions. \n"
-            "If nothing changes, preserve it verbatim, don't say 'Orginal summary / facts / open threads / key decisions unchanged.' produce it as is (1:1) verbatim.")
+                    if not summarize_part:
+                        meta = {
+                        'facts': prev_facts,
+                        'summary': prev_summary,
+                        'open_threads': prev_open_threads,
+                        'key_decisions': prev_key_decisions
+                        }
 
-            entry = None  
-            try:
-                async for (_, out, _ )in self.model.generate(text, [], stream=False, system_prompt_override=system, format_=self.format):  
-                    if out != ERROR_TOKEN and (out and isinstance(out, str) and out.strip()):
-                        entry = out
+                        return meta, context
 
-            except Exception as e:  
-                await Logger.log_async(f"Error during summarization: {e}; {traceback.format_exc()}", "error")
-                if self.event_bus:
-                    await self.event_bus.sequence_emit(self.event_bus.SUMMARISING_FAILED, error=str(e))
+                    text = self.build_convo_text(text, summarize_part, chunk_budget)
+
+                    to_keep = to_keep[self.trim_turn_num:]
+
+                text = self.build_prompt(text, prev_summary, prev_facts, prev_open_threads, prev_key_decisions)
+                entry = await self.generate(text, system)
 
             summary = prev_summary
             facts = prev_facts
             key_decisions = prev_key_decisions or []
             open_threads = prev_open_threads or []
             if entry:
-                entry = re.sub(r"```json\n?|```", "", entry).strip().replace("\n\n\n\n", "\n")
-                entry_obj = None
-
-                def extract_json_payload(raw_text):
-                    start = raw_text.find('{')
-                    if start == -1:
-                        return None
-                    stack = []
-                    for idx, ch in enumerate(raw_text[start:], start):
-                        if ch == '{':
-                            stack.append('{')
-                        elif ch == '}':
-                            if stack:
-                                stack.pop()
-                                if not stack:
-                                    return raw_text[start:idx + 1]
-                    return None
-
-                def safe_json_load(raw_text):
-                    try:
-                        return json.loads(raw_text)
-                    except json.JSONDecodeError:
-                        payload = extract_json_payload(raw_text)
-                        if not payload:
-                            return None
-                        try:
-                            return json.loads(payload)
-                        except json.JSONDecodeError:
-                            normalized = re.sub(r",\s*([\]}])", r"\1", payload)
-                            try:
-                                return json.loads(normalized)
-                            except json.JSONDecodeError:
-                                return None
-
-                entry_obj = safe_json_load(entry)
+                if entry_obj is None:
+                    entry_obj = parse_entry(entry)
                 if not isinstance(entry_obj, dict):
                     await Logger.log_async("Summariser json failed", "warn")
                     await Logger.log_async(f"Raw output: {entry}", "warn")
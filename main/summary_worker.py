@@ -0,0 +1,119 @@
+from .configs import SUMMARY_DEBOUNCE_SECONDS, SUMMARY_MAX_DELAY_SECONDS
+from .utils import Logger
+import asyncio
+import time
+import traceback
+
+class SummaryWorker:
+    '''
+    Runs conversation summarisation in the background, off the response path.
+
+    `request(cid)` only records that a conversation changed. A conversation is summarised once no request for it arrived for
+    `debounce_seconds`, or its oldest pending request is `max_delay_seconds` old, so a burst of turns costs one summariser call.
+    Conversations are summarised one at a time; requests for the one being summarised stay pending for its next run.
+
+    `run(cid)` does the work and returns False when its result could not be applied because the conversation changed underneath
+    it, which queues that conversation again.
+    '''
+    def __init__(self, run, debounce_seconds = SUMMARY_DEBOUNCE_SECONDS, max_delay_seconds = SUMMARY_MAX_DELAY_SECONDS) -> None:
+        self.run = run
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.pending: dict[str, tuple[float, float]] = {} # cid -> (first, last) request time
+        self.running: str | None = None
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.task: asyncio.Task | None = None
+        self.stats = {"requests": 0, "runs": 0, "conflicts": 0, "failures": 0, "last_run_seconds": 0.0}
+
+    def request(self, cid: str):
+        now = time.monotonic()
+        first = self.pending[cid][0] if cid in self.pending else now
+        self.pending[cid] = (first, now)
+        self.stats["requests"] += 1
+        self.idle.clear()
+        self.wakeup.set()
+        self._ensure_running()
+
+    def cancel(self, cid: str):
+        '''Drops a pending request (e.g. for a deleted conversation).'''
+        self.pending.pop(cid, None)
+
+    def _ensure_running(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def _next_due(self, now: float) -> tuple[str | None, float]:
+        '''The first conversation that is due, or None and the seconds until one will be.'''
+        wait = self.max_delay_seconds
+        for cid, (first, last) in self.pending.items():
+            due = min(last + self.debounce_seconds, first + self.max_delay_seconds)
+            if due <= now:
+                return cid, 0
+            wait = min(wait, due - now)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self.idle.set()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            cid, wait = self._next_due(time.monotonic())
+            if cid is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_one(cid)
+
+    async def _run_one(self, cid: str):
+        self.pending.pop(cid, None)
+        self.running = cid
+        self.stats["runs"] += 1
+        start = time.perf_counter()
+        try:
+            applied = await self.run(cid)
+        except Exception as e:
+            self.stats["failures"] += 1
+            await Logger.log_async(f"Background summarisation of {cid} failed: {e}; {traceback.format_exc()}", 'error')
+        else:
+            if applied is False:
+                self.stats["conflicts"] += 1
+                if cid not in self.pending:
+                    now = time.monotonic()
+                    self.pending[cid] = (now, now)
+        finally:
+            self.running = None
+            self.stats["last_run_seconds"] = time.perf_counter() - start
+
+    async def flush(self):
+        '''Summarises every pending conversation right away, then waits until the worker is idle.'''
+        while self.pending:
+            now = time.monotonic()
+            for cid in list(self.pending):
+                self.pending[cid] = (now - self.max_delay_seconds, now - self.debounce_seconds)
+            self.wakeup.set()
+            self._ensure_running()
+            await self.idle.wait()
+
+    async def close(self):
+        '''Stops the worker. Pending and running summaries are dropped, they are requested again on the next turn.'''
+        self.pending.clear()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.idle.set()
+
+    def metrics(self):
+        return {**self.stats, "pending": len(self.pending), "running": self.running}
\ No newline at end of file
@@ -0,0 +1,88 @@
+from functools import lru_cache
+from typing import Callable
+
+try:
+    import tiktoken # optional, exact token counts for the `tokenizer="tiktoken:<encoding>"` mode
+except ImportError:
+    tiktoken = None
+
+def estimated_counter(text: str) -> float:
+    '''Same estimate as `utils.estimate_tokens`, unrounded so counts can be summed.'''
+    return len(text) / 3.5
+
+def make_token_counter(tokenizer = None, cache_size = 65536) -> Callable[[str], float]:
+    '''
+    Returns a cached per-unit token counter. `tokenizer` may be None (character estimate), a callable returning a count, an object with
+    an `encode` method (tiktoken / Hugging Face tokenizers) or `"tiktoken:<encoding name>"`.
+    '''
+    if tokenizer is None:
+        return estimated_counter
+
+    if isinstance(tokenizer, str):
+        if not tokenizer.startswith("tiktoken:"):
+            raise ValueError(f"Unknown tokenizer: {tokenizer}")
+        if tiktoken is None:
+            raise ImportError("tiktoken is not installed, install it or use the default estimate (tokenizer=None)")
+        tokenizer = tiktoken.get_encoding(tokenizer.split(":", 1)[1])
+
+    if hasattr(tokenizer, "encode"):
+        encode = tokenizer.encode
+        count = lambda s: len(encode(s))
+    elif callable(tokenizer):
+        count = tokenizer
+    else:
+        raise TypeError("tokenizer must be callable or have an `encode` method")
+
+    return lru_cache(maxsize=cache_size)(lambda s: float(count(s)))
+
+def message_text(message) -> str:
+    '''The text of a message that counts towards the context budget: its content, or the text parts of multimodal content.'''
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content.strip()
+    return " ".join(p.get("text", "") for p in content if isinstance(p, dict)).strip()
+
+class TokenLedger:
+    '''
+    Running token count of one conversation. Each message is counted once, when it's appended, and its count is kept in `counts`
+    (aligned with the conversation's messages), so the budget checks after a turn cost O(1) instead of a pass over the whole
+    conversation. Replacing the messages (summary, trim, edit) reuses the counts of the records that are kept.
+
+    The summary, facts, decisions and open threads are counted by `meta_tokens`, which recounts only when one of them was
+    replaced (they are compared by identity, lists are never modified in place).
+    '''
+    def __init__(self, counter: Callable[[str], float] | None = None) -> None:
+        self.counter = counter or estimated_counter
+        self.counts: list[float] = []
+        self.total = 0.0
+        self._meta_key = None
+        self._meta_total = 0.0
+
+    def count(self, message) -> float:
+        text = message_text(message)
+        return self.counter(text) if text else 0.0
+
+    def append(self, messages):
+        counts = [self.count(m) for m in messages]
+        self.counts.extend(counts)
+        self.total += sum(counts)
+
+    def replace(self, old, new):
+        '''Counts for `new`, with the counts of records also in `old` (the messages `counts` belongs to) reused.'''
+        known = {id(m): n for m, n in zip(old, self.counts)}
+        self.counts = [known[id(m)] if id(m) in known else self.count(m) for m in new]
+        self.total = sum(self.counts)
+
+    def clear(self):
+        self.counts = []
+        self.total = 0.0
+        self._meta_key = None
+        self._meta_total = 0.0
+
+    def meta_tokens(self, summary, facts, decisions, threads) -> float:
+        key = (summary, facts, decisions, threads)
+        if self._meta_key is None or any(a is not b for a, b in zip(key, self._meta_key)):
+            texts = [summary or "", *(facts or ()), *(decisions or ()), *(threads or ())]
+            self._meta_total = sum(self.counter(t.strip()) for t in texts if isinstance(t, str) and t.strip())
+            self._meta_key = key
+        return self._meta_total
\ No newline at end of file